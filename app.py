@@ -1,9 +1,16 @@
-from flask import Flask
+from flask import Flask, Response
 from src.controller.e_broker import broker_api
+from src.metrics import CONTENT_TYPE, REGISTRY
 
 app = Flask(__name__)
 
 app.register_blueprint(broker_api, url_prefix='/broker/api')
 
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype=None, content_type=CONTENT_TYPE)
+
+
 if __name__ == '__main__':
-    app.run(port=9010)
\ No newline at end of file
+    app.run(port=9010)
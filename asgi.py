@@ -0,0 +1,7 @@
+from src.controller.asgi_broker import BrokerASGIApp
+
+app = BrokerASGIApp()
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, port=9010)
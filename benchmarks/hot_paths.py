@@ -0,0 +1,187 @@
+"""
+Micro-benchmarks of the service and repository hot paths. Every operation is timed call by call against an in-memory,
+a shared-cache in-memory, a file backed and a sharded database and against the ledger engine, all seeded with the
+given num of users, each holding one position, and ops/sec and p50/p99 latency are reported.
+
+    python -m benchmarks.hot_paths --sizes 1000 100000 1000000
+    python -m benchmarks.hot_paths --save baseline.json
+    python -m benchmarks.hot_paths --compare baseline.json --threshold 0.2
+
+With --compare the run exits with status 1 when an operation got slower than the stored baseline by more than the
+threshold, either in ops/sec or in p99 latency.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from setup_db import create_connection, fill_generated_data
+from src.persistence.db import BrokingDB
+from src.persistence.in_memory import InMemoryDB
+from src.persistence.ledger import LedgerDB
+from src.persistence.shared_memory import SharedMemoryDB
+from src.persistence.sharded import ShardedDB
+from src.persistence.storage import get_repository_class
+from src.service.broking import BrokingService
+
+
+TIME_STAMP = '10/12/2021 16:00:01'
+NUM_OF_EQUITIES = 100
+BACKENDS = ('memory', 'shared_memory', 'file', 'ledger', 'sharded')
+NUM_OF_SHARDS = 4
+
+
+def seed(conn, num_of_users):
+    """
+    Fills the tables with num_of_users users, NUM_OF_EQUITIES equities and one position per user in equity_of(user id)
+    """
+    fill_generated_data(conn, num_of_users, NUM_OF_EQUITIES, num_of_users, balance=(10 ** 9, 10 ** 9),
+                        shares=(100, 100))
+
+
+def equity_of(user_id):
+    return 1 + user_id % NUM_OF_EQUITIES
+
+
+def create_db(backend, num_of_users):
+    if backend == 'memory':
+        db = InMemoryDB()
+        # tables and indexes are created by the generator, the index after the rows are loaded
+        seed(db.conn, num_of_users)
+        return db
+    database_file = os.path.join(tempfile.mkdtemp(), 'ebroker.db')
+    conn = create_connection(database_file, 'throughput')
+    seed(conn, num_of_users)
+    conn.close()
+    if backend == 'shared_memory':
+        return SharedMemoryDB(name=f'benchmark_{num_of_users}', seed_file=database_file, checkpoint_file=None)
+    if backend == 'ledger':
+        return LedgerDB(journal_file=os.path.join(os.path.dirname(database_file), 'ebroker.journal'),
+                        snapshot_file=None, seed_file=database_file, snapshot_every=0)
+    if backend == 'sharded':
+        return ShardedDB([os.path.join(os.path.dirname(database_file), f'ebroker.shard{index}.db')
+                          for index in range(NUM_OF_SHARDS)], seed_file=database_file, pool_size=1)
+    return BrokingDB(database_file, pool_size=1)
+
+
+def operations(db):
+    """
+    Returns name to callable taking a user id of every benchmarked operation
+    """
+    service = BrokingService(db)
+    users = get_repository_class('user', db)(db)
+    equities = get_repository_class('equity', db)(db)
+    positions = get_repository_class('user_equity_map', db)(db)
+
+    def buy_then_sell(user_id):
+        service.buy_an_equity(user_id, equity_of(user_id), 1, TIME_STAMP)
+        service.sell_an_equity(user_id, equity_of(user_id), 1, TIME_STAMP)
+    return {
+        'service.buy_an_equity': lambda user_id: service.buy_an_equity(user_id, equity_of(user_id), 1, TIME_STAMP),
+        'service.sell_an_equity': lambda user_id: service.sell_an_equity(user_id, equity_of(user_id), 1, TIME_STAMP),
+        'service.buy_then_sell': buy_then_sell,
+        'service.add_fund': lambda user_id: service.add_fund(user_id, 1),
+        'service.get_balance': service.get_balance,
+        'service.get_portfolio': service.get_portfolio,
+        'repository.get_user': users.get_user,
+        'repository.get_equity': lambda user_id: equities.get_equity(equity_of(user_id)),
+        'repository.get_position': lambda user_id: positions.get_position(user_id, equity_of(user_id)),
+        'repository.debit_balance': lambda user_id: users.debit_balance(user_id, 1),
+        'repository.upsert_position': lambda user_id: positions.upsert_position(user_id, equity_of(user_id), 1),
+    }
+
+
+def percentile(sorted_latencies, fraction):
+    return sorted_latencies[min(int(len(sorted_latencies) * fraction), len(sorted_latencies) - 1)]
+
+
+def measure(operation, user_ids):
+    latencies = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        operation(user_id)
+        latencies.append(time.perf_counter() - start)
+    total = sum(latencies)
+    latencies.sort()
+    return {
+        'ops_per_sec': len(latencies) / total,
+        'p50_us': percentile(latencies, 0.5) * 10 ** 6,
+        'p99_us': percentile(latencies, 0.99) * 10 ** 6,
+    }
+
+
+def run(backends, sizes, iterations, selected=None):
+    """
+    Runs every operation on every backend and size
+
+    Returns
+    -------
+    dict
+        backend/size/operation to its ops_per_sec, p50_us and p99_us
+    """
+    results = {}
+    rng = random.Random(0)
+    for backend in backends:
+        for size in sizes:
+            db = create_db(backend, size)
+            try:
+                for name, operation in operations(db).items():
+                    if selected and name not in selected:
+                        continue
+                    user_ids = [rng.randint(1, size) for _ in range(iterations)]
+                    # warms up the statement and page caches
+                    for user_id in user_ids[:min(100, iterations)]:
+                        operation(user_id)
+                    results[f'{backend}/{size}/{name}'] = measure(operation, user_ids)
+            finally:
+                db.close()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the keys and reasons of the results that regressed by more than threshold against baseline
+    """
+    regressions = []
+    for key, result in results.items():
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+        if result['ops_per_sec'] < expected['ops_per_sec'] * (1 - threshold):
+            regressions.append((key, f'ops/sec {expected["ops_per_sec"]:.0f} -> {result["ops_per_sec"]:.0f}'))
+        elif result['p99_us'] > expected['p99_us'] * (1 + threshold):
+            regressions.append((key, f'p99 {expected["p99_us"]:.1f}us -> {result["p99_us"]:.1f}us'))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark service and repository hot paths')
+    parser.add_argument('--backends', nargs='*', default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument('--sizes', type=int, nargs='*', default=[1000, 100000, 1000000],
+                        help='num of users and positions')
+    parser.add_argument('--iterations', type=int, default=2000, help='calls per operation')
+    parser.add_argument('--operations', nargs='*', help='only run these operations')
+    parser.add_argument('--save', help='write the results as a JSON baseline to this file')
+    parser.add_argument('--compare', help='JSON baseline to compare the results with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='tolerated slowdown against the baseline')
+    args = parser.parse_args()
+    results = run(args.backends, args.sizes, args.iterations, args.operations)
+    print(f'{"benchmark":<48}{"ops/s":>12}{"p50 us":>12}{"p99 us":>12}')
+    for key, result in results.items():
+        print(f'{key:<48}{result["ops_per_sec"]:>12.0f}{result["p50_us"]:>12.1f}{result["p99_us"]:>12.1f}')
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for key, reason in regressions:
+            print(f'REGRESSION {key}: {reason}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Compares pessimistic trades, which hold the striped lock of their user and update balances with guarded statements,
+with optimistic trades, which read without locks and only update rows still on the version they read. Threads trade
+1, some or as many users as there are threads, from every thread trading the same user to no two threads doing so.
+
+    python -m benchmarks.optimistic_locking --threads 8 --trades 200
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from setup_db import create_connection, create_tables, fill_testing_data
+from src.persistence.db import BrokingDB
+from src.service.broking import VERSION_CONFLICTS, BrokingService
+
+
+TIME_STAMP = '10/12/2021 16:00:01'
+
+
+def create_service(threads, num_of_users, concurrency, profile):
+    database_file = os.path.join(tempfile.mkdtemp(), 'ebroker.db')
+    conn = create_connection(database_file, profile)
+    create_tables(conn)
+    fill_testing_data(conn)
+    conn.close()
+    db = BrokingDB(database_file, pool_size=threads, profile=profile)
+    service = BrokingService(db, concurrency=concurrency)
+    for n in range(num_of_users):
+        service.user_repository.add_user({'name': f'user_{n}', 'balance': 10 ** 9})
+    user_ids = [user.id for user in service.user_repository.get_all_users()][-num_of_users:]
+    return db, service, user_ids
+
+
+def run(concurrency, threads, num_of_users, trades_per_thread, profile):
+    db, service, user_ids = create_service(threads, num_of_users, concurrency, profile)
+    errors = []
+
+    def trade(user_id):
+        for i in range(trades_per_thread):
+            # a thread sells the share it just bought, so a position never goes below zero
+            operation = service.sell_an_equity if i % 2 else service.buy_an_equity
+            try:
+                operation(user_id, 1, 1, TIME_STAMP)
+            except Exception as e:
+                errors.append(str(e))
+    workers = [threading.Thread(target=trade, args=(user_ids[n % num_of_users],)) for n in range(threads)]
+    conflicts = VERSION_CONFLICTS.value()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    db.close()
+    return threads * trades_per_thread / elapsed, len(errors), VERSION_CONFLICTS.value() - conflicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pessimistic against optimistic trades as contention varies')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--trades', type=int, default=200, help='trades per thread')
+    parser.add_argument('--profile', default='durable')
+    args = parser.parse_args()
+    print(f'{"users":>6}  {"concurrency":<12}{"trades/s":>12}{"errors":>10}{"conflicts":>11}')
+    for num_of_users in sorted({1, max(args.threads // 4, 1), args.threads}):
+        for concurrency in ('pessimistic', 'optimistic'):
+            trades_per_sec, errors, conflicts = run(concurrency, args.threads, num_of_users, args.trades, args.profile)
+            print(f'{num_of_users:>6}  {concurrency:<12}{trades_per_sec:>12.0f}{errors:>10}{conflicts:>11}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Compares the sqlite pragma profiles. For every profile a fresh database is created, trades are run from writer threads
+while reader threads keep polling balances, and trade throughput and balance read latency are reported.
+
+    python -m benchmarks.pragma_profiles --trades 2000 --writers 2 --readers 4
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from setup_db import create_connection, create_tables, fill_testing_data
+from src.persistence.db import BrokingDB
+from src.persistence.pragmas import PRAGMA_PROFILES
+from src.service.broking import BrokingService
+
+
+TIME_STAMP = '10/12/2021 16:00:01'
+
+
+def run_profile(profile, trades, writers, readers):
+    directory = tempfile.mkdtemp()
+    database_file = os.path.join(directory, 'ebroker.db')
+    conn = create_connection(database_file, profile)
+    create_tables(conn)
+    fill_testing_data(conn)
+    conn.close()
+    db = BrokingDB(database_file, pool_size=writers + readers, profile=profile)
+    service = BrokingService(db)
+    service.add_fund(1, trades * 10)
+    stop_reading = threading.Event()
+    read_latencies = []
+
+    def write(num_of_trades):
+        for i in range(num_of_trades):
+            if i % 2:
+                service.sell_an_equity(1, 1, 1, TIME_STAMP)
+            else:
+                service.buy_an_equity(1, 1, 1, TIME_STAMP)
+
+    def read():
+        latencies = []
+        while not stop_reading.is_set():
+            start = time.perf_counter()
+            service.get_balance(2)
+            latencies.append(time.perf_counter() - start)
+        read_latencies.extend(latencies)
+
+    reader_threads = [threading.Thread(target=read) for _ in range(readers)]
+    writer_threads = [threading.Thread(target=write, args=(trades // writers,)) for _ in range(writers)]
+    for thread in reader_threads:
+        thread.start()
+    start = time.perf_counter()
+    for thread in writer_threads:
+        thread.start()
+    for thread in writer_threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop_reading.set()
+    for thread in reader_threads:
+        thread.join()
+    db.close()
+    read_latencies.sort()
+    return {
+        'trades_per_sec': trades / elapsed,
+        'reads': len(read_latencies),
+        'read_p50_ms': statistics.median(read_latencies) * 1000 if read_latencies else 0,
+        'read_p99_ms': read_latencies[int(len(read_latencies) * 0.99)] * 1000 if read_latencies else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sqlite pragma profiles')
+    parser.add_argument('--trades', type=int, default=2000)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--profiles', nargs='*', default=list(PRAGMA_PROFILES))
+    args = parser.parse_args()
+    print(f'{"profile":<12}{"trades/s":>12}{"reads":>10}{"read p50 ms":>14}{"read p99 ms":>14}')
+    for profile in args.profiles:
+        result = run_profile(profile, args.trades, args.writers, args.readers)
+        print(f'{profile:<12}{result["trades_per_sec"]:>12.0f}{result["reads"]:>10}'
+              f'{result["read_p50_ms"]:>14.3f}{result["read_p99_ms"]:>14.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Compares the throughput of the Flask (threaded WSGI) and the ASGI serving modes. Both servers are started on a copy of
+a freshly set up database and hammered by concurrent clients sending a mix of balance reads and trades.
+
+    python -m benchmarks.serving_modes --clients 8 32 --requests 200
+
+The ASGI mode needs uvicorn (pip install uvicorn).
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from setup_db import create_connection, create_tables, fill_testing_data
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+SERVERS = {
+    'flask': [sys.executable, '-c', 'import sys; from app import app; app.run(port=int(sys.argv[1]), threaded=True)'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:app', '--log-level', 'warning', '--port'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise Exception(f'Server did not start on port {port}')
+
+
+def call(base_url, i):
+    if i % 4 == 3:
+        side = 'sell' if i % 8 == 7 else 'buy'
+        body = json.dumps({'userId': 1, 'equityId': 1, 'numOfShares': 1, 'timeStamp': '10/12/2021 16:00:01'})
+        request = urllib.request.Request(f'{base_url}/{side}', data=body.encode(),
+                                         headers={'Content-Type': 'application/json'})
+    else:
+        request = urllib.request.Request(f'{base_url}/getBalance?userId=2')
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def run_mode(mode, clients, requests_per_client):
+    directory = tempfile.mkdtemp()
+    database_file = os.path.join(directory, 'ebroker.db')
+    conn = create_connection(database_file)
+    create_tables(conn)
+    fill_testing_data(conn)
+    conn.close()
+    port = free_port()
+    env = dict(os.environ, EBROKER_DATABASE_FILE=database_file)
+    server = subprocess.Popen(SERVERS[mode] + [str(port)], cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        base_url = f'http://127.0.0.1:{port}/broker/api'
+        statuses = []
+
+        def client():
+            statuses.extend(call(base_url, i) for i in range(requests_per_client))
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        'requests_per_sec': len(statuses) / elapsed,
+        'errors': sum(1 for status in statuses if status >= 500),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Flask and ASGI serving modes')
+    parser.add_argument('--clients', type=int, nargs='*', default=[8, 32])
+    parser.add_argument('--requests', type=int, default=200, help='requests per client')
+    parser.add_argument('--modes', nargs='*', default=list(SERVERS))
+    args = parser.parse_args()
+    print(f'{"mode":<8}{"clients":>10}{"requests/s":>14}{"errors":>10}')
+    for mode in args.modes:
+        for clients in args.clients:
+            result = run_mode(mode, clients, args.requests)
+            print(f'{mode:<8}{clients:>10}{result["requests_per_sec"]:>14.0f}{result["errors"]:>10}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares trades executed directly by many threads with trades funnelled through the single writer queue and with
+direct trades on a database sharded by user, where the threads trading users of different shards commit in parallel.
+
+    python -m benchmarks.write_queue --threads 16 --trades 200
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from setup_db import create_connection, create_tables, fill_testing_data
+from src.persistence.db import BrokingDB
+from src.persistence.sharded import ShardedDB
+from src.service.broking import BrokingService
+from src.service.trade_queue import TradeWriter
+
+
+TIME_STAMP = '10/12/2021 16:00:01'
+
+
+def create_service(threads, profile, sharded=False):
+    directory = tempfile.mkdtemp()
+    database_file = os.path.join(directory, 'ebroker.db')
+    conn = create_connection(database_file, profile)
+    create_tables(conn)
+    fill_testing_data(conn)
+    conn.close()
+    if sharded:
+        # users 1 and 2 land on different shards
+        db = ShardedDB([os.path.join(directory, f'ebroker.shard{index}.db') for index in range(2)],
+                       seed_file=database_file, pool_size=threads, profile=profile)
+    else:
+        db = BrokingDB(database_file, pool_size=threads, profile=profile)
+    service = BrokingService(db)
+    service.add_fund(1, 10 ** 9)
+    service.add_fund(2, 10 ** 9)
+    return db, service
+
+
+def run(mode, threads, trades_per_thread, profile):
+    db, service = create_service(threads, profile, sharded=mode == 'sharded')
+    writer = TradeWriter(service).start() if mode == 'queue' else None
+    errors = []
+
+    def trade(user_id):
+        for i in range(trades_per_thread):
+            operation = 'sell_an_equity' if i % 2 else 'buy_an_equity'
+            try:
+                if writer is not None:
+                    writer.submit(operation, user_id, 1, 1, TIME_STAMP).result()
+                else:
+                    getattr(service, operation)(user_id, 1, 1, TIME_STAMP)
+            except Exception as e:
+                errors.append(str(e))
+    workers = [threading.Thread(target=trade, args=(1 + n % 2,)) for n in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    if writer is not None:
+        writer.stop()
+    db.close()
+    return threads * trades_per_thread / elapsed, len(errors), writer.batches if writer is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark direct trades against the single writer queue and sharding')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--trades', type=int, default=200, help='trades per thread')
+    parser.add_argument('--profile', default='durable')
+    args = parser.parse_args()
+    print(f'{"mode":<8}{"trades/s":>12}{"errors":>10}{"batches":>10}')
+    for mode in ('direct', 'queue', 'sharded'):
+        trades_per_sec, errors, batches = run(mode, args.threads, args.trades, args.profile)
+        print(f'{mode:<8}{trades_per_sec:>12.0f}{errors:>10}{batches if batches is not None else "-":>10}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,22 @@
+import argparse
 import os
+import random
 import sqlite3
+import time
 from sqlite3 import Error
+from src import config
+from src.persistence import schema
+from src.persistence.pragmas import apply_pragma_profile
 
 
-def create_connection(database_file):
+def create_connection(database_file, profile=config.DB_PROFILE):
     """
     Creates a database connection to a SQLite database
     """
     conn = None
     try:
         conn = sqlite3.connect(database_file)
+        apply_pragma_profile(conn, profile)
         return conn
     except Error as e:
         print(e)
@@ -18,40 +25,10 @@ def create_connection(database_file):
 
 def create_tables(conn):
     """
-    Creates required tables for ebroker
+    Creates required tables and indexes for ebroker
     """
-    query = """CREATE TABLE IF NOT EXISTS users 
-                (
-                    id integer PRIMARY KEY,
-                    name text NOT NULL,
-                    balance real NOT NULL,
-                    last_modified_on text NOT NULL
-                );"""
-    cur = conn.cursor()
-    cur.execute(query)
-
-    query = """CREATE TABLE IF NOT EXISTS equities 
-                    (
-                        id integer PRIMARY KEY,
-                        name text NOT NULL,
-                        price real NOT NULL,
-                        last_modified_on text NOT NULL
-                    );"""
-    cur = conn.cursor()
-    cur.execute(query)
-
-    query = """CREATE TABLE IF NOT EXISTS user_equity_map 
-                        (
-                            id integer PRIMARY KEY,
-                            user_id integer,
-                            equity_id integer,
-                            total_shares integer NOT NULL,
-                            last_modified_on text NOT NULL,
-                            FOREIGN KEY(user_id) REFERENCES users(id),
-                            FOREIGN KEY(equity_id) REFERENCES equities(id)
-                        );"""
-    cur = conn.cursor()
-    cur.execute(query)
+    schema.create_tables(conn)
+    schema.create_indexes(conn)
 
 
 def fill_testing_data(conn):
@@ -81,20 +58,127 @@ def fill_testing_data(conn):
     conn.commit()
 
 
-if __name__ == '__main__':
-    database_file = r'ebroker.db'
+# rows inserted per executemany and transaction by the generator
+GENERATOR_CHUNK_SIZE = 100000
+
+
+def generate_rows(conn, query, rows, chunk_size=GENERATOR_CHUNK_SIZE):
+    """
+    Inserts rows with one executemany and one commit per chunk of chunk_size rows
+    """
+    cur = conn.cursor()
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            cur.executemany(query, chunk)
+            conn.commit()
+            chunk = []
+    if chunk:
+        cur.executemany(query, chunk)
+        conn.commit()
+
+
+def fill_generated_data(conn, num_of_users, num_of_equities, num_of_positions, seed=0, balance=(1000, 1000000),
+                        shares=(1, 1000), chunk_size=GENERATOR_CHUNK_SIZE):
+    """
+    Fills newly created tables with generated users, equities and positions, meant for load and benchmark testing.
+    Positions are spread round robin over the users, the n-th position of a user is in equity (user id + n) modulo
+    num_of_equities plus one, so every user holds its own equities. Balances, prices and shares are drawn from a
+    random generator seeded with seed, the same arguments always give the same data. The index of the positions is
+    built after they are loaded.
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        connection to a database whose tables are empty
+    num_of_users: int
+        num of users
+    num_of_equities: int
+        num of equities
+    num_of_positions: int
+        num of positions, at most num_of_users * num_of_equities
+    seed: int
+        seed of the random generator
+    balance: tuple
+        lowest and highest balance of a user
+    shares: tuple
+        lowest and highest num of shares of a position
+    chunk_size: int
+        rows inserted per transaction
+    """
+    if num_of_positions > num_of_users * num_of_equities:
+        raise Exception('A user can hold every equity only once, provide fewer positions')
+    rng = random.Random(seed)
+    schema.create_tables(conn)
+    generate_rows(conn, "INSERT INTO equities (id, name, price, last_modified_on) VALUES (?, ?, ?, datetime('now'))",
+                  ((i, f'EQUITY_{i}', round(rng.uniform(1, 5000), 2)) for i in range(1, num_of_equities + 1)),
+                  chunk_size)
+    generate_rows(conn, "INSERT INTO users (id, name, balance, last_modified_on) VALUES (?, ?, ?, datetime('now'))",
+                  ((i, f'user_{i}', rng.randint(*balance)) for i in range(1, num_of_users + 1)), chunk_size)
+    generate_rows(conn, 'INSERT INTO user_equity_map (user_id, equity_id, total_shares, last_modified_on) '
+                        "VALUES (?, ?, ?, datetime('now'))",
+                  ((position % num_of_users + 1, (position % num_of_users + 1 + position // num_of_users)
+                    % num_of_equities + 1, rng.randint(*shares)) for position in range(num_of_positions)),
+                  chunk_size)
+    # generated positions are unique, so the index is built without looking for duplicates to merge
+    cur = conn.cursor()
+    for query in schema.INDEXES:
+        cur.execute(query)
+    conn.commit()
+
+
+def generate(database_file, num_of_users, num_of_equities, num_of_positions, seed, chunk_size):
+    if os.path.exists(database_file):
+        raise Exception(f'{database_file} already exists, delete it or choose another file')
+    started = time.perf_counter()
+    # bulk load does not need to survive a power failure
+    conn = create_connection(database_file, 'throughput')
+    if not conn:
+        raise Exception('No connection')
+    try:
+        fill_generated_data(conn, num_of_users, num_of_equities, num_of_positions, seed=seed, chunk_size=chunk_size)
+    finally:
+        conn.close()
+    print(f'Generated {num_of_users} users, {num_of_equities} equities and {num_of_positions} positions in '
+          f'{database_file} in {time.perf_counter() - started:.1f}s')
+
+
+def set_up(database_file):
     if os.path.exists(database_file):
         delete = input('A database file already exists. '
                        'Do you want me to delete the existing one and create a new one? (y/n):\t')
         if delete.lower() in ('y', 'yes'):
             os.remove(database_file)
         else:
-            print('Skipping the set up as database already exists. If you still want to set up a fresh database then'
-                  ' delete the existing database - ebroker.db')
-            exit()
+            conn = create_connection(database_file)
+            if conn:
+                create_tables(conn)
+                conn.close()
+            print('Skipping the set up as database already exists, only its schema is upgraded. If you still want to'
+                  f' set up a fresh database then delete the existing database - {database_file}')
+            return
     conn = create_connection(database_file)
     if conn:
         create_tables(conn)
         fill_testing_data(conn)
         conn.close()
-        print('Database setup done')
\ No newline at end of file
+        print('Database setup done')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Set up the ebroker database with a few testing rows, or generate '
+                                                 'a large one when --users, --equities or --positions is given')
+    parser.add_argument('--database', default='ebroker.db', help='sqlite database file to create')
+    parser.add_argument('--users', type=int, help='num of generated users')
+    parser.add_argument('--equities', type=int, help='num of generated equities')
+    parser.add_argument('--positions', type=int, help='num of generated positions')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random generator')
+    parser.add_argument('--chunk-size', type=int, default=GENERATOR_CHUNK_SIZE, help='rows inserted per transaction')
+    args = parser.parse_args()
+    if args.users is None and args.equities is None and args.positions is None:
+        set_up(args.database)
+    else:
+        num_of_users = args.users if args.users is not None else 1000
+        num_of_equities = args.equities if args.equities is not None else 100
+        num_of_positions = args.positions if args.positions is not None else num_of_users
+        generate(args.database, num_of_users, num_of_equities, num_of_positions, args.seed, args.chunk_size)
\ No newline at end of file
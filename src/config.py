@@ -0,0 +1,119 @@
+import os
+
+
+def _get_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _get_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+# sqlite database used by the repositories
+DATABASE_FILE = os.environ.get('EBROKER_DATABASE_FILE') or \
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ebroker.db'))
+
+# Storage backing the repositories, file for the sqlite database file or shared_memory for a named shared-cache
+# in-memory database seeded from EBROKER_SHARED_MEMORY_SEED_FILE and copied to EBROKER_SHARED_MEMORY_CHECKPOINT_FILE
+# every EBROKER_SHARED_MEMORY_CHECKPOINT_INTERVAL seconds
+DB_MODE = os.environ.get('EBROKER_DB_MODE', 'file')
+SHARED_MEMORY_NAME = os.environ.get('EBROKER_SHARED_MEMORY_NAME', 'ebroker')
+SHARED_MEMORY_SEED_FILE = os.environ.get('EBROKER_SHARED_MEMORY_SEED_FILE', DATABASE_FILE)
+SHARED_MEMORY_CHECKPOINT_FILE = os.environ.get('EBROKER_SHARED_MEMORY_CHECKPOINT_FILE')
+SHARED_MEMORY_CHECKPOINT_INTERVAL = _get_float('EBROKER_SHARED_MEMORY_CHECKPOINT_INTERVAL', 60.0)
+
+# Engine behind the repositories, sqlite, ledger or sharded. The ledger keeps everything in memory, journals every
+# change to EBROKER_LEDGER_JOURNAL_FILE and writes a snapshot to EBROKER_LEDGER_SNAPSHOT_FILE every
+# EBROKER_LEDGER_SNAPSHOT_EVERY journal entries, it starts from EBROKER_LEDGER_SEED_FILE when there is no snapshot
+STORAGE_ENGINE = os.environ.get('EBROKER_STORAGE_ENGINE', 'sqlite')
+LEDGER_JOURNAL_FILE = os.environ.get('EBROKER_LEDGER_JOURNAL_FILE') or \
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ebroker.journal'))
+LEDGER_SNAPSHOT_FILE = os.environ.get('EBROKER_LEDGER_SNAPSHOT_FILE') or \
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ebroker.snapshot.json'))
+LEDGER_SEED_FILE = os.environ.get('EBROKER_LEDGER_SEED_FILE', DATABASE_FILE)
+LEDGER_SNAPSHOT_EVERY = _get_int('EBROKER_LEDGER_SNAPSHOT_EVERY', 100000)
+LEDGER_FSYNC = os.environ.get('EBROKER_LEDGER_FSYNC', '0').lower() in ('1', 'true', 'yes')
+
+# Users and their positions are split over EBROKER_SHARD_COUNT sqlite files by the sharded engine, named after
+# EBROKER_SHARD_FILE with the shard index in place of {}, equities are copied to every shard. Empty shards are filled
+# from EBROKER_SHARD_SEED_FILE
+SHARD_COUNT = _get_int('EBROKER_SHARD_COUNT', 4)
+SHARD_FILE = os.environ.get('EBROKER_SHARD_FILE') or \
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ebroker.shard{}.db'))
+SHARD_SEED_FILE = os.environ.get('EBROKER_SHARD_SEED_FILE', DATABASE_FILE)
+
+# Event log of trades, set EBROKER_TRADE_LOG to 1 to append every committed buy, sell and fund to
+# EBROKER_TRADE_LOG_FILE, relayed from the trade outbox every EBROKER_TRADE_LOG_RELAY_INTERVAL seconds, fsynced once
+# per EBROKER_TRADE_LOG_FSYNC_BATCH_SIZE events or EBROKER_TRADE_LOG_FSYNC_INTERVAL seconds and compacted into
+# EBROKER_TRADE_LOG_SNAPSHOT_FILE every EBROKER_TRADE_LOG_COMPACT_EVERY events
+TRADE_LOG = os.environ.get('EBROKER_TRADE_LOG', '0').lower() in ('1', 'true', 'yes')
+TRADE_LOG_FILE = os.environ.get('EBROKER_TRADE_LOG_FILE') or \
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ebroker.trades.log'))
+TRADE_LOG_SNAPSHOT_FILE = os.environ.get('EBROKER_TRADE_LOG_SNAPSHOT_FILE') or \
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ebroker.trades.snapshot.json'))
+TRADE_LOG_RELAY_INTERVAL = _get_float('EBROKER_TRADE_LOG_RELAY_INTERVAL', 0.05)
+TRADE_LOG_FSYNC_BATCH_SIZE = _get_int('EBROKER_TRADE_LOG_FSYNC_BATCH_SIZE', 64)
+TRADE_LOG_FSYNC_INTERVAL = _get_float('EBROKER_TRADE_LOG_FSYNC_INTERVAL', 0.05)
+TRADE_LOG_COMPACT_EVERY = _get_int('EBROKER_TRADE_LOG_COMPACT_EVERY', 100000)
+
+# Connection pool shared by all the repositories
+POOL_SIZE = _get_int('EBROKER_POOL_SIZE', 5)
+POOL_CHECKOUT_TIMEOUT = _get_float('EBROKER_POOL_CHECKOUT_TIMEOUT', 10.0)
+POOL_HEALTH_CHECK_INTERVAL = _get_float('EBROKER_POOL_HEALTH_CHECK_INTERVAL', 30.0)
+# Separate pool of read-only connections serving the reads made outside of a unit of work, 0 sends them to the pool
+# above
+READ_POOL_SIZE = _get_int('EBROKER_READ_POOL_SIZE', 5)
+
+# Rows fetched at a time by the exports and num of rows of a page
+STREAM_BATCH_SIZE = _get_int('EBROKER_STREAM_BATCH_SIZE', 1000)
+
+# Compiled statements each pooled connection keeps, enough for every repository query and IN list size
+STATEMENT_CACHE_SIZE = _get_int('EBROKER_STATEMENT_CACHE_SIZE', 256)
+
+# Timing of every statement and request exposed at /metrics, set to 0 to turn it off
+METRICS = os.environ.get('EBROKER_METRICS', '1').lower() in ('1', 'true', 'yes')
+
+# Named sqlite pragma profile applied on every connection, one of durable, balanced or throughput
+DB_PROFILE = os.environ.get('EBROKER_DB_PROFILE', 'durable')
+
+# Num of orders of a batch applied in one transaction
+ORDER_BATCH_CHUNK_SIZE = _get_int('EBROKER_ORDER_BATCH_CHUNK_SIZE', 1000)
+
+# Read-through cache of equity rows
+EQUITY_CACHE_SIZE = _get_int('EBROKER_EQUITY_CACHE_SIZE', 1024)
+EQUITY_CACHE_TTL = _get_float('EBROKER_EQUITY_CACHE_TTL', 60.0)
+
+# How buy and sell keep concurrent trades of a user apart: pessimistic holds locks for the whole trade, optimistic
+# reads without locks and only updates rows still on the version it read, retrying with jittered backoff otherwise
+CONCURRENCY = os.environ.get('EBROKER_CONCURRENCY', 'pessimistic')
+OPTIMISTIC_RETRIES = _get_int('EBROKER_OPTIMISTIC_RETRIES', 5)
+OPTIMISTIC_BACKOFF = _get_float('EBROKER_OPTIMISTIC_BACKOFF', 0.002)
+
+# Num of locks the users are striped over, a trade holds the lock of its user, 0 to not take them
+USER_LOCK_STRIPES = _get_int('EBROKER_USER_LOCK_STRIPES', 64)
+
+# Responses of trades sent with an idempotency key, kept in a table for IDEMPOTENCY_KEY_TTL seconds and cached in
+# process for the most recent ones
+IDEMPOTENCY_KEY_TTL = _get_float('EBROKER_IDEMPOTENCY_KEY_TTL', 86400.0)
+IDEMPOTENCY_CACHE_SIZE = _get_int('EBROKER_IDEMPOTENCY_CACHE_SIZE', 10000)
+IDEMPOTENCY_CACHE_TTL = _get_float('EBROKER_IDEMPOTENCY_CACHE_TTL', 300.0)
+
+# Max num of price ticks coalesced and written in one transaction
+PRICE_FEED_BATCH_SIZE = _get_int('EBROKER_PRICE_FEED_BATCH_SIZE', 5000)
+
+# Executors of the async (ASGI) serving mode, trades and reads get their own threads
+ASYNC_WRITE_WORKERS = _get_int('EBROKER_ASYNC_WRITE_WORKERS', 2)
+ASYNC_READ_WORKERS = _get_int('EBROKER_ASYNC_READ_WORKERS', 3)
+ASYNC_MAX_PENDING = _get_int('EBROKER_ASYNC_MAX_PENDING', 256)
+ASYNC_QUEUE_TIMEOUT = _get_float('EBROKER_ASYNC_QUEUE_TIMEOUT', 2.0)
+
+# Trading calendar checked for every trade, EBROKER_CALENDAR_FILE adds exchanges from a JSON file
+EXCHANGE = os.environ.get('EBROKER_EXCHANGE', 'DEFAULT')
+CALENDAR_FILE = os.environ.get('EBROKER_CALENDAR_FILE')
+
+# Single writer applying trades from a queue in group committed batches
+WRITE_QUEUE = os.environ.get('EBROKER_WRITE_QUEUE', '0').lower() in ('1', 'true', 'yes')
+WRITE_QUEUE_BATCH_SIZE = _get_int('EBROKER_WRITE_QUEUE_BATCH_SIZE', 256)
+WRITE_QUEUE_TIMEOUT = _get_float('EBROKER_WRITE_QUEUE_TIMEOUT', 30.0)
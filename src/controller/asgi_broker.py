@@ -0,0 +1,200 @@
+import json
+import time
+from urllib.parse import parse_qs
+from src import config
+from src.metrics import CONTENT_TYPE, REGISTRY, record_request
+from src.persistence.async_db import ServerBusyError
+from src.service.async_broking import AsyncBrokingService, create_executors
+from src.service.price_feed import validate_tick
+
+
+URL_PREFIX = '/broker/api'
+
+
+class BrokerASGIApp:
+    def __init__(self, service=None):
+        """
+        ASGI application exposing the same routes as the broker_api blueprint. Requests are handled on the event loop
+        and sqlite work runs on bounded executors, so slow clients only cost a coroutine and not a thread.
+        Parameters
+        ----------
+        service: AsyncBrokingService
+            service handling the requests, defaults to one with executors sized from the configuration
+        """
+        if service is None:
+            service = AsyncBrokingService(*create_executors())
+        self.service = service
+        self.routes = {
+            ('POST', f'{URL_PREFIX}/buy'): self.buy,
+            ('POST', f'{URL_PREFIX}/sell'): self.sell,
+            ('POST', f'{URL_PREFIX}/addAmount'): self.add,
+            ('GET', f'{URL_PREFIX}/getBalance'): self.balance,
+            ('GET', f'{URL_PREFIX}/portfolio'): self.portfolio,
+            ('POST', f'{URL_PREFIX}/orders/batch'): self.batch_orders,
+            ('POST', f'{URL_PREFIX}/prices'): self.update_prices,
+        }
+        # routes streaming NDJSON, to the kind of rows they export
+        self.exports = {
+            ('GET', f'{URL_PREFIX}/export/users'): 'users',
+            ('GET', f'{URL_PREFIX}/export/equities'): 'equities',
+            ('GET', f'{URL_PREFIX}/export/positions'): 'positions',
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        if scope['path'] == '/metrics' and scope['method'] == 'GET':
+            await send_response(send, 200, REGISTRY.render().encode(), CONTENT_TYPE.encode())
+            return
+        started = time.perf_counter()
+        kind = self.exports.get((scope['method'], scope['path']))
+        if kind is not None:
+            status = await self.export(send, kind, Request(scope, await read_body(receive)))
+            if config.METRICS:
+                record_request(scope['method'], scope['path'], status, time.perf_counter() - started)
+            return
+        handler = self.routes.get((scope['method'], scope['path']))
+        if handler is None:
+            known_path = any(path == scope['path'] for _, path in self.routes)
+            status, body = (405, {'error': 'Method not allowed'}) if known_path else (404, {'error': 'Not found'})
+        else:
+            try:
+                status, body = await handler(Request(scope, await read_body(receive)))
+            except KeyError as e:
+                status, body = 400, {'error': f'{str(e)} not found in request'}
+            except ServerBusyError as e:
+                status, body = 503, {'error': str(e)}
+            except Exception as e:
+                status, body = 500, {'error': str(e)}
+        await send_json(send, status, body)
+        if config.METRICS and handler is not None:
+            record_request(scope['method'], scope['path'], status, time.perf_counter() - started)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def buy(self, request):
+        request_body = request.json
+        user_id = request_body['userId']
+        equity_id = request_body['equityId']
+        num_of_shares = request_body['numOfShares']
+        time_stamp = request_body['timeStamp']
+        message = await self.service.buy_an_equity(user_id, equity_id, num_of_shares, time_stamp,
+                                                   request_body.get('idempotencyKey'))
+        return 200, {'message': message}
+
+    async def sell(self, request):
+        request_body = request.json
+        user_id = request_body['userId']
+        equity_id = request_body['equityId']
+        num_of_shares = request_body['numOfShares']
+        time_stamp = request_body['timeStamp']
+        message = await self.service.sell_an_equity(user_id, equity_id, num_of_shares, time_stamp,
+                                                    request_body.get('idempotencyKey'))
+        return 200, {'message': message}
+
+    async def add(self, request):
+        request_body = request.json
+        user_id = request_body['userId']
+        amount = request_body['amount']
+        return 200, {'message': await self.service.add_fund(user_id, amount, request_body.get('idempotencyKey'))}
+
+    async def balance(self, request):
+        if 'userId' not in request.args:
+            return 400, {'error': "'userId' not found in request"}
+        user_id = request.args['userId']
+        user_balance = await self.service.get_balance(int(user_id))
+        return 200, {'userId': user_id, 'balance': user_balance}
+
+    async def portfolio(self, request):
+        if 'userId' not in request.args:
+            return 400, {'error': "'userId' not found in request"}
+        user_id = request.args['userId']
+        user_portfolio = await self.service.get_portfolio(int(user_id))
+        return 200, {'userId': user_id, **user_portfolio}
+
+    async def batch_orders(self, request):
+        orders = request.json['orders']
+        if not isinstance(orders, list):
+            return 400, {'error': "'orders' should be a list"}
+        return 200, {'results': await self.service.execute_orders(orders)}
+
+    async def update_prices(self, request):
+        prices = request.json['prices']
+        if not isinstance(prices, list):
+            return 400, {'error': "'prices' should be a list"}
+        ticks = [validate_tick(tick['equityId'], tick['price']) for tick in prices]
+        return 200, await self.service.update_prices(ticks)
+
+    async def export(self, send, kind, request):
+        """
+        Streams an export as newline delimited JSON, one page at a time, and returns the response status
+        """
+        try:
+            after_id = int(request.args.get('afterId', 0))
+        except ValueError:
+            await send_json(send, 400, {'error': "'afterId' should be an integer"})
+            return 400
+        try:
+            rows, after_id = await self.service.export_page(kind, after_id)
+        except ServerBusyError as e:
+            await send_json(send, 503, {'error': str(e)})
+            return 503
+        except Exception as e:
+            await send_json(send, 500, {'error': str(e)})
+            return 500
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'application/x-ndjson')],
+        })
+        while True:
+            if rows:
+                payload = ''.join(json.dumps(row) + '\n' for row in rows).encode()
+                await send({'type': 'http.response.body', 'body': payload, 'more_body': True})
+            if after_id is None:
+                break
+            rows, after_id = await self.service.export_page(kind, after_id)
+        await send({'type': 'http.response.body', 'body': b''})
+        return 200
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.args = {key: values[-1] for key, values in parse_qs(scope.get('query_string', b'').decode()).items()}
+        self.body = body
+
+    @property
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            return body
+
+
+async def send_json(send, status, body):
+    await send_response(send, status, json.dumps(body).encode(), b'application/json')
+
+
+async def send_response(send, status, payload, content_type):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(payload)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': payload})
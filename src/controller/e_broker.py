@@ -1,10 +1,30 @@
-from flask import request, jsonify
+import json
+import time
+from flask import Response, g, request, jsonify
 from flask.blueprints import Blueprint
+from src import config
+from src.metrics import record_request
+from src.persistence.async_db import ServerBusyError
 from src.service.broking import BrokingService
+from src.service.price_feed import PriceFeed, validate_tick
+from src.service.trade_queue import run_trade
 
 broker_api = Blueprint('broker', __name__)
 
 
+@broker_api.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@broker_api.after_request
+def record_latency(response):
+    if config.METRICS and 'request_started' in g:
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        record_request(request.method, route, response.status_code, time.perf_counter() - g.request_started)
+    return response
+
+
 @broker_api.route('/buy', methods=['POST'])
 def buy():
     try:
@@ -13,10 +33,13 @@ def buy():
         equity_id = request_body['equityId']
         num_of_shares = request_body['numOfShares']
         time_stamp = request_body['timeStamp']
-        service = BrokingService()
-        return jsonify({'message': service.buy_an_equity(user_id, equity_id, num_of_shares, time_stamp)}), 200
+        message = run_trade('buy_an_equity', user_id, equity_id, num_of_shares, time_stamp,
+                            idempotency_key=request_body.get('idempotencyKey'))
+        return jsonify({'message': message}), 200
     except KeyError as e:
         return jsonify({'error': f'{str(e)} not found in request'}), 400
+    except ServerBusyError as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -29,10 +52,13 @@ def sell():
         equity_id = request_body['equityId']
         num_of_shares = request_body['numOfShares']
         time_stamp = request_body['timeStamp']
-        service = BrokingService()
-        return jsonify({'message': service.sell_an_equity(user_id, equity_id, num_of_shares, time_stamp)}), 200
+        message = run_trade('sell_an_equity', user_id, equity_id, num_of_shares, time_stamp,
+                            idempotency_key=request_body.get('idempotencyKey'))
+        return jsonify({'message': message}), 200
     except KeyError as e:
         return jsonify({'error': f'{str(e)} not found in request'}), 400
+    except ServerBusyError as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -43,10 +69,12 @@ def add():
         request_body = request.json
         user_id = request_body['userId']
         amount = request_body['amount']
-        service = BrokingService()
-        return jsonify({'message': service.add_fund(user_id, amount)}), 200
+        message = run_trade('add_fund', user_id, amount, idempotency_key=request_body.get('idempotencyKey'))
+        return jsonify({'message': message}), 200
     except KeyError as e:
         return jsonify({'error': f'{str(e)} not found in request'}), 400
+    except ServerBusyError as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -62,3 +90,106 @@ def balance():
         return jsonify({'error': f"'userId' not found in request"}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+
+@broker_api.route('/portfolio', methods=['GET'])
+def portfolio():
+    try:
+        user_id = request.args['userId']
+        service = BrokingService()
+        user_portfolio = service.get_portfolio(int(user_id))
+        return jsonify({'userId': user_id, **user_portfolio}), 200
+    except KeyError:
+        return jsonify({'error': f"'userId' not found in request"}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@broker_api.route('/orders/batch', methods=['POST'])
+def batch_orders():
+    try:
+        orders = request.json['orders']
+        if not isinstance(orders, list):
+            return jsonify({'error': "'orders' should be a list"}), 400
+        return jsonify({'results': run_trade('execute_orders', orders)}), 200
+    except KeyError as e:
+        return jsonify({'error': f'{str(e)} not found in request'}), 400
+    except ServerBusyError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def ndjson_chunks(rows, batch_size=config.STREAM_BATCH_SIZE):
+    """
+    Yields rows as newline delimited JSON, batch_size rows per chunk
+    """
+    batch = []
+    for row in rows:
+        batch.append(json.dumps(row))
+        if len(batch) == batch_size:
+            yield '\n'.join(batch) + '\n'
+            batch = []
+    if batch:
+        yield '\n'.join(batch) + '\n'
+
+
+@broker_api.route('/prices', methods=['POST'])
+def update_prices():
+    try:
+        prices = request.json['prices']
+        if not isinstance(prices, list):
+            return jsonify({'error': "'prices' should be a list"}), 400
+        ticks = [validate_tick(tick['equityId'], tick['price']) for tick in prices]
+        return jsonify(PriceFeed().apply(ticks)), 200
+    except KeyError as e:
+        return jsonify({'error': f'{str(e)} not found in request'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+class ChunkStream:
+    def __init__(self, first_chunk, chunks):
+        """
+        Response body made of a chunk read ahead and the rest of a chunk generator, closing it closes the generator so
+        that its connection goes back to the pool on the thread serving the request
+        """
+        self.first_chunk = first_chunk
+        self.chunks = chunks
+
+    def __iter__(self):
+        yield self.first_chunk
+        yield from self.chunks
+
+    def close(self):
+        self.chunks.close()
+
+
+def export(kind):
+    try:
+        after_id = int(request.args.get('afterId', 0))
+    except ValueError:
+        return jsonify({'error': "'afterId' should be an integer"}), 400
+    try:
+        chunks = ndjson_chunks(BrokingService().export(kind, after_id))
+        # the first chunk is read before the response starts so that a failing query still gets an error status
+        first_chunk = next(chunks, '')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return Response(ChunkStream(first_chunk, chunks), mimetype='application/x-ndjson')
+
+
+@broker_api.route('/export/users', methods=['GET'])
+def export_users():
+    return export('users')
+
+
+@broker_api.route('/export/equities', methods=['GET'])
+def export_equities():
+    return export('equities')
+
+
+@broker_api.route('/export/positions', methods=['GET'])
+def export_positions():
+    return export('positions')
+
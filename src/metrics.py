@@ -0,0 +1,284 @@
+import abc
+import bisect
+import re
+import threading
+from functools import lru_cache
+
+
+# upper bounds in seconds of the latency histogram buckets, from 100us to 10s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+def _format_labels(label_names, label_values, extra=''):
+    labels = [f'{name}="{escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _ThreadShardedMetric(abc.ABC):
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        # every thread updates its own series without taking a lock, they are merged when the metric is rendered
+        self._local = threading.local()
+        self._shards = []
+        # series of finished threads folded together
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    @abc.abstractmethod
+    def _merge(total, values):
+        """
+        Returns the values of two series of the same labels added together, total is None for the first series
+        """
+
+    def _thread_series(self):
+        try:
+            return self._local.series
+        except AttributeError:
+            series = self._local.series = {}
+            with self._lock:
+                # a server may start a thread per request, so the shards of finished threads are not kept
+                alive = []
+                for thread, shard in self._shards:
+                    if thread.is_alive():
+                        alive.append((thread, shard))
+                    else:
+                        self._fold(self._retired, shard)
+                alive.append((threading.current_thread(), series))
+                self._shards = alive
+            return series
+
+    def _fold(self, merged, shard):
+        for label_values, values in shard.copy().items():
+            merged[label_values] = self._merge(merged.get(label_values), values)
+
+    def _merged_series(self):
+        merged = {}
+        with self._lock:
+            self._fold(merged, self._retired)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            self._fold(merged, shard)
+        return sorted(merged.items())
+
+
+class Counter(_ThreadShardedMetric):
+    """
+    Monotonic counter with one series per combination of label values
+    """
+
+    @staticmethod
+    def _merge(total, value):
+        return value if total is None else total + value
+
+    def inc(self, amount=1, *label_values):
+        series = self._thread_series()
+        series[label_values] = series.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return dict(self._merged_series()).get(label_values, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for label_values, value in self._merged_series():
+            lines.append(f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}')
+        return lines
+
+
+class Histogram(_ThreadShardedMetric):
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        """
+        Histogram with one series per combination of label values. An observation only increments the count of its
+        bucket in the series of its thread, buckets are merged and made cumulative when the metric is rendered.
+        Parameters
+        ----------
+        name: str
+            metric name
+        documentation: str
+            help text of the metric
+        label_names: tuple of str
+            names of the labels
+        buckets: tuple of float
+            sorted upper bounds of the buckets, +Inf is added
+        """
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    @staticmethod
+    def _merge(total, values):
+        return list(values) if total is None else [a + b for a, b in zip(total, values)]
+
+    def observe(self, value, *label_values):
+        all_series = self._thread_series()
+        series = all_series.get(label_values)
+        if series is None:
+            # counts of every bucket and +Inf, then sum
+            series = all_series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *label_values):
+        series = dict(self._merged_series()).get(label_values)
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for label_values, values in self._merged_series():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                labels = _format_labels(self.label_names, label_values, f'le="{le}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(values[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, documentation, label_names=(), collect=None, metric_type='gauge'):
+        """
+        Metric whose values are read when it is rendered
+        Parameters
+        ----------
+        name: str
+            metric name
+        documentation: str
+            help text of the metric
+        label_names: tuple of str
+            names of the labels
+        collect: callable
+            returns a dict of label values tuple to value
+        metric_type: str
+            gauge, or counter for a total kept elsewhere
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.collect = collect
+        self.metric_type = metric_type
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        for label_values, value in sorted(self.collect().items()):
+            lines.append(f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """
+        Metrics of the process, rendered in the Prometheus text format
+        """
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Adds a metric, the metric already registered with the same name is returned instead
+        """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, label_names=()):
+        return self.register(Counter(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def gauge(self, name, documentation, label_names=(), collect=None, metric_type='gauge'):
+        return self.register(Gauge(name, documentation, label_names, collect, metric_type))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """
+        Returns all the metrics in the Prometheus text exposition format
+        Returns
+        -------
+        str
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+QUERY_DURATION = REGISTRY.histogram('ebroker_db_query_duration_seconds', 'Duration of sqlite statements',
+                                    ('statement',))
+QUERY_ROWS = REGISTRY.counter('ebroker_db_query_rows_total', 'Rows returned or changed by sqlite statements',
+                              ('statement',))
+QUERY_ERRORS = REGISTRY.counter('ebroker_db_query_errors_total', 'Failed sqlite statements', ('statement',))
+REQUEST_DURATION = REGISTRY.histogram('ebroker_http_request_duration_seconds', 'Duration of API requests',
+                                      ('method', 'route', 'status'))
+
+
+_WHITESPACE = re.compile(r'\s+')
+# IN and VALUES lists of any size are reported as one statement
+_PLACEHOLDER_LIST = re.compile(r'(\?|\(\?(?:, \?)*\))(?:, \1)+')
+
+
+@lru_cache(maxsize=1024)
+def normalize_statement(query):
+    """
+    Returns the text a statement is reported under, whitespace is collapsed and lists of placeholders are shortened
+    Parameters
+    ----------
+    query: str
+        SQL query
+
+    Returns
+    -------
+    str
+    """
+    return _PLACEHOLDER_LIST.sub(r'\1, ...', _WHITESPACE.sub(' ', query).strip())
+
+
+def record_query(query, duration, rows, error=None):
+    """
+    Query hook of BrokingDB recording the duration, rows and failures of a statement
+    Parameters
+    ----------
+    query: str
+        SQL query
+    duration: float
+        seconds the statement took
+    rows: int
+        num of rows returned or changed
+    error: Exception
+        error raised by the statement
+    """
+    statement = normalize_statement(query)
+    QUERY_DURATION.observe(duration, statement)
+    if error is not None:
+        QUERY_ERRORS.inc(1, statement)
+    elif rows > 0:
+        QUERY_ROWS.inc(rows, statement)
+
+
+def record_request(method, route, status, duration):
+    """
+    Records the duration of an API request under its route pattern
+    """
+    REQUEST_DURATION.observe(duration, method, route, str(status))
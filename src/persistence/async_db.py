@@ -0,0 +1,109 @@
+import asyncio
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from .storage import get_repository_class
+
+
+class ServerBusyError(Exception):
+    pass
+
+
+class BoundedExecutor:
+    def __init__(self, max_workers=4, max_pending=64, queue_timeout=1.0, name='ebroker'):
+        """
+        Runs blocking sqlite work on a fixed set of threads. At most max_pending calls can wait for a thread, a caller
+        which cannot get in within queue_timeout gets ServerBusyError instead of queueing without limit.
+        Parameters
+        ----------
+        max_workers: int
+            num of threads running sqlite work
+        max_pending: int
+            maximum num of calls running or waiting for a thread
+        queue_timeout: float
+            seconds a caller waits for a free slot
+        name: str
+            prefix of the thread names
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        # asyncio primitives belong to one event loop
+        self._slots = weakref.WeakKeyDictionary()
+
+    def _get_slots(self):
+        loop = asyncio.get_running_loop()
+        slots = self._slots.get(loop)
+        if slots is None:
+            slots = asyncio.Semaphore(self.max_pending)
+            self._slots[loop] = slots
+        return slots
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Holds one of the max_pending slots, work handed to another thread than the ones of the executor is bounded
+        the same way by running inside a slot
+        """
+        slots = self._get_slots()
+        try:
+            await asyncio.wait_for(slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise ServerBusyError('Server is busy, try again later')
+        try:
+            yield
+        finally:
+            slots.release()
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Runs a blocking call on the executor and returns its result
+        """
+        async with self.slot():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class AsyncRepository:
+    # kind of the wrapped repository, user, equity or user_equity_map
+    repository_kind = None
+
+    def __init__(self, executor, db=None):
+        """
+        Async variant of a repository, every method of the wrapped repository becomes a coroutine which runs the
+        sqlite work on a bounded executor
+        Parameters
+        ----------
+        executor: BoundedExecutor
+            executor running the queries
+        db: BrokingDB or LedgerDB
+            database to use, defaults to the one shared by all the repositories
+        """
+        self.repository = get_repository_class(self.repository_kind, db)(db)
+        self.executor = executor
+
+    def __getattr__(self, name):
+        method = getattr(self.repository, name)
+        if not callable(method):
+            return method
+
+        async def run(*args, **kwargs):
+            return await self.executor.run(method, *args, **kwargs)
+        return run
+
+
+class AsyncUserRepository(AsyncRepository):
+    repository_kind = 'user'
+
+
+class AsyncEquityRepository(AsyncRepository):
+    repository_kind = 'equity'
+
+
+class AsyncUserEquityMapRepository(AsyncRepository):
+    repository_kind = 'user_equity_map'
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    def __init__(self, max_size=1024, ttl=60.0):
+        """
+        Thread safe in-process cache which evicts the least recently used entry once it is full and expires entries
+        older than ttl
+        Parameters
+        ----------
+        max_size: int
+            maximum num of entries
+        ttl: float
+            seconds an entry stays valid, 0 or less to never expire
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # bumped by every invalidation, see put
+        self._generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns the cached value of a key or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_on = entry
+                if expires_on is None or expires_on > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def generation(self):
+        """
+        Returns the num of invalidations so far, read before loading a value to cache
+        """
+        return self._generation
+
+    def put(self, key, value, generation=None):
+        """
+        Caches value of a key
+        Parameters
+        ----------
+        key: hashable
+            key of the value
+        value: object
+            value to cache
+        generation: int
+            generation read before the value was loaded, the value is not cached if the cache was invalidated since
+            as it may have been loaded before the change the invalidation stands for
+        """
+        expires_on = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (value, expires_on)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        Removes a key from the cache
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generation += 1
+
+    def clear(self):
+        """
+        Removes all the keys from the cache
+        """
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        """
+        Returns hit and miss counters of the cache
+        Returns
+        -------
+        dict
+        """
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
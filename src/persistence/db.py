@@ -1,9 +1,62 @@
+import atexit
+import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.request import pathname2url
+from src import config
+from src.metrics import record_query
+from . import schema
+from .pool import ConnectionPool
+from .pragmas import apply_pragma_profile
+from .statements import MAX_IN_LIST_SIZE
+
+
+DATABASE_FILE = config.DATABASE_FILE
 
 
 class BrokingDB:
-    def __init__(self):
-        self.database_file = f'{__file__}/../../../ebroker.db'
+    def __init__(self, database_file=DATABASE_FILE, pool_size=config.POOL_SIZE,
+                 checkout_timeout=config.POOL_CHECKOUT_TIMEOUT,
+                 health_check_interval=config.POOL_HEALTH_CHECK_INTERVAL, profile=config.DB_PROFILE,
+                 read_pool_size=config.READ_POOL_SIZE):
+        """
+        Class to perform db operation on the sqlite database. Connections are reused from a pool instead of being
+        opened and closed for every query. Reads made outside of a unit of work go to a second pool of read-only
+        connections, so polling clients never wait for a connection held by a trade and, with WAL, read the last
+        committed state while a trade is being written.
+        Parameters
+        ----------
+        database_file: str
+            path of the sqlite database file
+        pool_size: int
+            maximum num of connections kept by the pool
+        checkout_timeout: float
+            seconds to wait for a free connection
+        health_check_interval: float
+            idle seconds after which a pooled connection is pinged before reuse
+        profile: str
+            sqlite pragma profile applied on every new connection
+        read_pool_size: int
+            maximum num of read-only connections, 0 to run the reads on the pool of the writes
+        """
+        self.database_file = database_file
+        self.profile = profile
+        self.pool = ConnectionPool(self._new_connection, max_size=pool_size, checkout_timeout=checkout_timeout,
+                                   health_check_interval=health_check_interval)
+        self.read_pool = None
+        if read_pool_size:
+            self.read_pool = ConnectionPool(self._new_read_connection, max_size=read_pool_size,
+                                            checkout_timeout=checkout_timeout,
+                                            health_check_interval=health_check_interval)
+        self._local = threading.local()
+        self._schema_upgraded = False
+        # whether exports read keyset pages rather than a stream holding a connection till they end
+        self.paged_exports = False
+        self._schema_lock = threading.Lock()
+        # called with the query, its duration in seconds, num of rows and error after every statement
+        self.query_hooks = [record_query] if config.METRICS else []
 
     def get_connection(self):
         """
@@ -14,12 +67,133 @@ class BrokingDB:
         """
         conn = None
         try:
-            conn = sqlite3.connect(self.database_file)
+            # pooled connections are handed over between threads
+            conn = sqlite3.connect(self.database_file, check_same_thread=False,
+                                   cached_statements=config.STATEMENT_CACHE_SIZE)
+            apply_pragma_profile(conn, self.profile)
         except sqlite3.Error as e:
             print(str(e))
         return conn
 
-    def execute_query(self, query, params=None, is_transactional=False):
+    def _new_connection(self):
+        conn = self.get_connection()
+        if not conn:
+            raise Exception('No connection')
+        if not self._schema_upgraded:
+            # the first connection brings a database created by an older version up to date
+            with self._schema_lock:
+                if not self._schema_upgraded:
+                    try:
+                        schema.upgrade_schema(conn)
+                    except Exception as e:
+                        conn.close()
+                        raise Exception(f'Could not upgrade the schema of {self.database_file}: {e}')
+                    self._schema_upgraded = True
+        return conn
+
+    def get_read_connection(self):
+        """
+        Returns a read-only connection, which can't change the database even by mistake
+        Returns
+        -------
+        sqlite3.Connection
+        """
+        conn = None
+        try:
+            uri = f'file:{pathname2url(os.path.abspath(self.database_file))}?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                   cached_statements=config.STATEMENT_CACHE_SIZE)
+            apply_pragma_profile(conn, self.profile, read_only=True)
+        except sqlite3.Error as e:
+            print(str(e))
+        return conn
+
+    def _new_read_connection(self):
+        if not self._schema_upgraded:
+            # a read-only connection can't create the file nor upgrade its schema, a writer does it first
+            self.pool.release(self.pool.acquire())
+        conn = self.get_read_connection()
+        if not conn:
+            raise Exception('No connection')
+        return conn
+
+    def _after_query(self, query, started, rows, error=None):
+        if self.query_hooks:
+            duration = time.perf_counter() - started
+            for hook in self.query_hooks:
+                hook(query, duration, rows, error)
+
+    def close(self):
+        """
+        Closes all the pooled connections
+        """
+        self.pool.close()
+        if self.read_pool is not None:
+            self.read_pool.close()
+
+    def in_transaction(self):
+        """
+        Returns whether the current thread is running inside a unit of work
+        """
+        return getattr(self._local, 'depth', 0) > 0
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs all the queries of the current thread on one connection as a single unit of work. The outermost unit of
+        work starts with BEGIN IMMEDIATE so that the write lock is taken before anything is read, it is committed once
+        at the end and rolled back on any error. A nested unit of work becomes a savepoint of the outer one.
+        Returns
+        -------
+        sqlite3.Connection
+        """
+        conn = self.pool.acquire()
+        depth = getattr(self._local, 'depth', 0)
+        savepoint = f'unit_of_work_{depth}'
+        callbacks = None
+        try:
+            conn.execute(f'SAVEPOINT {savepoint}' if depth else 'BEGIN IMMEDIATE')
+            if not depth:
+                self._local.after_commit = []
+            mark = len(self._local.after_commit)
+            self._local.depth = depth + 1
+            try:
+                yield conn
+            except BaseException:
+                del self._local.after_commit[mark:]
+                if depth:
+                    conn.execute(f'ROLLBACK TO {savepoint}')
+                    conn.execute(f'RELEASE {savepoint}')
+                else:
+                    conn.rollback()
+                raise
+            finally:
+                self._local.depth = depth
+            if depth:
+                conn.execute(f'RELEASE {savepoint}')
+            else:
+                conn.commit()
+                callbacks, self._local.after_commit = self._local.after_commit, []
+        finally:
+            self.pool.release(conn)
+        for callback in callbacks or ():
+            callback()
+
+    def after_commit(self, callback):
+        """
+        Runs a callback once the running unit of work is committed, or right away outside of a unit of work. The
+        callbacks of a unit of work which is rolled back are dropped.
+        Parameters
+        ----------
+        callback: callable
+            called without arguments
+        """
+        if self.in_transaction():
+            self._local.after_commit.append(callback)
+        else:
+            callback()
+
+    def execute_query(self, query, params=None, is_transactional=False, row_factory=None):
         """
         Executes given SQL query and returns the result
         Parameters
@@ -30,28 +204,239 @@ class BrokingDB:
             values to be passed in SQL query at run time
         is_transactional: bool
             whether the given query performs some data manipulation like insert, delete, update
+        row_factory: callable
+            builds a row from the cursor and the values of a row, rows are plain tuples by default
 
         Returns
         -------
         list of tuple
         """
-        conn = self.get_connection()
-        if not conn:
-            raise Exception('No connection')
+        conn = self.pool.acquire()
+        started = time.perf_counter()
         try:
             cur = conn.cursor()
+            if row_factory is not None:
+                cur.row_factory = row_factory
             if params:
                 cur.execute(query, params)
             else:
                 cur.execute(query)
             if is_transactional:
-                conn.commit()
+                # a unit of work commits once at its end
+                if not self.in_transaction():
+                    conn.commit()
+                self._after_query(query, started, cur.rowcount)
                 return []
             else:
                 row = cur.fetchall()
+                self._after_query(query, started, len(row))
                 return row
         except Exception as e:
             print(str(e))
+            self._after_query(query, started, 0, e)
+            raise Exception('Some error occurred while executing the query')
+        finally:
+            self.pool.release(conn)
+
+    def execute_read(self, query, params=None, row_factory=None):
+        """
+        Executes given SELECT query on a read-only connection and returns the result. Inside a unit of work the query
+        runs on the connection of the unit of work instead, so that it sees the changes made so far.
+        Parameters
+        ----------
+        query: str
+            SQL query
+        params: tuple
+            values to be passed in SQL query at run time
+        row_factory: callable
+            builds a row from the cursor and the values of a row, rows are plain tuples by default
+
+        Returns
+        -------
+        list of tuple
+        """
+        if self.read_pool is None or self.in_transaction():
+            return self.execute_query(query, params, row_factory=row_factory)
+        conn = self.read_pool.acquire()
+        started = time.perf_counter()
+        try:
+            cur = conn.cursor()
+            if row_factory is not None:
+                cur.row_factory = row_factory
+            if params:
+                cur.execute(query, params)
+            else:
+                cur.execute(query)
+            row = cur.fetchall()
+            self._after_query(query, started, len(row))
+            return row
+        except Exception as e:
+            print(str(e))
+            self._after_query(query, started, 0, e)
             raise Exception('Some error occurred while executing the query')
         finally:
-            conn.close()
+            self.read_pool.release(conn)
+
+    def stream_read(self, query, params=None, row_factory=None, batch_size=config.STREAM_BATCH_SIZE):
+        """
+        Executes given SELECT query like execute_read and yields its rows, which are fetched from the cursor
+        batch_size at a time so that a result of any size takes constant memory. The connection is held till the
+        generator is exhausted or closed, outside of a unit of work all the rows come from one WAL snapshot.
+        Parameters
+        ----------
+        query: str
+            SQL query
+        params: tuple
+            values to be passed in SQL query at run time
+        row_factory: callable
+            builds a row from the cursor and the values of a row, rows are plain tuples by default
+        batch_size: int
+            num of rows fetched at a time
+        """
+        pool = self.pool if self.read_pool is None or self.in_transaction() else self.read_pool
+        conn = pool.acquire()
+        started = time.perf_counter()
+        rows = 0
+        try:
+            cur = conn.cursor()
+            if row_factory is not None:
+                cur.row_factory = row_factory
+            try:
+                if params:
+                    cur.execute(query, params)
+                else:
+                    cur.execute(query)
+                while True:
+                    batch = cur.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    rows += len(batch)
+                    yield from batch
+            except sqlite3.Error as e:
+                print(str(e))
+                self._after_query(query, started, rows, e)
+                raise Exception('Some error occurred while executing the query')
+            finally:
+                cur.close()
+            self._after_query(query, started, rows)
+        finally:
+            pool.release(conn)
+
+    def execute_update(self, query, params=None):
+        """
+        Executes given data manipulation query and returns num of rows it changed, which lets a guarded update tell
+        whether its condition matched
+        Parameters
+        ----------
+        query: str
+            SQL query
+        params: tuple
+            values to be passed in SQL query at run time
+
+        Returns
+        -------
+        int
+        """
+        conn = self.pool.acquire()
+        started = time.perf_counter()
+        try:
+            cur = conn.cursor()
+            if params:
+                cur.execute(query, params)
+            else:
+                cur.execute(query)
+            if not self.in_transaction():
+                conn.commit()
+            self._after_query(query, started, cur.rowcount)
+            return cur.rowcount
+        except Exception as e:
+            print(str(e))
+            self._after_query(query, started, 0, e)
+            raise Exception('Some error occurred while executing the query')
+        finally:
+            self.pool.release(conn)
+
+    def execute_many(self, query, seq_of_params):
+        """
+        Executes given data manipulation query once for every set of params and returns num of rows it changed
+        Parameters
+        ----------
+        query: str
+            SQL query
+        seq_of_params: list of tuple
+            values to be passed in SQL query for each execution
+
+        Returns
+        -------
+        int
+        """
+        conn = self.pool.acquire()
+        started = time.perf_counter()
+        try:
+            cur = conn.cursor()
+            cur.executemany(query, seq_of_params)
+            if not self.in_transaction():
+                conn.commit()
+            self._after_query(query, started, cur.rowcount)
+            return cur.rowcount
+        except Exception as e:
+            print(str(e))
+            self._after_query(query, started, 0, e)
+            raise Exception('Some error occurred while executing the query')
+        finally:
+            self.pool.release(conn)
+
+
+# sqlite limits the num of params a single query can take
+MAX_PARAMS_PER_QUERY = MAX_IN_LIST_SIZE
+
+
+def chunks(items, size=MAX_PARAMS_PER_QUERY):
+    """
+    Splits a list into lists of given size
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+_shared_db = None
+_shared_db_lock = threading.Lock()
+
+
+def get_shared_db():
+    """
+    Returns the BrokingDB whose connection pool is shared by all the repositories of this process, it is created as
+    per the configured database mode
+    Returns
+    -------
+    BrokingDB
+    """
+    global _shared_db
+    if _shared_db is None:
+        with _shared_db_lock:
+            if _shared_db is None:
+                _shared_db = create_db(config.DB_MODE)
+    return _shared_db
+
+
+def create_db(mode):
+    """
+    Creates the database of a storage mode
+    Parameters
+    ----------
+    mode: str
+        file or shared_memory
+
+    Returns
+    -------
+    BrokingDB
+    """
+    if mode == 'file':
+        return BrokingDB()
+    if mode == 'shared_memory':
+        from .shared_memory import SharedMemoryDB
+        db = SharedMemoryDB()
+        # writes the last checkpoint when the server stops
+        atexit.register(db.close)
+        return db
+    raise Exception(f'Unknown database mode {mode}, choose one of file, shared_memory')
@@ -1,36 +1,171 @@
-from .db import BrokingDB
+import threading
+import weakref
+from src import config
+from src.metrics import REGISTRY
+from .cache import TTLCache
+from .db import chunks, get_shared_db
+from .models import EQUITY_ROW
+from .statements import in_list_query
+
+
+_equity_caches = weakref.WeakKeyDictionary()
+_equity_caches_lock = threading.Lock()
+
+
+def get_equity_cache(db):
+    """
+    Returns the cache of equity rows of a database, it is shared by all the equity repositories of that database
+    Parameters
+    ----------
+    db: BrokingDB
+        database of the equities
+
+    Returns
+    -------
+    TTLCache
+    """
+    with _equity_caches_lock:
+        cache = _equity_caches.get(db)
+        if cache is None:
+            cache = TTLCache(config.EQUITY_CACHE_SIZE, config.EQUITY_CACHE_TTL)
+            _equity_caches[db] = cache
+        return cache
+
+
+def _equity_cache_stats(name):
+    with _equity_caches_lock:
+        caches = list(_equity_caches.values())
+    return {(): sum(cache.stats()[name] for cache in caches)}
+
+
+REGISTRY.gauge('ebroker_equity_cache_entries', 'Equity rows held by the equity caches',
+               collect=lambda: _equity_cache_stats('size'))
+REGISTRY.gauge('ebroker_equity_cache_hits_total', 'Equity lookups served by the equity caches',
+               collect=lambda: _equity_cache_stats('hits'), metric_type='counter')
+REGISTRY.gauge('ebroker_equity_cache_misses_total', 'Equity lookups read from the database',
+               collect=lambda: _equity_cache_stats('misses'), metric_type='counter')
 
 
 class EquityRepository:
-    def __init__(self):
+    def __init__(self, db=None):
         """
         Class to perform CRUD operation on equity table
+        Parameters
+        ----------
+        db: BrokingDB
+            database to use, defaults to the one shared by all the repositories
         """
-        self.db = BrokingDB()
+        self.db = db if db is not None else get_shared_db()
+
+    @property
+    def cache(self):
+        # looked up on every call as the db of a repository can be swapped
+        return get_equity_cache(self.db)
 
     def get_equity(self, equity_id):
+        cache = self.cache
+        equity = cache.get(equity_id)
+        if equity is not None:
+            return equity
+        generation = cache.generation()
         query = 'SELECT id, name, price FROM equities WHERE id = ?'
-        result_set = self.db.execute_query(query, (equity_id,))
+        result_set = self.db.execute_read(query, (equity_id,), row_factory=EQUITY_ROW)
         if len(result_set):
+            # a row read in a unit of work may never be committed, and one read while the equity changed is stale
+            if not self.db.in_transaction():
+                cache.put(equity_id, result_set[0], generation)
             return result_set[0]
         else:
             return None
 
+    def get_equities(self, equity_ids):
+        cache = self.cache
+        result_set = []
+        missing_ids = []
+        for equity_id in equity_ids:
+            equity = cache.get(equity_id)
+            if equity is None:
+                missing_ids.append(equity_id)
+            else:
+                result_set.append(equity)
+        generation = cache.generation()
+        # cached only outside a unit of work like in get_equity
+        committed = not self.db.in_transaction()
+        for chunk in chunks(missing_ids):
+            query, params = in_list_query('SELECT id, name, price FROM equities WHERE id IN ({})', chunk)
+            for equity in self.db.execute_read(query, params, row_factory=EQUITY_ROW):
+                if committed:
+                    cache.put(equity[0], equity, generation)
+                result_set.append(equity)
+        return result_set
+
     def get_all_equities(self):
         query = 'SELECT id, name, price FROM equities'
-        result_set = self.db.execute_query(query)
+        result_set = self.db.execute_read(query, row_factory=EQUITY_ROW)
         return result_set
 
+    def update_prices(self, prices):
+        """
+        Sets the price of many equities with one statement per equity in a single transaction, an equity given more
+        than once gets its last price. Cached prices are dropped once the new ones are committed.
+        Parameters
+        ----------
+        prices: iterable of tuple
+            (equity id, price) pairs
+
+        Returns
+        -------
+        int
+            num of equities updated, unknown equities are skipped
+        """
+        latest = dict(prices)
+        if not latest:
+            return 0
+        cache = self.cache
+
+        def invalidate():
+            for equity_id in latest:
+                cache.invalidate(equity_id)
+        query = "UPDATE equities SET price = ?, last_modified_on = datetime('now') WHERE id = ?"
+        with self.db.transaction():
+            updated = self.db.execute_many(query, [(price, equity_id) for equity_id, price in latest.items()])
+            # dropped after the commit, a read in between would cache the old price again
+            self.db.after_commit(invalidate)
+        return updated
+
+    def get_equities_page(self, after_id=0, limit=config.STREAM_BATCH_SIZE):
+        """
+        Returns up to limit equities with an id above after_id in id order, the id of the last one is the after_id of
+        the next page
+        Returns
+        -------
+        list of Equity
+        """
+        query = 'SELECT id, name, price FROM equities WHERE id > ? ORDER BY id LIMIT ?'
+        return self.db.execute_read(query, (after_id, limit), row_factory=EQUITY_ROW)
+
+    def stream_equities(self, after_id=0):
+        """
+        Yields the equities with an id above after_id in id order without loading them all at once
+        """
+        query = 'SELECT id, name, price FROM equities WHERE id > ? ORDER BY id'
+        return self.db.stream_read(query, (after_id,), row_factory=EQUITY_ROW)
+
     def add_equity(self, equity):
         name = equity['name']
         price = equity['price']
         query = "INSERT INTO equities (name, price, last_modified_on) VALUES (?, ?, datetime('now'))"
         self.db.execute_query(query, (name, price), is_transactional=True)
+        # id of the new row is not known so the whole cache is dropped once it is committed
+        self.db.after_commit(self.cache.clear)
         return True
 
     def delete_equity(self, equity_id):
         query = 'DELETE FROM equities WHERE id = ?'
         self.db.execute_query(query, (equity_id, ), is_transactional=True)
+        cache = self.cache
+        # dropped after the commit like update_prices does
+        self.db.after_commit(lambda: cache.invalidate(equity_id))
         return True
 
     def update_equity(self, equity):
@@ -39,4 +174,6 @@ class EquityRepository:
         equity_price = equity['price']
         query = "UPDATE equities SET name=?, price = ?, last_modified_on = datetime('now') where id = ?"
         self.db.execute_query(query, (equity_name, equity_price, equity_id), is_transactional=True)
+        cache = self.cache
+        self.db.after_commit(lambda: cache.invalidate(equity_id))
         return True
@@ -0,0 +1,109 @@
+import threading
+import time
+import weakref
+from src import config
+from .cache import TTLCache
+from .db import get_shared_db
+from .models import STORED_RESPONSE_ROW, StoredResponse
+
+
+_idempotency_caches = weakref.WeakKeyDictionary()
+_idempotency_caches_lock = threading.Lock()
+
+
+def get_idempotency_cache(db):
+    """
+    Returns the cache of stored responses of a database, it is shared by all the idempotency repositories of that
+    database
+    Parameters
+    ----------
+    db: BrokingDB
+        database of the idempotency keys
+
+    Returns
+    -------
+    TTLCache
+    """
+    with _idempotency_caches_lock:
+        cache = _idempotency_caches.get(db)
+        if cache is None:
+            ttl = config.IDEMPOTENCY_CACHE_TTL
+            if config.IDEMPOTENCY_KEY_TTL > 0:
+                # a cached response never outlives its key
+                ttl = min(ttl, config.IDEMPOTENCY_KEY_TTL) if ttl > 0 else config.IDEMPOTENCY_KEY_TTL
+            cache = TTLCache(config.IDEMPOTENCY_CACHE_SIZE, ttl)
+            _idempotency_caches[db] = cache
+        return cache
+
+
+class IdempotencyRepository:
+    def __init__(self, db=None, key_ttl=config.IDEMPOTENCY_KEY_TTL):
+        """
+        Class to store the responses of requests sent with an idempotency key in the idempotency_keys table. The most
+        recent responses are also cached in process, so a retry is mostly answered without a query.
+        Parameters
+        ----------
+        db: BrokingDB
+            database to use, defaults to the one shared by all the repositories
+        key_ttl: float
+            seconds a key is kept, 0 or less to keep keys forever
+        """
+        self.db = db if db is not None else get_shared_db()
+        self.key_ttl = key_ttl
+
+    @property
+    def cache(self):
+        # looked up on every call as the db of a repository can be swapped
+        return get_idempotency_cache(self.db)
+
+    def get_response(self, user_id, key):
+        """
+        Returns the stored request and response of an idempotency key of a user
+        Returns
+        -------
+        StoredResponse or None
+        """
+        cache = self.cache
+        stored = cache.get((user_id, key))
+        if stored is not None:
+            return stored
+        query = 'SELECT request, response FROM idempotency_keys WHERE user_id = ? AND key = ? AND created_on > ?'
+        result_set = self.db.execute_read(query, (user_id, key, self.expired_before()),
+                                          row_factory=STORED_RESPONSE_ROW)
+        if len(result_set):
+            cache.put((user_id, key), result_set[0])
+            return result_set[0]
+        return None
+
+    def save_response(self, user_id, key, request, response):
+        """
+        Stores the response of a request sent with an idempotency key, in the running unit of work so that it is
+        committed together with the trade. Expired keys are deleted on the way.
+        Parameters
+        ----------
+        user_id: int
+            id of the user sending the request
+        key: str
+            idempotency key of the request
+        request: str
+            serialized request, a key sent again with another request is rejected
+        response: str
+            response returned to every retry of the request
+        """
+        stored = StoredResponse(request, response)
+        expired_before = self.expired_before()
+        with self.db.transaction():
+            if expired_before > 0:
+                self.db.execute_update('DELETE FROM idempotency_keys WHERE created_on <= ?', (expired_before,))
+            query = """INSERT OR REPLACE INTO idempotency_keys (user_id, key, request, response, created_on)
+                        VALUES (?, ?, ?, ?, ?)"""
+            self.db.execute_update(query, (user_id, key, request, response, time.time()))
+            # cached once committed, a rolled back trade must not answer its retries
+            self.db.after_commit(lambda: self.cache.put((user_id, key), stored))
+        return True
+
+    def expired_before(self):
+        """
+        Returns the creation time at or before which keys are expired
+        """
+        return time.time() - self.key_ttl if self.key_ttl > 0 else 0
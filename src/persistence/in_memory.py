@@ -1,3 +1,4 @@
+from src.persistence import schema
 from src.persistence.db import BrokingDB
 
 
@@ -7,80 +8,23 @@ IN_MEMORY_DB = ':memory:'
 class InMemoryDB(BrokingDB):
     def __init__(self):
         """
-        Class to perform db operation on an in-memory database
+        Class to perform db operation on an in-memory database, reads share its only connection
         """
-        super().__init__()
-        self.database_file = IN_MEMORY_DB
+        super().__init__(IN_MEMORY_DB, pool_size=1, read_pool_size=0)
         self.conn = self.get_connection()
 
     def create_tables(self):
         """
-        Creates required tables for in-memory database
+        Creates required tables and indexes for in-memory database
         """
-        query = """CREATE TABLE IF NOT EXISTS users 
-                    (
-                        id integer PRIMARY KEY,
-                        name text NOT NULL,
-                        balance real NOT NULL,
-                        last_modified_on text NOT NULL
-                    );"""
-        cur = self.conn.cursor()
-        cur.execute(query)
+        schema.create_tables(self.conn)
+        schema.create_indexes(self.conn)
 
-        query = """CREATE TABLE IF NOT EXISTS equities 
-                        (
-                            id integer PRIMARY KEY,
-                            name text NOT NULL,
-                            price real NOT NULL,
-                            last_modified_on text NOT NULL
-                        );"""
-        cur = self.conn.cursor()
-        cur.execute(query)
-
-        query = """CREATE TABLE IF NOT EXISTS user_equity_map 
-                            (
-                                id integer PRIMARY KEY,
-                                user_id integer,
-                                equity_id integer,
-                                total_shares integer NOT NULL,
-                                last_modified_on text NOT NULL,
-                                FOREIGN KEY(user_id) REFERENCES users(id),
-                                FOREIGN KEY(equity_id) REFERENCES equities(id)
-                            );"""
-        cur = self.conn.cursor()
-        cur.execute(query)
-
-    def execute_query(self, query, params=None, is_transactional=False):
+    def _new_connection(self):
         """
-        Executes given SQL query and returns the result. An in-memory db exists till the connection is available. With
-        each new connection a new in-memory db is created.
-        Parameters
-        ----------
-        query: str
-            SQL query
-        params: tuple
-            values to be passed in SQL query at run time
-        is_transactional: bool
-            whether the given query performs some data manipulation like insert, delete, update
-
-        Returns
-        -------
-        list of tuple
+        An in-memory db exists till the connection is available. With each new connection a new in-memory db is
+        created, so the pool always hands out the same connection.
         """
         if not self.conn:
             raise Exception('No connection')
-        try:
-            cur = self.conn.cursor()
-            if params:
-                cur.execute(query, params)
-            else:
-                cur.execute(query)
-            if is_transactional:
-                self.conn.commit()
-                return []
-            else:
-                row = cur.fetchall()
-                return row
-        except Exception as e:
-            print(str(e))
-            raise Exception('Some error occurred while executing the query')
+        return self.conn
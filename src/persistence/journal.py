@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+
+
+class Journal:
+    def __init__(self, path, fsync=False):
+        """
+        Append-only file of JSON entries, one per line, each prefixed by its sequence number. Entries of a commit are
+        written with one write call and flushed together, so a crash loses at most the commit being written, whose
+        partial last line is skipped on read.
+        Parameters
+        ----------
+        path: str
+            path of the journal file
+        fsync: bool
+            whether every append waits for the entries to reach the disk, otherwise they only reach the OS
+        """
+        self.path = path
+        self.fsync = fsync
+        self.sequence = 0
+        self._recover()
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def _recover(self):
+        # finds the last sequence number and cuts off a partially written commit, new entries would follow it
+        if not os.path.exists(self.path):
+            return
+        valid_size = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    self.sequence = json.loads(line)[0]
+                except ValueError:
+                    break
+                valid_size += len(line)
+        if valid_size < os.path.getsize(self.path):
+            os.truncate(self.path, valid_size)
+
+    def append(self, entries):
+        """
+        Appends entries to the journal
+        Parameters
+        ----------
+        entries: list
+            JSON serializable entries
+
+        Returns
+        -------
+        int
+            sequence number of the last entry
+        """
+        if not entries:
+            return self.sequence
+        with self._lock:
+            lines = []
+            for entry in entries:
+                self.sequence += 1
+                lines.append(json.dumps([self.sequence, entry], separators=(',', ':')))
+            self._file.write('\n'.join(lines) + '\n')
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            return self.sequence
+
+    def read(self, after=0):
+        """
+        Yields (sequence, entry) of the entries written after a sequence number
+        Parameters
+        ----------
+        after: int
+            sequence number of the last entry already applied, e.g. the one of a snapshot
+        """
+        return read_entries(self.path, after)
+
+    def sync(self):
+        """
+        Waits for the appended entries to reach the disk
+        """
+        with self._lock:
+            os.fsync(self._file.fileno())
+
+    def rotate(self, path):
+        """
+        Moves the entries written so far to another file and starts an empty journal, sequence numbers continue
+        Parameters
+        ----------
+        path: str
+            path the current journal file is renamed to
+        """
+        with self._lock:
+            self._file.close()
+            os.replace(self.path, path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def truncate(self, sequence=None):
+        """
+        Drops all the entries, once a snapshot holds them. Sequence numbers continue from the last entry.
+        Parameters
+        ----------
+        sequence: int
+            sequence number to continue from, defaults to the one of the last entry
+        """
+        with self._lock:
+            self._file.close()
+            self._file = open(self.path, 'w', encoding='utf-8')
+            if sequence is not None:
+                self.sequence = sequence
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_entries(path, after=0):
+    """
+    Yields (sequence, entry) of the entries of a journal file written after a sequence number
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                if not line.endswith('\n'):
+                    raise ValueError()
+                sequence, entry = json.loads(line)
+            except ValueError:
+                # the commit being written when the process stopped
+                break
+            if sequence > after:
+                yield sequence, entry
+
+
+def write_snapshot(path, state):
+    """
+    Writes a snapshot atomically, a crash while writing leaves the previous snapshot in place
+    Parameters
+    ----------
+    path: str
+        path of the snapshot file
+    state: dict
+        JSON serializable state
+    """
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def read_snapshot(path):
+    """
+    Returns the state of a snapshot or None if there is no snapshot
+    """
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,689 @@
+import atexit
+import heapq
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from src import config
+from .journal import Journal, read_snapshot, write_snapshot
+from .models import Equity, PortfolioRow, Position, StoredResponse, User
+
+
+class LedgerDB:
+    def __init__(self, journal_file=config.LEDGER_JOURNAL_FILE, snapshot_file=config.LEDGER_SNAPSHOT_FILE,
+                 seed_file=config.LEDGER_SEED_FILE, snapshot_every=config.LEDGER_SNAPSHOT_EVERY,
+                 fsync=config.LEDGER_FSYNC):
+        """
+        Memory resident storage engine. Users and equities are kept in dicts keyed by id and positions in arrays
+        indexed by a slot, so a trade is a few dict and array operations instead of SQL statements. Every committed
+        unit of work appends the new values of the rows it changed to a journal, and the state is written to a
+        snapshot after every snapshot_every entries, which lets the journal start over.
+        On startup the state is read from the snapshot, or from the sqlite seed file if there is no snapshot, and the
+        journal entries written after the snapshot are applied on it.
+        Parameters
+        ----------
+        journal_file: str
+            path of the journal, changes are only kept in memory if not given
+        snapshot_file: str
+            path of the snapshot
+        seed_file: str
+            sqlite database the state is read from when there is no snapshot yet
+        snapshot_every: int
+            num of journal entries after which a snapshot is taken, 0 to only take it on close
+        fsync: bool
+            whether a commit waits for its journal entries to reach the disk
+        """
+        self.snapshot_file = snapshot_file
+        self.snapshot_every = snapshot_every
+        self.lock = threading.RLock()
+        self._local = threading.local()
+        self.users = {}
+        self.equities = {}
+        # (user id, equity id) to slot of the position arrays
+        self.position_slots = {}
+        self.slot_of_position_id = {}
+        self.user_slots = {}
+        self.position_ids = array('q')
+        self.position_user_ids = array('q')
+        self.position_equity_ids = array('q')
+        self.position_shares = array('q')
+        self.free_slots = []
+        # (user id, idempotency key) to (request, response, created on) in creation order
+        self.idempotency_keys = {}
+        # sequence to trade event waiting to be appended to the trade event log
+        self.outbox = {}
+        self.next_outbox_sequence = 1
+        self.next_user_id = 1
+        self.next_equity_id = 1
+        self.next_position_id = 1
+        # inverse entries and journal entries of the running unit of work
+        self._undo = []
+        self._pending = []
+        self._since_snapshot = 0
+        snapshot = read_snapshot(snapshot_file)
+        sequence = 0
+        if snapshot is not None:
+            self._load_snapshot(snapshot)
+            sequence = snapshot['sequence']
+        elif seed_file and os.path.exists(seed_file):
+            self._load_sqlite(seed_file)
+        self.journal = None
+        if journal_file:
+            self.journal = Journal(journal_file, fsync=fsync)
+            for _, entry in self.journal.read(after=sequence):
+                self._apply(entry)
+                self._since_snapshot += 1
+            self.journal.sequence = max(self.journal.sequence, sequence)
+
+    def _load_snapshot(self, snapshot):
+        for user in snapshot['users']:
+            self._apply(['user', *user])
+        for equity in snapshot['equities']:
+            self._apply(['equity', *equity])
+        for position in snapshot['positions']:
+            self._apply(['position', *position])
+        for idempotency_key in snapshot.get('idempotency_keys', ()):
+            self._apply(['idempotency_key', *idempotency_key])
+        for outbox_event in snapshot.get('outbox', ()):
+            self._apply(['outbox_event', *outbox_event])
+
+    def _load_sqlite(self, seed_file):
+        conn = sqlite3.connect(seed_file)
+        try:
+            for user in conn.execute('SELECT id, name, balance FROM users'):
+                self._apply(['user', *user])
+            for equity in conn.execute('SELECT id, name, price FROM equities'):
+                self._apply(['equity', *equity])
+            for position in conn.execute('SELECT id, user_id, equity_id, total_shares FROM user_equity_map'):
+                self._apply(['position', *position])
+        finally:
+            conn.close()
+
+    def close(self):
+        """
+        Takes a last snapshot and closes the journal
+        """
+        with self.lock:
+            if self.journal is not None:
+                if self.snapshot_file:
+                    self.snapshot()
+                self.journal.close()
+                self.journal = None
+
+    def in_transaction(self):
+        """
+        Returns whether the current thread is running inside a unit of work
+        """
+        return getattr(self._local, 'depth', 0) > 0
+
+    @contextmanager
+    def transaction(self):
+        """
+        Unit of work holding the ledger lock, its changes are undone if it fails and journaled once the outermost unit
+        of work ends. A nested unit of work is undone on its own, like a savepoint.
+        """
+        callbacks = None
+        with self.lock:
+            depth = getattr(self._local, 'depth', 0)
+            if not depth:
+                self._local.after_commit = []
+            mark = (len(self._undo), len(self._pending), len(self._local.after_commit))
+            self._local.depth = depth + 1
+            try:
+                yield self
+            except BaseException:
+                self._rollback(mark)
+                raise
+            finally:
+                self._local.depth = depth
+            if not depth:
+                self._commit()
+                callbacks, self._local.after_commit = self._local.after_commit, []
+        for callback in callbacks or ():
+            callback()
+
+    def after_commit(self, callback):
+        """
+        Runs a callback once the running unit of work is committed, or right away outside of a unit of work. The
+        callbacks of a unit of work which is rolled back are dropped.
+        """
+        if self.in_transaction():
+            self._local.after_commit.append(callback)
+        else:
+            callback()
+
+    def _commit(self):
+        entries = self._pending
+        self._pending = []
+        if self.journal is not None and entries:
+            try:
+                self.journal.append(entries)
+            except Exception:
+                self._pending = entries
+                self._rollback((0, 0, 0))
+                raise
+            self._since_snapshot += len(entries)
+        self._undo = []
+        if self.snapshot_every and self.snapshot_file and self._since_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    def _rollback(self, mark):
+        undo_size, pending_size, callbacks_size = mark
+        while len(self._undo) > undo_size:
+            entry = self._undo.pop()
+            if entry is not None:
+                self._apply(entry)
+        del self._pending[pending_size:]
+        del self._local.after_commit[callbacks_size:]
+
+    def snapshot(self):
+        """
+        Writes the state to the snapshot file and starts the journal over
+        """
+        with self.lock:
+            if self.in_transaction():
+                raise Exception('Cannot take a snapshot inside a unit of work')
+            if not self.snapshot_file:
+                raise Exception('No snapshot file configured')
+            write_snapshot(self.snapshot_file, {
+                'sequence': self.journal.sequence if self.journal is not None else 0,
+                'users': [list(user) for user in self.users.values()],
+                'equities': [list(equity) for equity in self.equities.values()],
+                'positions': [list(self.position(slot)) for slot in self.position_slots.values()],
+                'idempotency_keys': [[user_id, key, *value] for (user_id, key), value in self.idempotency_keys.items()],
+                'outbox': [[sequence, event] for sequence, event in self.outbox.items()],
+            })
+            if self.journal is not None:
+                self.journal.truncate()
+            self._since_snapshot = 0
+
+    def write(self, entry):
+        """
+        Applies a change inside the running unit of work
+        Parameters
+        ----------
+        entry: list
+            operation and its values: user, delete_user, equity, delete_equity, position, delete_position,
+            idempotency_key, delete_idempotency_key, outbox_event or delete_outbox_event
+        """
+        if not self.in_transaction():
+            raise Exception('Ledger changes need a unit of work')
+        self._undo.append(self._inverse(entry))
+        self._pending.append(entry)
+        self._apply(entry)
+
+    def _inverse(self, entry):
+        operation = entry[0]
+        if operation in ('user', 'delete_user'):
+            user = self.users.get(entry[1])
+            return ['user', *user] if user is not None else (['delete_user', entry[1]] if operation == 'user' else None)
+        if operation in ('equity', 'delete_equity'):
+            equity = self.equities.get(entry[1])
+            if equity is not None:
+                return ['equity', *equity]
+            return ['delete_equity', entry[1]] if operation == 'equity' else None
+        if operation in ('idempotency_key', 'delete_idempotency_key'):
+            value = self.idempotency_keys.get((entry[1], entry[2]))
+            if value is not None:
+                return ['idempotency_key', entry[1], entry[2], *value]
+            return ['delete_idempotency_key', entry[1], entry[2]] if operation == 'idempotency_key' else None
+        if operation in ('outbox_event', 'delete_outbox_event'):
+            event = self.outbox.get(entry[1])
+            if event is not None:
+                return ['outbox_event', entry[1], event]
+            return ['delete_outbox_event', entry[1]] if operation == 'outbox_event' else None
+        key = (entry[2], entry[3]) if operation == 'position' else (entry[1], entry[2])
+        slot = self.position_slots.get(key)
+        if slot is not None:
+            return ['position', *self.position(slot)]
+        return ['delete_position', *key] if operation == 'position' else None
+
+    def _apply(self, entry):
+        operation = entry[0]
+        if operation == 'user':
+            _, user_id, name, balance = entry
+            self.users[user_id] = User(user_id, name, balance)
+            self.next_user_id = max(self.next_user_id, user_id + 1)
+        elif operation == 'delete_user':
+            self.users.pop(entry[1], None)
+        elif operation == 'equity':
+            _, equity_id, name, price = entry
+            self.equities[equity_id] = Equity(equity_id, name, price)
+            self.next_equity_id = max(self.next_equity_id, equity_id + 1)
+        elif operation == 'delete_equity':
+            self.equities.pop(entry[1], None)
+        elif operation == 'position':
+            self._set_position(*entry[1:])
+        elif operation == 'delete_position':
+            self._delete_position(entry[1], entry[2])
+        elif operation == 'idempotency_key':
+            _, user_id, key, request, response, created_on = entry
+            # moved to the end so that the keys stay in creation order
+            self.idempotency_keys.pop((user_id, key), None)
+            self.idempotency_keys[(user_id, key)] = (request, response, created_on)
+        elif operation == 'delete_idempotency_key':
+            self.idempotency_keys.pop((entry[1], entry[2]), None)
+        elif operation == 'outbox_event':
+            _, sequence, event = entry
+            self.outbox[sequence] = event
+            self.next_outbox_sequence = max(self.next_outbox_sequence, sequence + 1)
+        elif operation == 'delete_outbox_event':
+            self.outbox.pop(entry[1], None)
+        else:
+            raise Exception(f'Unknown ledger operation {operation}')
+
+    def _set_position(self, position_id, user_id, equity_id, total_shares):
+        slot = self.position_slots.get((user_id, equity_id))
+        if slot is None:
+            if self.free_slots:
+                slot = self.free_slots.pop()
+            else:
+                slot = len(self.position_ids)
+                for column in (self.position_ids, self.position_user_ids, self.position_equity_ids,
+                               self.position_shares):
+                    column.append(0)
+            self.position_slots[(user_id, equity_id)] = slot
+            self.user_slots.setdefault(user_id, set()).add(slot)
+            self.position_user_ids[slot] = user_id
+            self.position_equity_ids[slot] = equity_id
+        else:
+            self.slot_of_position_id.pop(self.position_ids[slot], None)
+        self.position_ids[slot] = position_id
+        self.slot_of_position_id[position_id] = slot
+        self.position_shares[slot] = total_shares
+        self.next_position_id = max(self.next_position_id, position_id + 1)
+
+    def _delete_position(self, user_id, equity_id):
+        slot = self.position_slots.pop((user_id, equity_id), None)
+        if slot is None:
+            return
+        slots = self.user_slots[user_id]
+        slots.discard(slot)
+        if not slots:
+            del self.user_slots[user_id]
+        self.slot_of_position_id.pop(self.position_ids[slot], None)
+        self.free_slots.append(slot)
+
+    def position(self, slot):
+        """
+        Returns the position held in a slot
+        Returns
+        -------
+        Position
+        """
+        return Position(self.position_ids[slot], self.position_user_ids[slot], self.position_equity_ids[slot],
+                        self.position_shares[slot])
+
+
+class LedgerRepository:
+    def __init__(self, db=None):
+        """
+        Parameters
+        ----------
+        db: LedgerDB
+            ledger to use, defaults to the one shared by all the repositories
+        """
+        self.db = db if db is not None else get_shared_ledger()
+
+    def page(self, rows, after_id, limit, get_row):
+        """
+        Returns the rows of the up to limit smallest ids above after_id of a dict keyed by id
+        """
+        with self.db.lock:
+            row_ids = heapq.nsmallest(limit, (row_id for row_id in rows if row_id > after_id))
+            return [get_row(row_id) for row_id in row_ids]
+
+    def stream(self, rows, after_id, get_row, batch_size=config.STREAM_BATCH_SIZE):
+        """
+        Yields the rows with an id above after_id of a dict keyed by id in id order. The ids are sorted once and the
+        rows are read batch_size at a time, rows deleted meanwhile are skipped.
+        """
+        with self.db.lock:
+            row_ids = sorted(row_id for row_id in rows if row_id > after_id)
+        for start in range(0, len(row_ids), batch_size):
+            with self.db.lock:
+                batch = [get_row(row_id) for row_id in row_ids[start:start + batch_size] if row_id in rows]
+            yield from batch
+
+
+class LedgerUserRepository(LedgerRepository):
+    """
+    UserRepository on the ledger
+    """
+
+    def get_user(self, user_id):
+        # the lock keeps out changes of a running unit of work of another thread
+        with self.db.lock:
+            return self.db.users.get(user_id)
+
+    def get_users(self, user_ids):
+        users = self.db.users
+        with self.db.lock:
+            return [users[user_id] for user_id in user_ids if user_id in users]
+
+    def get_all_users(self):
+        with self.db.lock:
+            return list(self.db.users.values())
+
+    def get_users_page(self, after_id=0, limit=config.STREAM_BATCH_SIZE):
+        return self.page(self.db.users, after_id, limit, self.db.users.get)
+
+    def stream_users(self, after_id=0):
+        return self.stream(self.db.users, after_id, self.db.users.get)
+
+    def add_user(self, user):
+        with self.db.transaction():
+            self.db.write(['user', self.db.next_user_id, user['name'], user['balance']])
+        return True
+
+    def delete_user(self, user_id):
+        with self.db.transaction():
+            self.db.write(['delete_user', user_id])
+        return True
+
+    def update_user(self, user):
+        with self.db.transaction():
+            if user['id'] in self.db.users:
+                self.db.write(['user', user['id'], user['name'], user['balance']])
+        return True
+
+    def debit_balance(self, user_id, amount):
+        """
+        Deducts given amount from user balance only if the balance covers it
+        Returns
+        -------
+        bool
+            False when the user does not exist or has insufficient balance
+        """
+        with self.db.transaction():
+            user = self.db.users.get(user_id)
+            if user is None or user.balance < amount:
+                return False
+            self.db.write(['user', user_id, user.name, user.balance - amount])
+        return True
+
+    def credit_balance(self, user_id, amount):
+        """
+        Adds given amount to user balance
+        Returns
+        -------
+        bool
+            False when the user does not exist
+        """
+        with self.db.transaction():
+            user = self.db.users.get(user_id)
+            if user is None:
+                return False
+            self.db.write(['user', user_id, user.name, user.balance + amount])
+        return True
+
+    def credit_balances(self, amounts):
+        """
+        Adds amount to the balance of many users at once
+        Parameters
+        ----------
+        amounts: list of tuple
+            (user id, amount) pairs, amount is negative for a deduction
+        """
+        with self.db.transaction():
+            for user_id, amount in amounts:
+                self.credit_balance(user_id, amount)
+        return True
+
+
+class LedgerEquityRepository(LedgerRepository):
+    """
+    EquityRepository on the ledger
+    """
+
+    def get_equity(self, equity_id):
+        with self.db.lock:
+            return self.db.equities.get(equity_id)
+
+    def get_equities(self, equity_ids):
+        equities = self.db.equities
+        with self.db.lock:
+            return [equities[equity_id] for equity_id in equity_ids if equity_id in equities]
+
+    def get_all_equities(self):
+        with self.db.lock:
+            return list(self.db.equities.values())
+
+    def update_prices(self, prices):
+        latest = dict(prices)
+        updated = 0
+        with self.db.transaction():
+            for equity_id, price in latest.items():
+                equity = self.db.equities.get(equity_id)
+                if equity is not None:
+                    self.db.write(['equity', equity_id, equity.name, price])
+                    updated += 1
+        return updated
+
+    def get_equities_page(self, after_id=0, limit=config.STREAM_BATCH_SIZE):
+        return self.page(self.db.equities, after_id, limit, self.db.equities.get)
+
+    def stream_equities(self, after_id=0):
+        return self.stream(self.db.equities, after_id, self.db.equities.get)
+
+    def add_equity(self, equity):
+        with self.db.transaction():
+            self.db.write(['equity', self.db.next_equity_id, equity['name'], equity['price']])
+        return True
+
+    def delete_equity(self, equity_id):
+        with self.db.transaction():
+            self.db.write(['delete_equity', equity_id])
+        return True
+
+    def update_equity(self, equity):
+        with self.db.transaction():
+            if equity['id'] in self.db.equities:
+                self.db.write(['equity', equity['id'], equity['name'], equity['price']])
+        return True
+
+
+class LedgerUserEquityMapRepository(LedgerRepository):
+    """
+    UserEquityMapRepository on the ledger
+    """
+
+    def get_user_equity(self, user_equity_id):
+        with self.db.lock:
+            slot = self.db.slot_of_position_id.get(user_equity_id)
+            return self.db.position(slot) if slot is not None else None
+
+    def get_user_equity_mapping_id(self, user_id, equity_id):
+        position = self.get_position(user_id, equity_id)
+        return position.id if position is not None else None
+
+    def get_position(self, user_id, equity_id):
+        with self.db.lock:
+            slot = self.db.position_slots.get((user_id, equity_id))
+            return self.db.position(slot) if slot is not None else None
+
+    def get_positions(self, user_equity_pairs):
+        slots = self.db.position_slots
+        with self.db.lock:
+            return [self.db.position(slots[pair]) for pair in user_equity_pairs if pair in slots]
+
+    def get_all_positions(self):
+        with self.db.lock:
+            return [self.db.position(slot) for slot in self.db.position_slots.values()]
+
+    def get_positions_page(self, after_id=0, limit=config.STREAM_BATCH_SIZE):
+        return self.page(self.db.slot_of_position_id, after_id, limit, self.get_user_equity)
+
+    def stream_positions(self, after_id=0):
+        return self.stream(self.db.slot_of_position_id, after_id, self.get_user_equity)
+
+    def get_portfolio(self, user_id):
+        """
+        Returns the same rows as UserEquityMapRepository.get_portfolio
+        Returns
+        -------
+        list of PortfolioRow
+        """
+        with self.db.lock:
+            user = self.db.users.get(user_id)
+            if user is None:
+                return []
+            positions = sorted((self.db.position(slot) for slot in self.db.user_slots.get(user_id, ())),
+                               key=lambda position: position.equity_id)
+            if not positions:
+                return [PortfolioRow(user_id, user.balance, None, None, None, None)]
+            rows = []
+            for position in positions:
+                equity = self.db.equities.get(position.equity_id)
+                rows.append(PortfolioRow(user_id, user.balance, position.equity_id,
+                                         equity.name if equity is not None else None, position.total_shares,
+                                         equity.price if equity is not None else None))
+            return rows
+
+    def upsert_position(self, user_id, equity_id, shares):
+        """
+        Adds given num of shares to the position of a user in an equity, the position is created if the user does not
+        hold the equity yet and removed once its shares reach zero
+        """
+        with self.db.transaction():
+            position = self.get_position(user_id, equity_id)
+            if position is None:
+                position = Position(self.db.next_position_id, user_id, equity_id, 0)
+            total_shares = position.total_shares + shares
+            if total_shares <= 0 and shares < 0:
+                self.db.write(['delete_position', user_id, equity_id])
+            else:
+                self.db.write(['position', position.id, user_id, equity_id, total_shares])
+        return True
+
+    def remove_shares(self, user_id, equity_id, shares):
+        """
+        Removes given num of shares from the position of a user only if the position holds them
+        Returns
+        -------
+        bool
+            False when the user does not hold the equity or holds fewer shares
+        """
+        with self.db.transaction():
+            position = self.get_position(user_id, equity_id)
+            if position is None or position.total_shares < shares:
+                return False
+            self.upsert_position(user_id, equity_id, -shares)
+        return True
+
+    def upsert_positions(self, shares):
+        """
+        Adds shares to many positions at once
+        Parameters
+        ----------
+        shares: list of tuple
+            (user id, equity id, num of shares) triples, num of shares is negative to remove shares
+        """
+        with self.db.transaction():
+            for user_id, equity_id, num_of_shares in shares:
+                self.upsert_position(user_id, equity_id, num_of_shares)
+        return True
+
+    def add_user_equity(self, user_equity):
+        with self.db.transaction():
+            self.db.write(['position', self.db.next_position_id, user_equity['user_id'], user_equity['equity_id'],
+                           user_equity['total_shares']])
+        return True
+
+    def delete_user_equity_map(self, user_equity_map_id):
+        with self.db.transaction():
+            position = self.get_user_equity(user_equity_map_id)
+            if position is not None:
+                self.db.write(['delete_position', position.user_id, position.equity_id])
+        return True
+
+    def update_equity(self, user_equity):
+        with self.db.transaction():
+            position = self.get_user_equity(user_equity['id'])
+            if position is not None:
+                self.db.write(['delete_position', position.user_id, position.equity_id])
+                self.db.write(['position', position.id, user_equity['user_id'], user_equity['equity_id'],
+                               user_equity['total_shares']])
+        return True
+
+
+class LedgerIdempotencyRepository(LedgerRepository):
+    """
+    IdempotencyRepository on the ledger, keys are looked up in a dict so they are not cached again
+    """
+
+    def __init__(self, db=None, key_ttl=config.IDEMPOTENCY_KEY_TTL):
+        super().__init__(db)
+        self.key_ttl = key_ttl
+
+    def get_response(self, user_id, key):
+        with self.db.lock:
+            value = self.db.idempotency_keys.get((user_id, key))
+        if value is None or (self.key_ttl > 0 and value[2] <= time.time() - self.key_ttl):
+            return None
+        return StoredResponse(value[0], value[1])
+
+    def save_response(self, user_id, key, request, response):
+        with self.db.transaction():
+            if self.key_ttl > 0:
+                expired_before = time.time() - self.key_ttl
+                expired = []
+                for expired_key, (_, _, created_on) in self.db.idempotency_keys.items():
+                    if created_on > expired_before:
+                        break
+                    expired.append(expired_key)
+                for expired_key in expired:
+                    self.db.write(['delete_idempotency_key', *expired_key])
+            self.db.write(['idempotency_key', user_id, key, request, response, time.time()])
+        return True
+
+
+class LedgerOutboxRepository(LedgerRepository):
+    """
+    OutboxRepository on the ledger, an event takes its sequence under the ledger lock held by the unit of work of its
+    trade
+    """
+
+    def add_events(self, events):
+        with self.db.transaction():
+            for event in events:
+                self.db.write(['outbox_event', self.db.next_outbox_sequence, event])
+        return True
+
+    def relay(self, record, batch_size=config.STREAM_BATCH_SIZE):
+        while True:
+            with self.db.lock:
+                sequences = heapq.nsmallest(batch_size, self.db.outbox)
+                events = [self.db.outbox[sequence] for sequence in sequences]
+            if not sequences:
+                return
+            # written without the ledger lock so that trades go on meanwhile
+            record(events)
+            with self.db.transaction():
+                for sequence in sequences:
+                    self.db.write(['delete_outbox_event', sequence])
+            if len(sequences) < batch_size:
+                return
+
+
+_shared_ledger = None
+_shared_ledger_lock = threading.Lock()
+
+
+def get_shared_ledger():
+    """
+    Returns the ledger shared by all the ledger repositories of this process
+    Returns
+    -------
+    LedgerDB
+    """
+    global _shared_ledger
+    if _shared_ledger is None:
+        with _shared_ledger_lock:
+            if _shared_ledger is None:
+                _shared_ledger = LedgerDB()
+                # snapshots the state when the server stops
+                atexit.register(_shared_ledger.close)
+    return _shared_ledger
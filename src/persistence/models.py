@@ -0,0 +1,78 @@
+from typing import NamedTuple, Optional
+
+
+class User(NamedTuple):
+    id: int
+    name: str
+    balance: float
+
+
+class Equity(NamedTuple):
+    id: int
+    name: str
+    price: float
+
+
+class Position(NamedTuple):
+    id: int
+    user_id: int
+    equity_id: int
+    total_shares: int
+
+
+class VersionedUser(NamedTuple):
+    id: int
+    name: str
+    balance: float
+    version: int
+
+
+class VersionedPosition(NamedTuple):
+    id: int
+    user_id: int
+    equity_id: int
+    total_shares: int
+    version: int
+
+
+class PortfolioRow(NamedTuple):
+    user_id: int
+    balance: float
+    equity_id: Optional[int]
+    equity_name: Optional[str]
+    total_shares: Optional[int]
+    price: Optional[float]
+
+
+class StoredResponse(NamedTuple):
+    request: str
+    response: str
+
+
+def row_factory(model):
+    """
+    Returns a sqlite3 row factory building rows of a model. Models are tuples without instance dict, so rows are built
+    straight from the values sqlite returns and can still be indexed like plain tuples.
+    Parameters
+    ----------
+    model: type
+        one of User, Equity, Position or PortfolioRow
+
+    Returns
+    -------
+    callable
+    """
+    new = tuple.__new__
+
+    def build(cursor, row):
+        return new(model, row)
+    return build
+
+
+USER_ROW = row_factory(User)
+EQUITY_ROW = row_factory(Equity)
+POSITION_ROW = row_factory(Position)
+PORTFOLIO_ROW = row_factory(PortfolioRow)
+VERSIONED_USER_ROW = row_factory(VersionedUser)
+VERSIONED_POSITION_ROW = row_factory(VersionedPosition)
+STORED_RESPONSE_ROW = row_factory(StoredResponse)
@@ -0,0 +1,53 @@
+import json
+from src import config
+from .db import get_shared_db
+
+
+class OutboxRepository:
+    def __init__(self, db=None):
+        """
+        Class to keep trade events in the trade_outbox table until they are appended to the trade event log. An event
+        is inserted by the unit of work of its trade, so it is committed or rolled back with the trade and gets its
+        sequence number while the trade holds the write lock, which orders the events of the outbox as their trades
+        were committed.
+        Parameters
+        ----------
+        db: BrokingDB
+            database to use, defaults to the one shared by all the repositories
+        """
+        self.db = db if db is not None else get_shared_db()
+
+    def add_events(self, events):
+        """
+        Adds trade events to the outbox in the running unit of work
+        Parameters
+        ----------
+        events: list of dict
+            buy, sell and fund events
+        """
+        self.db.execute_many('INSERT INTO trade_outbox (event) VALUES (?)',
+                             [(json.dumps(event, separators=(',', ':')),) for event in events])
+        return True
+
+    def relay(self, record, batch_size=config.STREAM_BATCH_SIZE):
+        """
+        Hands the events of the outbox to record in sequence order, batch_size events at a time, and deletes every
+        batch once record returns. The events are read without a unit of work, so the write lock is not held while
+        record writes them. Events left over by a stop are relayed first, a stop between record and the delete hands
+        the batch over again. Only one caller may relay an outbox at a time.
+        Parameters
+        ----------
+        record: callable
+            called with the list of events of every batch
+        batch_size: int
+            maximum num of events handed to record at once
+        """
+        while True:
+            rows = self.db.execute_read('SELECT sequence, event FROM trade_outbox ORDER BY sequence LIMIT ?',
+                                        (batch_size,))
+            if not rows:
+                return
+            record([json.loads(event) for _, event in rows])
+            self.db.execute_update('DELETE FROM trade_outbox WHERE sequence <= ?', (rows[-1][0],))
+            if len(rows) < batch_size:
+                return
@@ -0,0 +1,196 @@
+import threading
+import time
+
+
+class ConnectionPool:
+    def __init__(self, connect, max_size=5, checkout_timeout=10.0, health_check_interval=30.0):
+        """
+        Thread safe pool of database connections. A thread keeps the same connection till it releases it as many times
+        as it acquired it, so nested repository calls made by one thread share a single connection.
+        Parameters
+        ----------
+        connect: callable
+            creates a new connection when the pool has no idle one
+        max_size: int
+            maximum num of connections the pool can open
+        checkout_timeout: float
+            seconds to wait for a connection when all of them are checked out
+        health_check_interval: float
+            idle seconds after which a connection is pinged before handing it out again
+        """
+        if max_size < 1:
+            raise Exception('Pool size should be at least one')
+        self.connect = connect
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self._condition = threading.Condition()
+        self._local = threading.local()
+        # idle connections as (connection, id of the thread which released it, release time)
+        self._idle = []
+        # checked out connections to [num of times acquired, id of the thread which checked it out]
+        self._checkouts = {}
+        self._connections = set()
+        self._closed = False
+
+    @property
+    def size(self):
+        """
+        Returns num of connections currently opened by the pool
+        """
+        return len(self._connections)
+
+    @property
+    def idle_count(self):
+        """
+        Returns num of connections waiting in the pool to be checked out
+        """
+        return len(self._idle)
+
+    def current_connection(self):
+        """
+        Returns connection checked out by the current thread or None
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return None
+        checkout = self._checkouts.get(conn)
+        if checkout is None or checkout[1] != threading.get_ident():
+            # released by another thread meanwhile
+            self._local.conn = None
+            return None
+        return conn
+
+    def acquire(self):
+        """
+        Checks out a connection for the current thread
+        Returns
+        -------
+        sqlite3.Connection
+        """
+        conn = self.current_connection()
+        if conn is not None:
+            with self._condition:
+                self._checkouts[conn][0] += 1
+            return conn
+        conn = self._checkout()
+        with self._condition:
+            self._checkouts[conn] = [1, threading.get_ident()]
+        self._local.conn = conn
+        return conn
+
+    def release(self, conn):
+        """
+        Returns a connection back to the pool once it is released as many times as it was acquired. Any thread can
+        release it, a stream started on one thread and closed on another one hands its connection back all the same.
+        Parameters
+        ----------
+        conn: sqlite3.Connection
+            connection returned by acquire
+        """
+        with self._condition:
+            checkout = self._checkouts.get(conn)
+            if checkout is None:
+                print('Released a connection which is not checked out')
+                return
+            checkout[0] -= 1
+            if checkout[0] > 0:
+                return
+            del self._checkouts[conn]
+        if getattr(self._local, 'conn', None) is conn:
+            self._local.conn = None
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception as e:
+            print(str(e))
+            self._discard(conn)
+            return
+        with self._condition:
+            if self._closed:
+                self._connections.discard(conn)
+                conn.close()
+            else:
+                self._idle.append((conn, threading.get_ident(), time.monotonic()))
+            self._condition.notify()
+
+    def close(self):
+        """
+        Closes all the idle connections and refuses further checkouts
+        """
+        with self._condition:
+            self._closed = True
+            for conn, _, _ in self._idle:
+                self._connections.discard(conn)
+                conn.close()
+            self._idle = []
+            self._condition.notify_all()
+
+    def _checkout(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise Exception('Connection pool is closed')
+                if self._idle:
+                    conn, last_used_on = self._take_idle()
+                    if self._is_healthy(conn, last_used_on):
+                        return conn
+                    self._connections.discard(conn)
+                    continue
+                if len(self._connections) < self.max_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise Exception('Timed out while waiting for a database connection')
+                self._condition.wait(remaining)
+            # reserve the slot so that other threads don't open more than max_size connections
+            placeholder = object()
+            self._connections.add(placeholder)
+        try:
+            conn = self.connect()
+        except Exception:
+            with self._condition:
+                self._connections.discard(placeholder)
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._connections.discard(placeholder)
+            self._connections.add(conn)
+        return conn
+
+    def _take_idle(self):
+        """
+        Picks the connection last used by the current thread if there is one, otherwise the most recently used one
+        """
+        thread_id = threading.get_ident()
+        index = len(self._idle) - 1
+        for position in range(len(self._idle) - 1, -1, -1):
+            if self._idle[position][1] == thread_id:
+                index = position
+                break
+        conn, _, last_used_on = self._idle.pop(index)
+        return conn, last_used_on
+
+    def _is_healthy(self, conn, last_used_on):
+        if time.monotonic() - last_used_on < self.health_check_interval:
+            return True
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except Exception as e:
+            print(str(e))
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return False
+
+    def _discard(self, conn):
+        with self._condition:
+            self._connections.discard(conn)
+            self._condition.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
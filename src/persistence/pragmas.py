@@ -0,0 +1,76 @@
+PRAGMA_PROFILES = {
+    # every commit is fsynced, nothing is lost even on a power failure
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'mmap_size': 0,
+        'cache_size': -8000,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,
+    },
+    # WAL is fsynced only on checkpoints, the last commits can be lost on a power failure but never corrupted
+    'balanced': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 64 * 1024 * 1024,
+        'cache_size': -32000,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+    # no fsync at all, meant for simulations and bulk loads
+    'throughput': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -128000,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000,
+    },
+}
+
+DEFAULT_PROFILE = 'durable'
+
+
+def get_pragma_profile(profile):
+    """
+    Returns the pragmas of a named profile
+    Parameters
+    ----------
+    profile: str
+        one of durable, balanced or throughput
+
+    Returns
+    -------
+    dict
+    """
+    try:
+        return PRAGMA_PROFILES[profile]
+    except KeyError:
+        raise Exception(f'Unknown pragma profile {profile}, choose one of {", ".join(PRAGMA_PROFILES)}')
+
+
+def apply_pragma_profile(conn, profile=DEFAULT_PROFILE, read_only=False):
+    """
+    Applies the pragmas of a named profile on a connection
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        connection to configure
+    profile: str
+        one of durable, balanced or throughput
+    read_only: bool
+        whether the connection only reads, it then keeps the journal mode set by the writers and refuses to write
+    """
+    pragmas = get_pragma_profile(profile)
+    cur = conn.cursor()
+    # busy_timeout goes first so that switching the journal mode waits for other connections
+    cur.execute(f"PRAGMA busy_timeout = {int(pragmas['busy_timeout'])}")
+    if read_only:
+        cur.execute('PRAGMA query_only = ON')
+    else:
+        cur.execute(f"PRAGMA journal_mode = {pragmas['journal_mode']}")
+        cur.execute(f"PRAGMA synchronous = {pragmas['synchronous']}")
+    cur.execute(f"PRAGMA mmap_size = {int(pragmas['mmap_size'])}")
+    cur.execute(f"PRAGMA cache_size = {int(pragmas['cache_size'])}")
+    cur.execute(f"PRAGMA temp_store = {pragmas['temp_store']}")
+    cur.close()
@@ -0,0 +1,127 @@
+TABLES = [
+    """CREATE TABLE IF NOT EXISTS users
+        (
+            id integer PRIMARY KEY,
+            name text NOT NULL,
+            balance real NOT NULL,
+            last_modified_on text NOT NULL,
+            version integer NOT NULL DEFAULT 0
+        );""",
+    """CREATE TABLE IF NOT EXISTS equities
+        (
+            id integer PRIMARY KEY,
+            name text NOT NULL,
+            price real NOT NULL,
+            last_modified_on text NOT NULL
+        );""",
+    """CREATE TABLE IF NOT EXISTS user_equity_map
+        (
+            id integer PRIMARY KEY,
+            user_id integer,
+            equity_id integer,
+            total_shares integer NOT NULL,
+            last_modified_on text NOT NULL,
+            version integer NOT NULL DEFAULT 0,
+            FOREIGN KEY(user_id) REFERENCES users(id),
+            FOREIGN KEY(equity_id) REFERENCES equities(id)
+        );""",
+    """CREATE TABLE IF NOT EXISTS idempotency_keys
+        (
+            user_id integer NOT NULL,
+            key text NOT NULL,
+            request text NOT NULL,
+            response text NOT NULL,
+            created_on real NOT NULL,
+            PRIMARY KEY(user_id, key)
+        );""",
+    # trade events waiting to be appended to the trade event log, in the order their trades were committed
+    """CREATE TABLE IF NOT EXISTS trade_outbox
+        (
+            sequence integer PRIMARY KEY AUTOINCREMENT,
+            event text NOT NULL
+        );""",
+]
+
+# columns added after their table was first released, added to the tables of an older database
+COLUMNS = [
+    # bumped by every change of a row, an optimistic update only applies on the version it read
+    ('users', 'version', 'integer NOT NULL DEFAULT 0'),
+    ('user_equity_map', 'version', 'integer NOT NULL DEFAULT 0'),
+]
+
+INDEXES = [
+    # a user holds one position per equity, it is looked up on every buy and sell
+    """CREATE UNIQUE INDEX IF NOT EXISTS user_equity_map_user_id_equity_id
+        ON user_equity_map (user_id, equity_id);""",
+    # expired idempotency keys are deleted oldest first
+    """CREATE INDEX IF NOT EXISTS idempotency_keys_created_on
+        ON idempotency_keys (created_on);""",
+]
+
+
+def create_tables(conn):
+    """
+    Creates required tables for ebroker
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        connection to the database
+    """
+    cur = conn.cursor()
+    for query in TABLES:
+        cur.execute(query)
+    for table, column, definition in COLUMNS:
+        if column not in [row[1] for row in cur.execute(f'PRAGMA table_info({table})')]:
+            cur.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    conn.commit()
+
+
+def merge_duplicate_positions(conn):
+    """
+    Merges the positions of a user in the same equity into one row so that the unique index can be built on a database
+    created before it existed
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        connection to the database
+    """
+    cur = conn.cursor()
+    cur.execute("""UPDATE user_equity_map
+                    SET total_shares = (SELECT SUM(m.total_shares) FROM user_equity_map m
+                                        WHERE m.user_id = user_equity_map.user_id
+                                        AND m.equity_id = user_equity_map.equity_id)
+                    WHERE id IN (SELECT MIN(id) FROM user_equity_map GROUP BY user_id, equity_id
+                                 HAVING COUNT(*) > 1)""")
+    cur.execute("""DELETE FROM user_equity_map
+                    WHERE id NOT IN (SELECT MIN(id) FROM user_equity_map GROUP BY user_id, equity_id)""")
+    conn.commit()
+
+
+def create_indexes(conn):
+    """
+    Creates the indexes of ebroker tables
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        connection to the database
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'user_equity_map_user_id_equity_id'")
+    if cur.fetchone() is None:
+        merge_duplicate_positions(conn)
+    for query in INDEXES:
+        cur.execute(query)
+    conn.commit()
+
+
+def upgrade_schema(conn):
+    """
+    Brings the schema of a database created by an older version up to date: missing tables, columns and indexes are
+    added, duplicate positions are merged before the unique index is built
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        connection to the database
+    """
+    create_tables(conn)
+    create_indexes(conn)
@@ -0,0 +1,537 @@
+import atexit
+import heapq
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from itertools import islice
+from src import config
+from . import schema
+from .db import BrokingDB
+from .equity import EquityRepository
+from .idempotency import IdempotencyRepository
+from .outbox import OutboxRepository
+from .user import UserRepository
+from .user_equity_map import UserEquityMapRepository
+
+
+class ShardedDB:
+    def __init__(self, shard_files=None, seed_file=config.SHARD_SEED_FILE, **kwargs):
+        """
+        Users and their positions split over several sqlite databases by user id, so that trades of users on different
+        shards take different write locks and commit in parallel. Equities are copied to every shard so that a
+        portfolio is still read with one query on the shard of its user. Scans of all the users or positions run on
+        the shards in parallel.
+        A unit of work takes part in the transaction of a shard the first time it touches the shard, a trade of one
+        user thus only locks the shard of that user. A unit of work touching several shards commits them one after the
+        other, a failure in between leaves the shards committed before it in place.
+        Parameters
+        ----------
+        shard_files: list of str
+            paths of the sqlite database files of the shards, defaults to the configured num of shards
+        seed_file: str
+            sqlite database file split over the shards on startup if they are all empty
+        kwargs:
+            passed to the BrokingDB of every shard
+        """
+        if shard_files is None:
+            shard_files = [config.SHARD_FILE.format(index) for index in range(config.SHARD_COUNT)]
+        if not shard_files:
+            raise Exception('Provide at least one shard')
+        self.shards = [BrokingDB(shard_file, **kwargs) for shard_file in shard_files]
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix='ebroker-shard')
+        self._next_user_id = None
+        self._user_id_lock = threading.Lock()
+        for shard in self.shards:
+            conn = shard.pool.acquire()
+            try:
+                schema.create_tables(conn)
+                schema.create_indexes(conn)
+            finally:
+                shard.pool.release(conn)
+        if seed_file and os.path.exists(seed_file) and self.is_empty():
+            self.seed(seed_file)
+
+    def shard_for(self, user_id):
+        """
+        Returns the index of the shard holding a user and its positions
+        """
+        # '1' and 1 are the same user, and '1' % n would format a string
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            raise Exception(f'Invalid user id {user_id}')
+        return user_id % len(self.shards)
+
+    def shard(self, index):
+        """
+        Returns the database of a shard, which joins the running unit of work of the current thread if there is one
+        Parameters
+        ----------
+        index: int
+            index of the shard
+
+        Returns
+        -------
+        BrokingDB
+        """
+        shard = self.shards[index]
+        frames = getattr(self._local, 'frames', None)
+        if frames and index not in self._local.enlisted:
+            # a transaction for the outermost unit of work and a savepoint for every nested one
+            for frame in frames:
+                frame.enter_context(shard.transaction())
+            self._local.enlisted.append(index)
+        return shard
+
+    def replica_index(self):
+        """
+        Returns the index of the shard tables copied to every shard are read from, a shard the running unit of work
+        already holds so that no other one is locked for it
+        """
+        enlisted = getattr(self._local, 'enlisted', None)
+        if self.in_transaction() and enlisted:
+            return enlisted[0]
+        return 0
+
+    def map(self, function, indexes=None):
+        """
+        Calls a function with the index of every shard and returns the results in the same sequence. The calls run in
+        parallel unless the current thread is inside a unit of work, whose shards are only reachable from this thread.
+        Parameters
+        ----------
+        function: callable
+            called with a shard index
+        indexes: list of int
+            shards to call the function for, defaults to all of them
+
+        Returns
+        -------
+        list
+        """
+        indexes = range(len(self.shards)) if indexes is None else list(indexes)
+        if self.in_transaction() or len(indexes) < 2:
+            return [function(index) for index in indexes]
+        return list(self._executor.map(function, indexes))
+
+    def in_transaction(self):
+        """
+        Returns whether the current thread is running inside a unit of work
+        """
+        return bool(getattr(self._local, 'frames', None))
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs all the queries of the current thread as a single unit of work on every shard it touches. A nested unit of
+        work becomes a savepoint on every shard of the outer one.
+        Returns
+        -------
+        ShardedDB
+        """
+        frames = getattr(self._local, 'frames', None)
+        if frames is None:
+            frames = self._local.frames = []
+        depth = len(frames)
+        if not depth:
+            self._local.enlisted = []
+            self._local.after_commit = []
+        mark = len(self._local.after_commit)
+        try:
+            with ExitStack() as frame:
+                for index in self._local.enlisted:
+                    frame.enter_context(self.shards[index].transaction())
+                frames.append(frame)
+                try:
+                    yield self
+                finally:
+                    frames.pop()
+        except BaseException:
+            del self._local.after_commit[mark:]
+            raise
+        if not depth:
+            callbacks, self._local.after_commit = self._local.after_commit, []
+            for callback in callbacks:
+                callback()
+
+    def after_commit(self, callback):
+        """
+        Runs a callback once the running unit of work is committed on all its shards, or right away outside of a unit
+        of work
+        Parameters
+        ----------
+        callback: callable
+            called without arguments
+        """
+        if self.in_transaction():
+            self._local.after_commit.append(callback)
+        else:
+            callback()
+
+    def next_user_id(self):
+        """
+        Returns a new user id, ids can't be generated by the shards as they decide which shard a user goes to
+        """
+        with self._user_id_lock:
+            if self._next_user_id is None:
+                ids = self.map(lambda index: self.shards[index].execute_query('SELECT MAX(id) FROM users')[0][0])
+                self._next_user_id = max(user_id or 0 for user_id in ids) + 1
+            user_id = self._next_user_id
+            self._next_user_id += 1
+            return user_id
+
+    def is_empty(self):
+        """
+        Returns whether no shard holds any user or equity
+        """
+        query = 'SELECT EXISTS (SELECT 1 FROM users) OR EXISTS (SELECT 1 FROM equities)'
+        return not any(self.map(lambda index: self.shards[index].execute_query(query)[0][0]))
+
+    def seed(self, seed_file):
+        """
+        Splits the users and positions of a sqlite database file over the shards and copies its equities to all of
+        them
+        Parameters
+        ----------
+        seed_file: str
+            path of the sqlite database file
+        """
+        num_of_shards = len(self.shards)
+
+        def seed_shard(index):
+            conn = self.shards[index].pool.acquire()
+            try:
+                conn.execute('ATTACH DATABASE ? AS seed', (seed_file,))
+                try:
+                    conn.execute('INSERT INTO equities (id, name, price, last_modified_on) '
+                                 'SELECT id, name, price, last_modified_on FROM seed.equities')
+                    conn.execute('INSERT INTO users (id, name, balance, last_modified_on) '
+                                 'SELECT id, name, balance, last_modified_on FROM seed.users WHERE id % ? = ?',
+                                 (num_of_shards, index))
+                    conn.execute('INSERT INTO user_equity_map (user_id, equity_id, total_shares, last_modified_on) '
+                                 'SELECT user_id, equity_id, SUM(total_shares), MAX(last_modified_on) '
+                                 'FROM seed.user_equity_map WHERE user_id % ? = ? GROUP BY user_id, equity_id',
+                                 (num_of_shards, index))
+                    conn.commit()
+                finally:
+                    conn.execute('DETACH DATABASE seed')
+            finally:
+                self.shards[index].pool.release(conn)
+        self.map(seed_shard)
+
+    def close(self):
+        """
+        Closes the connections of all the shards
+        """
+        self._executor.shutdown()
+        for shard in self.shards:
+            shard.close()
+
+
+class ShardedRepository:
+    repository_class = None
+
+    def __init__(self, db=None):
+        """
+        Parameters
+        ----------
+        db: ShardedDB
+            shards to use, defaults to the ones shared by all the repositories
+        """
+        self.db = db if db is not None else get_shared_sharded_db()
+        self.repositories = [self.repository_class(shard) for shard in self.db.shards]
+
+    def on_shard(self, index):
+        """
+        Returns the repository of a shard, which joins the running unit of work
+        """
+        self.db.shard(index)
+        return self.repositories[index]
+
+    def for_user(self, user_id):
+        """
+        Returns the repository of the shard of a user
+        """
+        return self.on_shard(self.db.shard_for(user_id))
+
+    def merge_pages(self, get_page, limit):
+        """
+        Returns the first limit rows in id order of the pages of all the shards
+        """
+        pages = self.db.map(get_page)
+        return list(islice(heapq.merge(*pages, key=lambda row: row.id), limit))
+
+    def merge_streams(self, get_stream):
+        """
+        Yields the rows of the streams of all the shards in id order
+        """
+        return heapq.merge(*(get_stream(index) for index in range(len(self.repositories))), key=lambda row: row.id)
+
+    def group_by_shard(self, items, user_id_of):
+        """
+        Returns shard index to the items of the users on that shard
+        """
+        groups = {}
+        for item in items:
+            groups.setdefault(self.db.shard_for(user_id_of(item)), []).append(item)
+        return groups
+
+
+class ShardedUserRepository(ShardedRepository):
+    """
+    UserRepository on the shards
+    """
+    repository_class = UserRepository
+
+    def get_user(self, user_id):
+        return self.for_user(user_id).get_user(user_id)
+
+    def get_versioned_user(self, user_id):
+        return self.for_user(user_id).get_versioned_user(user_id)
+
+    def get_users(self, user_ids):
+        groups = self.group_by_shard(user_ids, lambda user_id: user_id)
+        # shards are joined in ascending order, so two units of work touching the same shards can't lock each other
+        indexes = sorted(groups)
+        results = self.db.map(lambda index: self.on_shard(index).get_users(groups[index]), indexes)
+        return [user for users in results for user in users]
+
+    def get_all_users(self):
+        results = self.db.map(lambda index: self.on_shard(index).get_all_users())
+        return sorted((user for users in results for user in users), key=lambda user: user.id)
+
+    def get_users_page(self, after_id=0, limit=config.STREAM_BATCH_SIZE):
+        return self.merge_pages(lambda index: self.on_shard(index).get_users_page(after_id, limit), limit)
+
+    def stream_users(self, after_id=0):
+        return self.merge_streams(lambda index: self.on_shard(index).stream_users(after_id))
+
+    def add_user(self, user):
+        user_id = self.db.next_user_id()
+        query = "INSERT INTO users (id, name, balance, last_modified_on) VALUES (?, ?, ?, datetime('now'))"
+        self.for_user(user_id).db.execute_query(query, (user_id, user['name'], user['balance']), is_transactional=True)
+        return True
+
+    def delete_user(self, user_id):
+        return self.for_user(user_id).delete_user(user_id)
+
+    def update_user(self, user):
+        return self.for_user(user['id']).update_user(user)
+
+    def debit_balance(self, user_id, amount):
+        return self.for_user(user_id).debit_balance(user_id, amount)
+
+    def credit_balance(self, user_id, amount):
+        return self.for_user(user_id).credit_balance(user_id, amount)
+
+    def credit_balances(self, amounts):
+        groups = self.group_by_shard(amounts, lambda amount: amount[0])
+        for index in sorted(groups):
+            self.on_shard(index).credit_balances(groups[index])
+        return True
+
+
+class ShardedEquityRepository(ShardedRepository):
+    """
+    EquityRepository on the shards, equities are read from one shard and written to all of them
+    """
+    repository_class = EquityRepository
+
+    @property
+    def replica(self):
+        return self.repositories[self.db.replica_index()]
+
+    def get_equity(self, equity_id):
+        return self.replica.get_equity(equity_id)
+
+    def get_equities(self, equity_ids):
+        return self.replica.get_equities(equity_ids)
+
+    def get_all_equities(self):
+        return self.replica.get_all_equities()
+
+    def get_equities_page(self, after_id=0, limit=config.STREAM_BATCH_SIZE):
+        return self.replica.get_equities_page(after_id, limit)
+
+    def stream_equities(self, after_id=0):
+        return self.replica.stream_equities(after_id)
+
+    def add_equity(self, equity):
+        # every shard gives the new equity the same id as long as all of them get the same changes
+        with self.db.transaction():
+            for index in range(len(self.repositories)):
+                self.on_shard(index).add_equity(equity)
+        return True
+
+    def delete_equity(self, equity_id):
+        with self.db.transaction():
+            for index in range(len(self.repositories)):
+                self.on_shard(index).delete_equity(equity_id)
+        return True
+
+    def update_equity(self, equity):
+        with self.db.transaction():
+            for index in range(len(self.repositories)):
+                self.on_shard(index).update_equity(equity)
+        return True
+
+    def update_prices(self, prices):
+        latest = dict(prices)
+        with self.db.transaction():
+            updated = [self.on_shard(index).update_prices(latest.items()) for index in range(len(self.repositories))]
+        return updated[0]
+
+
+class ShardedUserEquityMapRepository(ShardedRepository):
+    """
+    UserEquityMapRepository on the shards. Position ids are only unique within a shard, so the ids handed out are
+    the shard id times the num of shards plus the shard index.
+    """
+    repository_class = UserEquityMapRepository
+
+    def to_global(self, position, index):
+        if position is None:
+            return None
+        return position._replace(id=position.id * len(self.repositories) + index)
+
+    def to_local(self, user_equity_id):
+        """
+        Returns the shard index and the id within the shard of a position id
+        """
+        return user_equity_id % len(self.repositories), user_equity_id // len(self.repositories)
+
+    def get_user_equity(self, user_equity_id):
+        index, local_id = self.to_local(user_equity_id)
+        return self.to_global(self.on_shard(index).get_user_equity(local_id), index)
+
+    def get_user_equity_mapping_id(self, user_id, equity_id):
+        index = self.db.shard_for(user_id)
+        local_id = self.on_shard(index).get_user_equity_mapping_id(user_id, equity_id)
+        return local_id * len(self.repositories) + index if local_id is not None else None
+
+    def get_position(self, user_id, equity_id):
+        index = self.db.shard_for(user_id)
+        return self.to_global(self.on_shard(index).get_position(user_id, equity_id), index)
+
+    def get_versioned_position(self, user_id, equity_id):
+        index = self.db.shard_for(user_id)
+        return self.to_global(self.on_shard(index).get_versioned_position(user_id, equity_id), index)
+
+    def get_positions(self, user_equity_pairs):
+        groups = self.group_by_shard(user_equity_pairs, lambda pair: pair[0])
+        indexes = sorted(groups)
+        results = self.db.map(lambda index: [self.to_global(position, index) for position in
+                                             self.on_shard(index).get_positions(groups[index])], indexes)
+        return [position for positions in results for position in positions]
+
+    def get_all_positions(self):
+        results = self.db.map(lambda index: [self.to_global(position, index) for position in
+                                             self.on_shard(index).get_all_positions()])
+        return sorted((position for positions in results for position in positions), key=lambda position: position.id)
+
+    def local_after_id(self, after_id, index):
+        """
+        Returns the id within a shard above which its positions have a position id above after_id
+        """
+        return (after_id - index) // len(self.repositories)
+
+    def get_positions_page(self, after_id=0, limit=config.STREAM_BATCH_SIZE):
+        def get_page(index):
+            page = self.on_shard(index).get_positions_page(self.local_after_id(after_id, index), limit)
+            return [self.to_global(position, index) for position in page]
+        return self.merge_pages(get_page, limit)
+
+    def stream_positions(self, after_id=0):
+        def get_stream(index):
+            stream = self.on_shard(index).stream_positions(self.local_after_id(after_id, index))
+            return (self.to_global(position, index) for position in stream)
+        return self.merge_streams(get_stream)
+
+    def get_portfolio(self, user_id):
+        return self.for_user(user_id).get_portfolio(user_id)
+
+    def upsert_position(self, user_id, equity_id, shares):
+        return self.for_user(user_id).upsert_position(user_id, equity_id, shares)
+
+    def remove_shares(self, user_id, equity_id, shares):
+        return self.for_user(user_id).remove_shares(user_id, equity_id, shares)
+
+    def upsert_positions(self, shares):
+        groups = self.group_by_shard(shares, lambda change: change[0])
+        for index in sorted(groups):
+            self.on_shard(index).upsert_positions(groups[index])
+        return True
+
+    def add_user_equity(self, user_equity):
+        return self.for_user(user_equity['user_id']).add_user_equity(user_equity)
+
+    def add_position(self, user_id, equity_id, total_shares):
+        return self.for_user(user_id).add_position(user_id, equity_id, total_shares)
+
+    def delete_user_equity_map(self, user_equity_map_id, version=None):
+        index, local_id = self.to_local(user_equity_map_id)
+        return self.on_shard(index).delete_user_equity_map(local_id, version)
+
+    def update_equity(self, user_equity):
+        index, local_id = self.to_local(user_equity['id'])
+        target = self.db.shard_for(user_equity['user_id'])
+        if target == index:
+            return self.on_shard(index).update_equity({**user_equity, 'id': local_id})
+        # the position moves to the shard of its new user
+        with self.db.transaction():
+            if not self.on_shard(index).delete_user_equity_map(local_id, user_equity.get('version')):
+                return False
+            self.on_shard(target).add_user_equity(user_equity)
+        return True
+
+
+class ShardedIdempotencyRepository(ShardedRepository):
+    """
+    IdempotencyRepository on the shards, the key of a request is kept on the shard of its user so that it is
+    committed with the trade
+    """
+    repository_class = IdempotencyRepository
+
+    def get_response(self, user_id, key):
+        return self.for_user(user_id).get_response(user_id, key)
+
+    def save_response(self, user_id, key, request, response):
+        return self.for_user(user_id).save_response(user_id, key, request, response)
+
+
+class ShardedOutboxRepository(ShardedRepository):
+    """
+    OutboxRepository on the shards, the events of a trade are kept on the shard of their user so that they are
+    committed with the trade. The events of a user are in order, the events of users on different shards are not.
+    """
+    repository_class = OutboxRepository
+
+    def add_events(self, events):
+        for index, shard_events in self.group_by_shard(events, lambda event: event['userId']).items():
+            self.on_shard(index).add_events(shard_events)
+        return True
+
+    def relay(self, record, batch_size=config.STREAM_BATCH_SIZE):
+        for repository in self.repositories:
+            repository.relay(record, batch_size)
+
+
+_shared_sharded_db = None
+_shared_sharded_db_lock = threading.Lock()
+
+
+def get_shared_sharded_db():
+    """
+    Returns the shards shared by all the sharded repositories of this process
+    Returns
+    -------
+    ShardedDB
+    """
+    global _shared_sharded_db
+    if _shared_sharded_db is None:
+        with _shared_sharded_db_lock:
+            if _shared_sharded_db is None:
+                _shared_sharded_db = ShardedDB()
+                atexit.register(_shared_sharded_db.close)
+    return _shared_sharded_db
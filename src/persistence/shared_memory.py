@@ -0,0 +1,125 @@
+import os
+import sqlite3
+import threading
+from src import config
+from src.persistence import schema
+from src.persistence.db import BrokingDB
+
+
+class SharedMemoryDB(BrokingDB):
+    def __init__(self, name=config.SHARED_MEMORY_NAME, seed_file=config.SHARED_MEMORY_SEED_FILE,
+                 checkpoint_file=config.SHARED_MEMORY_CHECKPOINT_FILE,
+                 checkpoint_interval=config.SHARED_MEMORY_CHECKPOINT_INTERVAL, pool_size=1, **kwargs):
+        """
+        Class to perform db operation on a named shared-cache in-memory database. Every connection opened with the same
+        name in this process reaches the same database, which lives as long as one of them is open. Shared-cache
+        connections lock whole tables and do not wait for each other, so by default the pool hands out one connection
+        which serializes the threads instead, and reads use it too. Exports thus read keyset pages instead of
+        streaming, which would hold the only connection for the whole export.
+        Parameters
+        ----------
+        name: str
+            name of the in-memory database
+        seed_file: str
+            sqlite database file copied into memory on startup, if it exists
+        checkpoint_file: str
+            sqlite database file the in-memory database is copied to, nothing is written to disk if not given
+        checkpoint_interval: float
+            seconds between two checkpoints, only checkpointed on close if 0
+        pool_size: int
+            maximum num of connections kept by the pool
+        """
+        super().__init__(f'file:{name}?mode=memory&cache=shared', pool_size=pool_size, read_pool_size=0, **kwargs)
+        self.name = name
+        self.paged_exports = True
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        # keeps the database alive while the pooled connections come and go
+        self.conn = self.get_connection()
+        if not self.conn:
+            raise Exception('No connection')
+        if seed_file and os.path.exists(seed_file):
+            self.seed(seed_file)
+        schema.create_tables(self.conn)
+        schema.create_indexes(self.conn)
+        self._stop_checkpoints = threading.Event()
+        self._checkpoint_thread = None
+        if checkpoint_file and checkpoint_interval > 0:
+            self._checkpoint_thread = threading.Thread(target=self._run_checkpoints, daemon=True,
+                                                       name='ebroker-checkpoint')
+            self._checkpoint_thread.start()
+
+    def get_connection(self):
+        """
+        Returns a new connection to the shared in-memory database
+        Returns
+        -------
+        sqlite3.Connection
+        """
+        conn = None
+        try:
+            conn = sqlite3.connect(self.database_file, uri=True, check_same_thread=False,
+                                   cached_statements=config.STATEMENT_CACHE_SIZE)
+            conn.execute(f'PRAGMA busy_timeout = {int(self.pool.checkout_timeout * 1000)}')
+        except sqlite3.Error as e:
+            print(str(e))
+        return conn
+
+    def seed(self, seed_file):
+        """
+        Replaces the content of the in-memory database with the one of a sqlite database file
+        Parameters
+        ----------
+        seed_file: str
+            path of the sqlite database file
+        """
+        source = sqlite3.connect(seed_file)
+        try:
+            source.backup(self.conn)
+        finally:
+            source.close()
+
+    def checkpoint(self, checkpoint_file=None):
+        """
+        Copies the in-memory database to a sqlite database file. The copy runs on a pooled connection, so it waits
+        for the running unit of work and holds back the next one until it is done.
+        Parameters
+        ----------
+        checkpoint_file: str
+            path of the sqlite database file, defaults to the configured one
+        """
+        checkpoint_file = checkpoint_file or self.checkpoint_file
+        if not checkpoint_file:
+            raise Exception('No checkpoint file configured')
+        conn = self.pool.acquire()
+        try:
+            target = sqlite3.connect(checkpoint_file)
+            try:
+                conn.backup(target)
+            finally:
+                target.close()
+        finally:
+            self.pool.release(conn)
+
+    def _run_checkpoints(self):
+        while not self._stop_checkpoints.wait(self.checkpoint_interval):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                print(str(e))
+
+    def close(self):
+        """
+        Stops the periodic checkpoints, writes a last checkpoint if a checkpoint file is configured and closes all the
+        connections, which drops the in-memory database
+        """
+        if self._checkpoint_thread is not None:
+            self._stop_checkpoints.set()
+            self._checkpoint_thread.join()
+            self._checkpoint_thread = None
+        if self.checkpoint_file and self.conn:
+            self.checkpoint()
+        super().close()
+        if self.conn:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,55 @@
+from functools import lru_cache
+
+
+# num of values an IN list is padded up to, every size is one compiled statement in the cache of a connection
+IN_LIST_SIZES = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+MAX_IN_LIST_SIZE = IN_LIST_SIZES[-1]
+
+
+@lru_cache(maxsize=None)
+def in_list_statement(template, size, placeholder='?'):
+    """
+    Returns the statement of a template whose {} is replaced by a list of size placeholders. Statements are built once
+    per size and their text never changes, so sqlite can reuse the statement it compiled on a pooled connection.
+    Parameters
+    ----------
+    template: str
+        SQL query with {} in place of the IN list
+    size: int
+        num of placeholders, one of IN_LIST_SIZES
+    placeholder: str
+        placeholder of one value, e.g. (?, ?) for a pair
+
+    Returns
+    -------
+    str
+    """
+    return template.format(', '.join([placeholder] * size))
+
+
+def in_list_query(template, values, placeholder='?'):
+    """
+    Returns the statement and params to look up given values with an IN list. The values are padded by repeating
+    the last one up to the next size of IN_LIST_SIZES, which does not change the result of an IN list.
+    Parameters
+    ----------
+    template: str
+        SQL query with {} in place of the IN list
+    values: list
+        at most MAX_IN_LIST_SIZE values, tuples when placeholder takes many params
+    placeholder: str
+        placeholder of one value
+
+    Returns
+    -------
+    tuple
+        (query, params)
+    """
+    size = next(size for size in IN_LIST_SIZES if size >= len(values))
+    padded = list(values) + [values[-1]] * (size - len(values))
+    if placeholder == '?':
+        params = tuple(padded)
+    else:
+        params = tuple(param for value in padded for param in value)
+    return in_list_statement(template, size, placeholder), params
+
@@ -0,0 +1,63 @@
+from src import config
+from .equity import EquityRepository
+from .idempotency import IdempotencyRepository
+from .ledger import LedgerDB, LedgerEquityRepository, LedgerIdempotencyRepository, LedgerOutboxRepository, \
+    LedgerUserEquityMapRepository, LedgerUserRepository
+from .outbox import OutboxRepository
+from .sharded import ShardedDB, ShardedEquityRepository, ShardedIdempotencyRepository, ShardedOutboxRepository, \
+    ShardedUserEquityMapRepository, ShardedUserRepository
+from .user import UserRepository
+from .user_equity_map import UserEquityMapRepository
+
+
+# repository classes of every storage engine
+STORAGE_ENGINES = {
+    'sqlite': {
+        'user': UserRepository,
+        'equity': EquityRepository,
+        'user_equity_map': UserEquityMapRepository,
+        'idempotency': IdempotencyRepository,
+        'outbox': OutboxRepository,
+    },
+    'ledger': {
+        'user': LedgerUserRepository,
+        'equity': LedgerEquityRepository,
+        'user_equity_map': LedgerUserEquityMapRepository,
+        'idempotency': LedgerIdempotencyRepository,
+        'outbox': LedgerOutboxRepository,
+    },
+    'sharded': {
+        'user': ShardedUserRepository,
+        'equity': ShardedEquityRepository,
+        'user_equity_map': ShardedUserEquityMapRepository,
+        'idempotency': ShardedIdempotencyRepository,
+        'outbox': ShardedOutboxRepository,
+    },
+}
+
+
+def get_repository_class(kind, db=None):
+    """
+    Returns the repository class of the engine of a database, or of the configured engine if no database is given
+    Parameters
+    ----------
+    kind: str
+        user, equity, user_equity_map, idempotency or outbox
+    db: BrokingDB, LedgerDB or ShardedDB
+        database the repository will use
+
+    Returns
+    -------
+    type
+    """
+    if db is None:
+        engine = config.STORAGE_ENGINE
+    elif isinstance(db, LedgerDB):
+        engine = 'ledger'
+    elif isinstance(db, ShardedDB):
+        engine = 'sharded'
+    else:
+        engine = 'sqlite'
+    if engine not in STORAGE_ENGINES:
+        raise Exception(f'Unknown storage engine {engine}, choose one of {", ".join(STORAGE_ENGINES)}')
+    return STORAGE_ENGINES[engine][kind]
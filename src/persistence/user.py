@@ -1,26 +1,69 @@
-from .db import BrokingDB
+from src import config
+from .db import chunks, get_shared_db
+from .models import USER_ROW, VERSIONED_USER_ROW
+from .statements import in_list_query
 
 
 class UserRepository:
-    def __init__(self):
+    def __init__(self, db=None):
         """
         Class to perform CRUD operation on user table
+        Parameters
+        ----------
+        db: BrokingDB
+            database to use, defaults to the one shared by all the repositories
         """
-        self.db = BrokingDB()
+        self.db = db if db is not None else get_shared_db()
 
     def get_user(self, user_id):
         query = 'SELECT id, name, balance FROM users WHERE id = ?'
-        result_set = self.db.execute_query(query, (user_id,))
+        result_set = self.db.execute_read(query, (user_id,), row_factory=USER_ROW)
         if len(result_set):
             return result_set[0]
         else:
             return None
 
+    def get_versioned_user(self, user_id):
+        """
+        Returns a user along with the version of its row, which an optimistic update_user is conditional on
+        Returns
+        -------
+        VersionedUser or None
+        """
+        query = 'SELECT id, name, balance, version FROM users WHERE id = ?'
+        result_set = self.db.execute_read(query, (user_id,), row_factory=VERSIONED_USER_ROW)
+        return result_set[0] if len(result_set) else None
+
+    def get_users(self, user_ids):
+        result_set = []
+        for chunk in chunks(list(user_ids)):
+            query, params = in_list_query('SELECT id, name, balance FROM users WHERE id IN ({})', chunk)
+            result_set.extend(self.db.execute_read(query, params, row_factory=USER_ROW))
+        return result_set
+
     def get_all_users(self):
         query = 'SELECT id, name, balance FROM users'
-        result_set = self.db.execute_query(query)
+        result_set = self.db.execute_read(query, row_factory=USER_ROW)
         return result_set
 
+    def get_users_page(self, after_id=0, limit=config.STREAM_BATCH_SIZE):
+        """
+        Returns up to limit users with an id above after_id in id order, the id of the last one is the after_id of the
+        next page. The page is found through the primary key, so every page costs the same however far it is.
+        Returns
+        -------
+        list of User
+        """
+        query = 'SELECT id, name, balance FROM users WHERE id > ? ORDER BY id LIMIT ?'
+        return self.db.execute_read(query, (after_id, limit), row_factory=USER_ROW)
+
+    def stream_users(self, after_id=0):
+        """
+        Yields the users with an id above after_id in id order without loading them all at once
+        """
+        query = 'SELECT id, name, balance FROM users WHERE id > ? ORDER BY id'
+        return self.db.stream_read(query, (after_id,), row_factory=USER_ROW)
+
     def add_user(self, user):
         name = user['name']
         balance = user['balance']
@@ -34,9 +77,58 @@ class UserRepository:
         return True
 
     def update_user(self, user):
+        """
+        Overwrites name and balance of a user. When the user has a version the row is only updated if it still has
+        that version, as read by get_versioned_user.
+        Returns
+        -------
+        bool
+            False when a version is given and the row has another one or does not exist
+        """
         user_id = user['id']
         user_name = user['name']
         amount = user['balance']
-        query = "UPDATE users SET name=?, balance = ?, last_modified_on = datetime('now') where id = ?"
+        query = "UPDATE users SET name=?, balance = ?, version = version + 1, last_modified_on = datetime('now') " \
+                "where id = ?"
+        if user.get('version') is not None:
+            query += ' AND version = ?'
+            return self.db.execute_update(query, (user_name, amount, user_id, user['version'])) == 1
         self.db.execute_query(query, (user_name, amount, user_id), is_transactional=True)
         return True
+
+    def debit_balance(self, user_id, amount):
+        """
+        Deducts given amount from user balance only if the balance covers it
+        Returns
+        -------
+        bool
+            False when the user does not exist or has insufficient balance
+        """
+        query = "UPDATE users SET balance = balance - ?, version = version + 1, last_modified_on = datetime('now') " \
+                "WHERE id = ? AND balance >= ?"
+        return self.db.execute_update(query, (amount, user_id, amount)) == 1
+
+    def credit_balance(self, user_id, amount):
+        """
+        Adds given amount to user balance
+        Returns
+        -------
+        bool
+            False when the user does not exist
+        """
+        query = "UPDATE users SET balance = balance + ?, version = version + 1, last_modified_on = datetime('now') " \
+                "WHERE id = ?"
+        return self.db.execute_update(query, (amount, user_id)) == 1
+
+    def credit_balances(self, amounts):
+        """
+        Adds amount to the balance of many users at once
+        Parameters
+        ----------
+        amounts: list of tuple
+            (user id, amount) pairs, amount is negative for a deduction
+        """
+        query = "UPDATE users SET balance = balance + ?, version = version + 1, last_modified_on = datetime('now') " \
+                "WHERE id = ?"
+        self.db.execute_many(query, [(amount, user_id) for user_id, amount in amounts])
+        return True
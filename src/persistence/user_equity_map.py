@@ -1,16 +1,23 @@
-from .db import BrokingDB
+from src import config
+from .db import chunks, get_shared_db
+from .models import PORTFOLIO_ROW, POSITION_ROW, VERSIONED_POSITION_ROW
+from .statements import MAX_IN_LIST_SIZE, in_list_query
 
 
 class UserEquityMapRepository:
-    def __init__(self):
+    def __init__(self, db=None):
         """
         Class to perform CRUD operation on user_equity_map table
+        Parameters
+        ----------
+        db: BrokingDB
+            database to use, defaults to the one shared by all the repositories
         """
-        self.db = BrokingDB()
+        self.db = db if db is not None else get_shared_db()
 
     def get_user_equity(self, user_equity_id):
         query = 'SELECT id, user_id, equity_id, total_shares FROM user_equity_map WHERE id = ?'
-        result_set = self.db.execute_query(query, (user_equity_id,))
+        result_set = self.db.execute_read(query, (user_equity_id,), row_factory=POSITION_ROW)
         if len(result_set):
             return result_set[0]
         else:
@@ -18,12 +25,145 @@ class UserEquityMapRepository:
 
     def get_user_equity_mapping_id(self, user_id, equity_id):
         query = 'SELECT id FROM user_equity_map WHERE user_id = ? AND equity_id = ?'
-        result_set = self.db.execute_query(query, (user_id, equity_id))
+        result_set = self.db.execute_read(query, (user_id, equity_id))
         if len(result_set):
             return result_set[0][0]
         else:
             return None
 
+    def get_position(self, user_id, equity_id):
+        query = 'SELECT id, user_id, equity_id, total_shares FROM user_equity_map WHERE user_id = ? AND equity_id = ?'
+        result_set = self.db.execute_read(query, (user_id, equity_id), row_factory=POSITION_ROW)
+        if len(result_set):
+            return result_set[0]
+        else:
+            return None
+
+    def get_versioned_position(self, user_id, equity_id):
+        """
+        Returns the position of a user in an equity along with the version of its row, which an optimistic
+        update_equity or delete_user_equity_map is conditional on
+        Returns
+        -------
+        VersionedPosition or None
+        """
+        query = 'SELECT id, user_id, equity_id, total_shares, version FROM user_equity_map ' \
+                'WHERE user_id = ? AND equity_id = ?'
+        result_set = self.db.execute_read(query, (user_id, equity_id), row_factory=VERSIONED_POSITION_ROW)
+        return result_set[0] if len(result_set) else None
+
+    def get_positions(self, user_equity_pairs):
+        """
+        Returns the positions of many (user id, equity id) pairs at once
+        """
+        result_set = []
+        # every pair takes two params
+        for chunk in chunks(list(user_equity_pairs), size=MAX_IN_LIST_SIZE // 2):
+            query, params = in_list_query('SELECT id, user_id, equity_id, total_shares FROM user_equity_map '
+                                          'WHERE (user_id, equity_id) IN (VALUES {})', chunk, placeholder='(?, ?)')
+            result_set.extend(self.db.execute_read(query, params, row_factory=POSITION_ROW))
+        return result_set
+
+    def get_all_positions(self):
+        query = 'SELECT id, user_id, equity_id, total_shares FROM user_equity_map'
+        return self.db.execute_read(query, row_factory=POSITION_ROW)
+
+    def get_positions_page(self, after_id=0, limit=config.STREAM_BATCH_SIZE):
+        """
+        Returns up to limit positions with an id above after_id in id order, the id of the last one is the after_id of
+        the next page
+        Returns
+        -------
+        list of Position
+        """
+        query = 'SELECT id, user_id, equity_id, total_shares FROM user_equity_map WHERE id > ? ORDER BY id LIMIT ?'
+        return self.db.execute_read(query, (after_id, limit), row_factory=POSITION_ROW)
+
+    def stream_positions(self, after_id=0):
+        """
+        Yields the positions with an id above after_id in id order without loading them all at once
+        """
+        query = 'SELECT id, user_id, equity_id, total_shares FROM user_equity_map WHERE id > ? ORDER BY id'
+        return self.db.stream_read(query, (after_id,), row_factory=POSITION_ROW)
+
+    def get_portfolio(self, user_id):
+        """
+        Returns balance of a user together with all the positions and current prices in one query, a user without
+        positions gets a single row with None for position columns
+        Returns
+        -------
+        list of tuple
+            (user id, balance, equity id, equity name, total shares, price)
+        """
+        query = 'SELECT u.id, u.balance, m.equity_id, e.name, m.total_shares, e.price FROM users u ' \
+                'LEFT JOIN user_equity_map m ON m.user_id = u.id ' \
+                'LEFT JOIN equities e ON e.id = m.equity_id ' \
+                'WHERE u.id = ? ORDER BY m.equity_id'
+        return self.db.execute_read(query, (user_id,), row_factory=PORTFOLIO_ROW)
+
+    def upsert_position(self, user_id, equity_id, shares):
+        """
+        Adds given num of shares to the position of a user in an equity, the position is created if the user does not
+        hold the equity yet and removed once its shares reach zero
+        Parameters
+        ----------
+        user_id: int
+            id of the user
+        equity_id: int
+            id of the equity
+        shares: int
+            num of shares to add, negative to remove shares
+
+        Returns
+        -------
+        bool
+        """
+        query = "INSERT INTO user_equity_map (user_id, equity_id, total_shares, last_modified_on)" \
+                " VALUES (?, ?, ?, datetime('now'))" \
+                " ON CONFLICT (user_id, equity_id) DO UPDATE SET total_shares = total_shares + excluded.total_shares," \
+                " version = version + 1, last_modified_on = excluded.last_modified_on"
+        self.db.execute_query(query, (user_id, equity_id, shares), is_transactional=True)
+        if shares < 0:
+            query = 'DELETE FROM user_equity_map WHERE user_id = ? AND equity_id = ? AND total_shares <= 0'
+            self.db.execute_query(query, (user_id, equity_id), is_transactional=True)
+        return True
+
+    def remove_shares(self, user_id, equity_id, shares):
+        """
+        Removes given num of shares from the position of a user only if the position holds them, the position is
+        removed once its shares reach zero
+        Returns
+        -------
+        bool
+            False when the user does not hold the equity or holds fewer shares
+        """
+        query = "UPDATE user_equity_map SET total_shares = total_shares - ?, version = version + 1, " \
+                "last_modified_on = datetime('now') WHERE user_id = ? AND equity_id = ? AND total_shares >= ?"
+        if self.db.execute_update(query, (shares, user_id, equity_id, shares)) != 1:
+            return False
+        query = 'DELETE FROM user_equity_map WHERE user_id = ? AND equity_id = ? AND total_shares <= 0'
+        self.db.execute_query(query, (user_id, equity_id), is_transactional=True)
+        return True
+
+    def upsert_positions(self, shares):
+        """
+        Adds shares to many positions at once, positions are created when missing and removed once they reach zero
+        Parameters
+        ----------
+        shares: list of tuple
+            (user id, equity id, num of shares) triples, num of shares is negative to remove shares
+        """
+        query = "INSERT INTO user_equity_map (user_id, equity_id, total_shares, last_modified_on)" \
+                " VALUES (?, ?, ?, datetime('now'))" \
+                " ON CONFLICT (user_id, equity_id) DO UPDATE SET total_shares = total_shares + excluded.total_shares," \
+                " version = version + 1, last_modified_on = excluded.last_modified_on"
+        self.db.execute_many(query, shares)
+        removed = [(user_id, equity_id) for user_id, equity_id, num_of_shares in shares if num_of_shares < 0]
+        if removed:
+            query = 'DELETE FROM user_equity_map WHERE user_id = ? AND equity_id = ? AND total_shares <= 0'
+            self.db.execute_many(query, removed)
+        return True
+
     def add_user_equity(self, user_equity):
         user_id = user_equity['user_id']
         equity_id = user_equity['equity_id']
@@ -33,17 +173,50 @@ class UserEquityMapRepository:
         self.db.execute_query(query, (user_id, equity_id, total_shares), is_transactional=True)
         return True
 
-    def delete_user_equity_map(self, user_equity_map_id):
+    def add_position(self, user_id, equity_id, total_shares):
+        """
+        Creates the position of a user in an equity unless the user already holds the equity
+        Returns
+        -------
+        bool
+            False when the position exists
+        """
+        query = "INSERT INTO user_equity_map (user_id, equity_id, total_shares, last_modified_on)" \
+                " VALUES (?, ?, ?, datetime('now')) ON CONFLICT (user_id, equity_id) DO NOTHING"
+        return self.db.execute_update(query, (user_id, equity_id, total_shares)) == 1
+
+    def delete_user_equity_map(self, user_equity_map_id, version=None):
+        """
+        Deletes a position, only if it still has the given version when there is one
+        Returns
+        -------
+        bool
+            False when a version is given and the row has another one or does not exist
+        """
         query = "DELETE FROM user_equity_map WHERE id = ?"
+        if version is not None:
+            return self.db.execute_update(query + ' AND version = ?', (user_equity_map_id, version)) == 1
         self.db.execute_query(query, (user_equity_map_id,), is_transactional=True)
         return True
 
     def update_equity(self, user_equity):
+        """
+        Overwrites user, equity and shares of a position. When the position has a version the row is only updated if
+        it still has that version, as read by get_versioned_position.
+        Returns
+        -------
+        bool
+            False when a version is given and the row has another one or does not exist
+        """
         user_equity_map_id = user_equity['id']
         user_id = user_equity['user_id']
         equity_id = user_equity['equity_id']
         total_shares = user_equity['total_shares']
-        query = "UPDATE user_equity_map SET user_id = ?, equity_id = ?, total_shares = ?, " \
+        query = "UPDATE user_equity_map SET user_id = ?, equity_id = ?, total_shares = ?, version = version + 1, " \
                 "last_modified_on = datetime('now') where id = ?"
+        if user_equity.get('version') is not None:
+            query += ' AND version = ?'
+            params = (user_id, equity_id, total_shares, user_equity_map_id, user_equity['version'])
+            return self.db.execute_update(query, params) == 1
         self.db.execute_query(query, (user_id, equity_id, total_shares, user_equity_map_id), is_transactional=True)
         return True
@@ -0,0 +1,103 @@
+import asyncio
+from src import config
+from src.persistence.async_db import AsyncEquityRepository, AsyncUserEquityMapRepository, AsyncUserRepository, \
+    BoundedExecutor
+from src.service.broking import BrokingService
+from src.service.price_feed import PriceFeed
+from src.service.trade_queue import get_trade_writer, give_up
+
+
+class AsyncBrokingService:
+    def __init__(self, write_executor, read_executor, db=None):
+        """
+        Async variant of BrokingService. Trades run as a whole on the write executor since a unit of work is bound to
+        the thread running it, reads run their queries on the read executor so that polling clients cannot take the
+        threads trades need.
+        Parameters
+        ----------
+        write_executor: BoundedExecutor
+            executor running trades
+        read_executor: BoundedExecutor
+            executor running read only queries
+        db: BrokingDB
+            database used by all the repositories, defaults to the shared one
+        """
+        self.service = BrokingService(db)
+        self.price_feed = PriceFeed(db)
+        self.write_executor = write_executor
+        self.read_executor = read_executor
+        self.user_repository = AsyncUserRepository(read_executor, db)
+        self.equity_repository = AsyncEquityRepository(read_executor, db)
+        self.map_repository = AsyncUserEquityMapRepository(read_executor, db)
+
+    async def run_trade(self, operation, *args, idempotency_key=None):
+        """
+        Runs a trade through the trade writer when the write queue is enabled, otherwise on the write executor. A
+        trade already run with the idempotency key of its user is answered from the read executor instead. A trade
+        sent to the trade writer holds a slot of the write executor, so the queue is bounded like the executor, and
+        is given up after the write queue timeout.
+        """
+        if idempotency_key is not None:
+            response = await self.read_executor.run(self.service.stored_response, idempotency_key, operation, *args)
+            if response is not None:
+                return response
+            operation, args = 'run_idempotent', (idempotency_key, operation, *args)
+        if config.WRITE_QUEUE:
+            async with self.write_executor.slot():
+                future = get_trade_writer().submit(operation, *args)
+                try:
+                    return await asyncio.wait_for(asyncio.wrap_future(future), config.WRITE_QUEUE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise give_up(future)
+        return await self.write_executor.run(getattr(self.service, operation), *args)
+
+    async def buy_an_equity(self, user_id, equity_id, num_of_shares, time_stamp, idempotency_key=None):
+        return await self.run_trade('buy_an_equity', user_id, equity_id, num_of_shares, time_stamp,
+                                    idempotency_key=idempotency_key)
+
+    async def sell_an_equity(self, user_id, equity_id, num_of_shares, time_stamp, idempotency_key=None):
+        return await self.run_trade('sell_an_equity', user_id, equity_id, num_of_shares, time_stamp,
+                                    idempotency_key=idempotency_key)
+
+    async def add_fund(self, user_id, amount, idempotency_key=None):
+        return await self.run_trade('add_fund', user_id, amount, idempotency_key=idempotency_key)
+
+    async def execute_orders(self, orders):
+        return await self.run_trade('execute_orders', orders)
+
+    async def update_prices(self, ticks):
+        return await self.write_executor.run(self.price_feed.apply, ticks)
+
+    async def get_balance(self, user_id):
+        user = await self.user_repository.get_user(user_id)
+        if user is None:
+            raise Exception('No such user exists')
+        return user.balance
+
+    async def get_portfolio(self, user_id):
+        return BrokingService.value_portfolio(await self.map_repository.get_portfolio(user_id))
+
+    async def export_page(self, kind, after_id, limit=config.STREAM_BATCH_SIZE):
+        """
+        Returns a page of an export like BrokingService.export and the after_id of the next page, None after the last
+        page. Every page is a query of its own on the read executor, so no thread is held between two pages.
+        """
+        pages = {
+            'users': self.user_repository.get_users_page,
+            'equities': self.equity_repository.get_equities_page,
+            'positions': self.map_repository.get_positions_page,
+        }
+        page = await pages[kind](after_id, limit)
+        next_after_id = page[-1].id if len(page) == limit else None
+        return [BrokingService.export_row(kind, row) for row in page], next_after_id
+
+
+def create_executors():
+    """
+    Returns write and read executors sized from the configuration
+    """
+    write_executor = BoundedExecutor(config.ASYNC_WRITE_WORKERS, config.ASYNC_MAX_PENDING,
+                                     config.ASYNC_QUEUE_TIMEOUT, name='ebroker-write')
+    read_executor = BoundedExecutor(config.ASYNC_READ_WORKERS, config.ASYNC_MAX_PENDING,
+                                    config.ASYNC_QUEUE_TIMEOUT, name='ebroker-read')
+    return write_executor, read_executor
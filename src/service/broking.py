@@ -1,19 +1,187 @@
-import datetime
-from src.persistence.user import UserRepository
-from src.persistence.equity import EquityRepository
-from src.persistence.user_equity_map import UserEquityMapRepository
+import json
+import random
+import time
+from contextlib import nullcontext
+from src import config
+from src.metrics import REGISTRY
+from src.persistence.storage import get_repository_class
+from src.service.trade_log import get_trade_event_log
+from src.service.trading_calendar import get_calendar
+from src.service.user_locks import get_user_locks
+
+
+# trades which take an idempotency key, the id of the user is their first argument
+IDEMPOTENT_OPERATIONS = ('buy_an_equity', 'sell_an_equity', 'add_fund')
+
+IDEMPOTENT_REPLAYS = REGISTRY.counter('ebroker_idempotent_replays_total',
+                                      'Trades answered with the stored response of their idempotency key')
+VERSION_CONFLICTS = REGISTRY.counter('ebroker_version_conflicts_total',
+                                     'Optimistic trades retried as a row they read was changed meanwhile')
+
+
+class VersionConflictError(Exception):
+    """
+    Raised by an optimistic trade when a row it read was changed before its update
+    """
 
 
 class BrokingService:
-    def __init__(self):
-        self.user_repository = UserRepository()
-        self.equity_repository = EquityRepository()
-        self.map_repository = UserEquityMapRepository()
+    def __init__(self, db=None, event_log=None, user_locks=None, concurrency=None):
+        """
+        Parameters
+        ----------
+        db: BrokingDB or LedgerDB
+            database used by all the repositories, defaults to the shared one of the configured storage engine
+        event_log: TradeEventLog
+            log the committed trades are appended to, defaults to the one of this process when the trade log is
+            enabled
+        user_locks: StripedLocks
+            locks held by the trades of a user, defaults to the ones of this process when they are enabled
+        concurrency: str
+            pessimistic or optimistic, defaults to the configured one. The ledger engine applies a whole trade under
+            its lock, so its trades are always pessimistic.
+        """
+        self.user_repository = get_repository_class('user', db)(db)
+        self.equity_repository = get_repository_class('equity', db)(db)
+        self.map_repository = get_repository_class('user_equity_map', db)(db)
+        self.idempotency_repository = get_repository_class('idempotency', db)(db)
+        self.outbox_repository = get_repository_class('outbox', db)(db)
+        if event_log is None and config.TRADE_LOG:
+            event_log = get_trade_event_log()
+        self.event_log = event_log
+        if event_log is not None:
+            event_log.watch(self.outbox_repository.db)
+        self.user_locks = user_locks if user_locks is not None else get_user_locks()
+        concurrency = concurrency if concurrency is not None else config.CONCURRENCY
+        if concurrency not in ('pessimistic', 'optimistic'):
+            raise Exception(f'Unknown concurrency {concurrency}, choose pessimistic or optimistic')
+        self.optimistic = concurrency == 'optimistic' and hasattr(self.user_repository, 'get_versioned_user')
+
+    def transaction(self):
+        """
+        Returns a unit of work in which all the repository calls of a trade run on one connection and are committed
+        together
+        """
+        return self.user_repository.db.transaction()
+
+    def lock_users(self, *user_ids):
+        """
+        Returns a context holding the striped locks of users, entered before the unit of work of a trade so that the
+        trades of a user run in order while the trades of other users go on. Nothing is held inside a unit of work as
+        the database already orders the trades there, which also keeps the user locks always taken before the lock of
+        the database.
+        """
+        if self.user_locks is None or self.user_repository.db.in_transaction():
+            return nullcontext()
+        return self.user_locks.hold(user_ids)
+
+    def runs_optimistically(self):
+        """
+        Returns whether a trade runs optimistically, inside a unit of work the rows are already held by it
+        """
+        return self.optimistic and not self.user_repository.db.in_transaction()
+
+    def retry_on_conflict(self, trade, *args):
+        """
+        Runs an optimistic trade, again after a random pause when a row it read was changed by another trade. The
+        pause is drawn up to a bound doubling with every attempt, so trades colliding once don't collide again in
+        lockstep.
+        Parameters
+        ----------
+        trade: callable
+            optimistic trade raising VersionConflictError on a conflict
+        args: tuple
+            arguments of the trade
+
+        Returns
+        -------
+        str
+        """
+        for attempt in range(config.OPTIMISTIC_RETRIES + 1):
+            try:
+                return trade(*args)
+            except VersionConflictError:
+                if config.METRICS:
+                    VERSION_CONFLICTS.inc()
+                if attempt < config.OPTIMISTIC_RETRIES:
+                    time.sleep(random.uniform(0, config.OPTIMISTIC_BACKOFF * 2 ** attempt))
+        raise Exception('Too many concurrent trades for this user, try again later')
+
+    def record_events(self, events):
+        """
+        Adds trade events to the outbox in the running unit of work, which numbers them in the order the trades are
+        committed. The event log relays the outbox in the background, so the trade does not wait for it. Events carry
+        the user id as an int since a request may send it as a string.
+        """
+        if self.event_log is not None and events:
+            self.outbox_repository.add_events(events)
+
+    def stored_response(self, idempotency_key, operation, *args):
+        """
+        Returns the response stored for a trade already run with an idempotency key
+        Parameters
+        ----------
+        idempotency_key: str
+            key the client sent with the trade
+        operation: str
+            buy_an_equity, sell_an_equity or add_fund
+        args: tuple
+            arguments of the method
+
+        Returns
+        -------
+        str or None
+            None if the key was not used yet by the user
+        """
+        if operation not in IDEMPOTENT_OPERATIONS:
+            raise Exception(f'{operation} does not take an idempotency key')
+        if not isinstance(idempotency_key, str) or not idempotency_key:
+            raise Exception('Provide the idempotency key as a non empty string')
+        stored = self.idempotency_repository.get_response(args[0], idempotency_key)
+        if stored is None:
+            return None
+        if stored.request != json.dumps([operation, *args]):
+            raise Exception(f'Idempotency key {idempotency_key} was already used for another request')
+        if config.METRICS:
+            IDEMPOTENT_REPLAYS.inc()
+        return stored.response
+
+    def run_idempotent(self, idempotency_key, operation, *args):
+        """
+        Runs a trade once per idempotency key of a user. The response is stored in the unit of work of the trade, so a
+        retry gets it back without touching the user and position rows, and a trade which fails stores nothing and
+        can be retried.
+        Parameters
+        ----------
+        idempotency_key: str
+            key the client sent with the trade
+        operation: str
+            buy_an_equity, sell_an_equity or add_fund
+        args: tuple
+            arguments of the method
+
+        Returns
+        -------
+        str
+        """
+        response = self.stored_response(idempotency_key, operation, *args)
+        if response is not None:
+            return response
+        with self.lock_users(args[0]), self.transaction():
+            # a retry sent while the first try was running waits for its lock and finds its response here
+            response = self.stored_response(idempotency_key, operation, *args)
+            if response is not None:
+                return response
+            response = getattr(self, operation)(*args)
+            self.idempotency_repository.save_response(args[0], idempotency_key, json.dumps([operation, *args]),
+                                                      response)
+        return response
 
     @staticmethod
     def can_perform_transaction(time_stamp):
         """
-        Checks whether an equity can be bought or sold from 9 to 5 and Monday to Friday
+        Checks whether an equity can be bought or sold at a time stamp as per the trading calendar of the configured
+        exchange, by default from 9 to 5 and Monday to Friday
         Parameters
         ----------
         time_stamp: str
@@ -23,14 +191,7 @@ class BrokingService:
         -------
         bool
         """
-        date_time = datetime.datetime.strptime(time_stamp, '%d/%m/%Y %H:%M:%S')
-        # Between 9 am and 5 pm
-        if date_time.time() < datetime.time(9, 0, 0) or date_time.time() > datetime.time(17, 0, 0):
-            raise Exception('You can only buy an equity between 9am and 5pm')
-        # Monday is 0 and Sunday is 6
-        if date_time.weekday() > 4:
-            raise Exception('You can only buy an equity between Monday and Friday')
-        return True
+        return get_calendar(config.EXCHANGE).check(time_stamp)
 
     def buy_an_equity(self, user_id, equity_id, num_of_shares, time_stamp):
         """
@@ -55,38 +216,21 @@ class BrokingService:
         if num_of_shares == 0:
             raise Exception('Provide minimum one share to buy')
         self.can_perform_transaction(time_stamp)
-        user_info = self.user_repository.get_user(user_id)
-        current_balance = user_info[2]
-        equity_info = self.equity_repository.get_equity(equity_id)
-        equity_price = equity_info[2]
-        total_amount_to_deduct = equity_price * num_of_shares
-        if current_balance < total_amount_to_deduct:
-            raise Exception('Insufficient balance to buy')
-        user_equity_map_id = self.map_repository.get_user_equity_mapping_id(user_id, equity_id)
-        if user_equity_map_id is not None:
-            user_equity_info = self.map_repository.get_user_equity(user_equity_map_id)
-            total_shares = num_of_shares + user_equity_info[3]
-            updated_user_equity = {
-                'id': user_equity_map_id,
-                'user_id': user_id,
-                'equity_id': equity_id,
-                'total_shares': total_shares
-            }
-            self.map_repository.update_equity(updated_user_equity)
-        else:
-            total_shares = num_of_shares
-            updated_user_equity = {
-                'user_id': user_id,
-                'equity_id': equity_id,
-                'total_shares': total_shares
-            }
-            self.map_repository.add_user_equity(updated_user_equity)
-        updated_user = {
-            'id': user_id,
-            'name': user_info[1],
-            'balance': current_balance - total_amount_to_deduct
-        }
-        self.user_repository.update_user(updated_user)
+        if self.runs_optimistically():
+            return self.retry_on_conflict(self.buy_optimistically, user_id, equity_id, num_of_shares, time_stamp)
+        with self.lock_users(user_id), self.transaction():
+            equity_info = self.equity_repository.get_equity(equity_id)
+            if equity_info is None:
+                raise Exception('No such equity exists')
+            equity_price = equity_info.price
+            total_amount_to_deduct = equity_price * num_of_shares
+            if not self.user_repository.debit_balance(user_id, total_amount_to_deduct):
+                if self.user_repository.get_user(user_id) is None:
+                    raise Exception('No such user exists')
+                raise Exception('Insufficient balance to buy')
+            self.map_repository.upsert_position(user_id, equity_id, num_of_shares)
+            self.record_events([{'type': 'buy', 'userId': int(user_id), 'equityId': equity_id, 'shares': num_of_shares,
+                                 'price': equity_price, 'timeStamp': time_stamp}])
         return 'Equity bought successfully'
 
     def sell_an_equity(self, user_id, equity_id, num_of_shares, time_stamp):
@@ -112,36 +256,101 @@ class BrokingService:
         if num_of_shares == 0:
             raise Exception('Provide minimum one share to sell')
         self.can_perform_transaction(time_stamp)
-        user_equity_map_id = self.map_repository.get_user_equity_mapping_id(user_id, equity_id)
-        if not user_equity_map_id:
-            raise Exception('User does not have selected equity')
-        else:
-            user_equity_info = self.map_repository.get_user_equity(user_equity_map_id)
-            total_shares = user_equity_info[3]
-            if total_shares < num_of_shares:
+        if self.runs_optimistically():
+            return self.retry_on_conflict(self.sell_optimistically, user_id, equity_id, num_of_shares, time_stamp)
+        with self.lock_users(user_id), self.transaction():
+            if not self.map_repository.remove_shares(user_id, equity_id, num_of_shares):
+                if self.map_repository.get_position(user_id, equity_id) is None:
+                    raise Exception('User does not have selected equity')
                 raise Exception('Insufficient shares to sell')
             equity_info = self.equity_repository.get_equity(equity_id)
-            equity_price = equity_info[2]
+            if equity_info is None:
+                raise Exception('No such equity exists')
+            equity_price = equity_info.price
             total_amount_to_add = equity_price * num_of_shares
-            user_info = self.user_repository.get_user(user_id)
-            current_balance = user_info[2]
-            if total_shares == num_of_shares:
-                self.map_repository.delete_user_equity_map(user_equity_map_id)
+            if not self.user_repository.credit_balance(user_id, total_amount_to_add):
+                raise Exception('No such user exists')
+            self.record_events([{'type': 'sell', 'userId': int(user_id), 'equityId': equity_id, 'shares': num_of_shares,
+                                 'price': equity_price, 'timeStamp': time_stamp}])
+        return 'Equity sold successfully'
+
+    def buy_optimistically(self, user_id, equity_id, num_of_shares, time_stamp):
+        """
+        Buys shares like buy_an_equity without holding any lock while the user and position are read, the update
+        only applies if both rows still have the version read
+        Raises
+        ------
+        VersionConflictError
+            when the user or the position was changed meanwhile
+        """
+        equity_info = self.equity_repository.get_equity(equity_id)
+        if equity_info is None:
+            raise Exception('No such equity exists')
+        user = self.user_repository.get_versioned_user(user_id)
+        if user is None:
+            raise Exception('No such user exists')
+        equity_price = equity_info.price
+        total_amount_to_deduct = equity_price * num_of_shares
+        if user.balance < total_amount_to_deduct:
+            raise Exception('Insufficient balance to buy')
+        position = self.map_repository.get_versioned_position(user_id, equity_id)
+        with self.transaction():
+            if not self.user_repository.update_user({'id': user_id, 'name': user.name,
+                                                     'balance': user.balance - total_amount_to_deduct,
+                                                     'version': user.version}):
+                raise VersionConflictError(f'User {user_id} was changed')
+            if position is None:
+                updated = self.map_repository.add_position(user_id, equity_id, num_of_shares)
             else:
-                updated_user_equity = {
-                    'id': user_equity_map_id,
-                    'user_id': user_id,
-                    'equity_id': equity_id,
-                    'total_shares': total_shares - num_of_shares
-                }
-                self.map_repository.update_equity(updated_user_equity)
-            updated_user = {
-                'id': user_id,
-                'name': user_info[1],
-                'balance': current_balance + total_amount_to_add
-            }
-            self.user_repository.update_user(updated_user)
-            return 'Equity sold successfully'
+                updated = self.map_repository.update_equity({'id': position.id, 'user_id': user_id,
+                                                             'equity_id': equity_id,
+                                                             'total_shares': position.total_shares + num_of_shares,
+                                                             'version': position.version})
+            if not updated:
+                raise VersionConflictError(f'Position of user {user_id} in equity {equity_id} was changed')
+            self.record_events([{'type': 'buy', 'userId': int(user_id), 'equityId': equity_id, 'shares': num_of_shares,
+                                 'price': equity_price, 'timeStamp': time_stamp}])
+        return 'Equity bought successfully'
+
+    def sell_optimistically(self, user_id, equity_id, num_of_shares, time_stamp):
+        """
+        Sells shares like sell_an_equity without holding any lock while the position and user are read, the update
+        only applies if both rows still have the version read
+        Raises
+        ------
+        VersionConflictError
+            when the position or the user was changed meanwhile
+        """
+        position = self.map_repository.get_versioned_position(user_id, equity_id)
+        if position is None:
+            raise Exception('User does not have selected equity')
+        if position.total_shares < num_of_shares:
+            raise Exception('Insufficient shares to sell')
+        equity_info = self.equity_repository.get_equity(equity_id)
+        if equity_info is None:
+            raise Exception('No such equity exists')
+        user = self.user_repository.get_versioned_user(user_id)
+        if user is None:
+            raise Exception('No such user exists')
+        equity_price = equity_info.price
+        total_amount_to_add = equity_price * num_of_shares
+        remaining_shares = position.total_shares - num_of_shares
+        with self.transaction():
+            if remaining_shares > 0:
+                updated = self.map_repository.update_equity({'id': position.id, 'user_id': user_id,
+                                                             'equity_id': equity_id, 'total_shares': remaining_shares,
+                                                             'version': position.version})
+            else:
+                updated = self.map_repository.delete_user_equity_map(position.id, position.version)
+            if not updated:
+                raise VersionConflictError(f'Position of user {user_id} in equity {equity_id} was changed')
+            if not self.user_repository.update_user({'id': user_id, 'name': user.name,
+                                                     'balance': user.balance + total_amount_to_add,
+                                                     'version': user.version}):
+                raise VersionConflictError(f'User {user_id} was changed')
+            self.record_events([{'type': 'sell', 'userId': int(user_id), 'equityId': equity_id, 'shares': num_of_shares,
+                                 'price': equity_price, 'timeStamp': time_stamp}])
+        return 'Equity sold successfully'
 
     def add_fund(self, user_id, amount):
         """
@@ -159,18 +368,150 @@ class BrokingService:
         """
         if amount < 0:
             raise Exception('Negative amount cannot be added')
-        user_result = self.user_repository.get_user(user_id)
-        if user_result is None:
-            raise Exception('No such user exists')
-        user = {
-            'id': user_id,
-            'name': user_result[1],
-            'balance': user_result[2] + amount
-        }
-        if not self.user_repository.update_user(user):
-            raise Exception('Some error occurred while updating user balance')
+        with self.lock_users(user_id), self.transaction():
+            if not self.user_repository.credit_balance(user_id, amount):
+                if self.user_repository.get_user(user_id) is None:
+                    raise Exception('No such user exists')
+                raise Exception('Some error occurred while updating user balance')
+            self.record_events([{'type': 'fund', 'userId': int(user_id), 'amount': amount}])
         return 'User balance updated successfully'
 
+    def validate_order(self, order):
+        """
+        Validates an order of a batch the same way as its single order counterpart, except for its time stamp which
+        execute_orders checks with the ones of the other orders
+        Parameters
+        ----------
+        order: dict
+            order with type buy, sell or addAmount and the fields of the matching single order request
+
+        Returns
+        -------
+        tuple
+            (type, user id, equity id, num of shares or amount, time stamp)
+        """
+        try:
+            order_type = order['type']
+            # checked first so that an unknown type is not reported as a missing field of another type
+            if order_type not in ('buy', 'sell', 'addAmount'):
+                raise Exception(f'Unknown order type {order_type}')
+            user_id = order['userId']
+            # checked before the locks and shards of the batch are picked by it, so only this order fails
+            try:
+                user_id = int(user_id)
+            except (TypeError, ValueError):
+                raise Exception(f'Invalid user id {user_id}')
+            if order_type == 'addAmount':
+                amount = order['amount']
+                if amount < 0:
+                    raise Exception('Negative amount cannot be added')
+                return order_type, user_id, None, amount, None
+            equity_id = order['equityId']
+            num_of_shares = order['numOfShares']
+            time_stamp = order['timeStamp']
+        except KeyError as e:
+            raise Exception(f'{str(e)} not found in request')
+        if num_of_shares < 0:
+            raise Exception(f'Provide non negative number of shares to {order_type}')
+        if num_of_shares == 0:
+            raise Exception(f'Provide minimum one share to {order_type}')
+        return order_type, user_id, equity_id, num_of_shares, time_stamp
+
+    def execute_orders(self, orders):
+        """
+        Executes a batch of buy, sell and addAmount orders. Orders are validated together and applied in chunks, each
+        chunk in one transaction: the users, equities and positions it touches are read at once, the orders are
+        played in sequence on them and the net change of every user and position is written with executemany.
+        Parameters
+        ----------
+        orders: list of dict
+            orders with type buy, sell or addAmount and the fields of the matching single order request
+
+        Returns
+        -------
+        list of dict
+            result of every order in the same sequence, either a message or an error
+        """
+        results = [None] * len(orders)
+        valid_orders = []
+        for index, order in enumerate(orders):
+            try:
+                valid_orders.append((index, self.validate_order(order)))
+            except Exception as e:
+                results[index] = {'error': str(e)}
+        # the time stamps of the batch are checked against the trading calendar in one call
+        trades = [(index, order) for index, order in valid_orders if order[4] is not None]
+        errors = get_calendar(config.EXCHANGE).check_all([time_stamp for _, (_, _, _, _, time_stamp) in trades])
+        for (index, _), error in zip(trades, errors):
+            if error is not None:
+                results[index] = {'error': str(error)}
+        valid_orders = [(index, order) for index, order in valid_orders if results[index] is None]
+        for start in range(0, len(valid_orders), config.ORDER_BATCH_CHUNK_SIZE):
+            chunk = valid_orders[start:start + config.ORDER_BATCH_CHUNK_SIZE]
+            with self.lock_users(*(user_id for _, (_, user_id, _, _, _) in chunk)), self.transaction():
+                for index, result in self._apply_orders(chunk):
+                    results[index] = result
+        return results
+
+    def _apply_orders(self, orders):
+        user_ids = {user_id for _, (_, user_id, _, _, _) in orders}
+        equity_ids = {equity_id for _, (_, _, equity_id, _, _) in orders if equity_id is not None}
+        pairs = {(user_id, equity_id) for _, (_, user_id, equity_id, _, _) in orders if equity_id is not None}
+        balances = {user.id: user.balance for user in self.user_repository.get_users(user_ids)}
+        prices = {equity.id: equity.price for equity in self.equity_repository.get_equities(equity_ids)}
+        shares = {(position.user_id, position.equity_id): position.total_shares
+                  for position in self.map_repository.get_positions(pairs)}
+        balance_changes = {}
+        share_changes = {}
+        events = []
+        results = []
+        for index, (order_type, user_id, equity_id, quantity, time_stamp) in orders:
+            if user_id not in balances:
+                results.append((index, {'error': 'No such user exists'}))
+                continue
+            if order_type == 'addAmount':
+                amount = quantity
+                message = 'User balance updated successfully'
+            elif order_type == 'buy':
+                if equity_id not in prices:
+                    results.append((index, {'error': 'No such equity exists'}))
+                    continue
+                amount = -prices[equity_id] * quantity
+                if balances[user_id] + amount < 0:
+                    results.append((index, {'error': 'Insufficient balance to buy'}))
+                    continue
+                message = 'Equity bought successfully'
+            else:
+                held = shares.get((user_id, equity_id), 0)
+                if held <= 0:
+                    results.append((index, {'error': 'User does not have selected equity'}))
+                    continue
+                if held < quantity:
+                    results.append((index, {'error': 'Insufficient shares to sell'}))
+                    continue
+                if equity_id not in prices:
+                    results.append((index, {'error': 'No such equity exists'}))
+                    continue
+                amount = prices[equity_id] * quantity
+                quantity = -quantity
+                message = 'Equity sold successfully'
+            balances[user_id] += amount
+            balance_changes[user_id] = balance_changes.get(user_id, 0) + amount
+            if order_type != 'addAmount':
+                shares[(user_id, equity_id)] = shares.get((user_id, equity_id), 0) + quantity
+                share_changes[(user_id, equity_id)] = share_changes.get((user_id, equity_id), 0) + quantity
+                events.append({'type': order_type, 'userId': user_id, 'equityId': equity_id, 'shares': abs(quantity),
+                               'price': prices[equity_id], 'timeStamp': time_stamp})
+            else:
+                events.append({'type': 'fund', 'userId': user_id, 'amount': amount})
+            results.append((index, {'message': message}))
+        self.user_repository.credit_balances([(user_id, amount) for user_id, amount in balance_changes.items()
+                                              if amount])
+        self.map_repository.upsert_positions([(user_id, equity_id, quantity)
+                                              for (user_id, equity_id), quantity in share_changes.items() if quantity])
+        self.record_events(events)
+        return results
+
     def get_balance(self, user_id):
         """
         Returns current balance of a user
@@ -186,5 +527,114 @@ class BrokingService:
         user = self.user_repository.get_user(user_id)
         if user is None:
             raise Exception('No such user exists')
-        current_balance = user[2]
+        current_balance = user.balance
         return current_balance
+
+    def export(self, kind, after_id=0):
+        """
+        Yields users, equities or positions with an id above after_id in id order, they are read from the database
+        while they are consumed so that an export of any size takes constant memory
+        Parameters
+        ----------
+        kind: str
+            users, equities or positions
+        after_id: int
+            id of the last row already exported, 0 to start from the beginning
+        """
+        if getattr(self.user_repository.db, 'paged_exports', False):
+            pages = {
+                'users': self.user_repository.get_users_page,
+                'equities': self.equity_repository.get_equities_page,
+                'positions': self.map_repository.get_positions_page,
+            }
+            rows = self.read_pages(pages[kind], after_id)
+        else:
+            streams = {
+                'users': self.user_repository.stream_users,
+                'equities': self.equity_repository.stream_equities,
+                'positions': self.map_repository.stream_positions,
+            }
+            rows = streams[kind](after_id)
+        for row in rows:
+            yield self.export_row(kind, row)
+
+    @staticmethod
+    def read_pages(get_page, after_id):
+        """
+        Yields the rows of keyset pages, each page is a query of its own so that no connection is held between two
+        pages, which lets trades run in between on a database with a single connection
+        Parameters
+        ----------
+        get_page: callable
+            called with after_id and the page size, returns rows in id order
+        after_id: int
+            id of the last row already read
+        """
+        while True:
+            page = get_page(after_id, config.STREAM_BATCH_SIZE)
+            yield from page
+            if len(page) < config.STREAM_BATCH_SIZE:
+                return
+            after_id = page[-1].id
+
+    @staticmethod
+    def export_row(kind, row):
+        """
+        Returns the exported fields of a User, Equity or Position
+        """
+        if kind == 'users':
+            return {'userId': row.id, 'name': row.name, 'balance': row.balance}
+        if kind == 'equities':
+            return {'equityId': row.id, 'name': row.name, 'price': row.price}
+        return {'positionId': row.id, 'userId': row.user_id, 'equityId': row.equity_id, 'shares': row.total_shares}
+
+    def get_portfolio(self, user_id):
+        """
+        Returns holdings of a user valued at current prices along with the balance and total net worth
+        Parameters
+        ----------
+        user_id: int
+            id of the user
+
+        Returns
+        -------
+        dict
+        """
+        return self.value_portfolio(self.map_repository.get_portfolio(user_id))
+
+    @staticmethod
+    def value_portfolio(rows):
+        """
+        Values the portfolio rows of a user at their current prices
+        Parameters
+        ----------
+        rows: list of PortfolioRow
+            rows returned by UserEquityMapRepository.get_portfolio
+
+        Returns
+        -------
+        dict
+        """
+        if not rows:
+            raise Exception('No such user exists')
+        balance = rows[0].balance
+        holdings = []
+        holdings_value = 0
+        for _, _, equity_id, name, total_shares, price in rows:
+            if equity_id is None:
+                continue
+            market_value = total_shares * price if price is not None else None
+            holdings.append({
+                'equityId': equity_id,
+                'name': name,
+                'shares': total_shares,
+                'price': price,
+                'marketValue': market_value
+            })
+            holdings_value += market_value or 0
+        return {
+            'balance': balance,
+            'holdings': holdings,
+            'holdingsValue': holdings_value,
+            'netWorth': balance + holdings_value
+        }
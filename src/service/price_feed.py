@@ -0,0 +1,122 @@
+import argparse
+import csv
+import json
+import math
+import time
+from itertools import islice
+from src import config
+from src.metrics import REGISTRY
+from src.persistence.storage import get_repository_class
+
+
+PRICE_TICKS = REGISTRY.counter('ebroker_price_ticks_total', 'Price ticks received from the feed')
+PRICE_UPDATES = REGISTRY.counter('ebroker_price_updates_total', 'Equity prices written after coalescing the ticks')
+
+
+def validate_tick(equity_id, price):
+    """
+    Returns a tick as (equity id, price) after checking its values
+    """
+    if isinstance(equity_id, bool) or not isinstance(equity_id, int):
+        raise Exception(f'Invalid equity id {equity_id}')
+    # NaN is not below 0, so non finite prices are rejected on their own
+    if isinstance(price, bool) or not isinstance(price, (int, float)) or not math.isfinite(price) or price < 0:
+        raise Exception(f'Provide a non negative price for equity {equity_id}')
+    return equity_id, price
+
+
+def read_ticks(path):
+    """
+    Yields (equity id, price) of the ticks of a file in file order, either a CSV file with equityId and price columns
+    or a file with one JSON object with equityId and price per line
+    Parameters
+    ----------
+    path: str
+        path of a .csv, .ndjson or .jsonl file
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            for line_number, row in enumerate(csv.DictReader(f), start=2):
+                try:
+                    yield validate_tick(int(row['equityId']), float(row['price']))
+                except (KeyError, TypeError, ValueError):
+                    raise Exception(f'Invalid tick at line {line_number} of {path}')
+        else:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    tick = json.loads(line)
+                    yield validate_tick(tick['equityId'], tick['price'])
+                except (KeyError, TypeError, ValueError):
+                    raise Exception(f'Invalid tick at line {line_number} of {path}')
+
+
+class PriceFeed:
+    def __init__(self, db=None, batch_size=config.PRICE_FEED_BATCH_SIZE):
+        """
+        Writes equity prices from a market data feed. Ticks are taken batch_size at a time, the ticks of a batch are
+        coalesced to the last price of every equity and written in one transaction.
+        Parameters
+        ----------
+        db: BrokingDB, LedgerDB or ShardedDB
+            database of the equities, defaults to the shared one of the configured storage engine
+        batch_size: int
+            max num of ticks written in one transaction
+        """
+        self.equity_repository = get_repository_class('equity', db)(db)
+        self.batch_size = batch_size
+
+    def apply(self, ticks):
+        """
+        Writes the prices of ticks
+        Parameters
+        ----------
+        ticks: iterable of tuple
+            (equity id, price) pairs in the order they were received
+
+        Returns
+        -------
+        dict
+            num of ticks, num of prices written, seconds taken and ticks per second
+        """
+        started = time.perf_counter()
+        ticks = iter(ticks)
+        num_of_ticks = 0
+        updated = 0
+        while True:
+            batch = list(islice(ticks, self.batch_size))
+            if not batch:
+                break
+            batch_updated = self.equity_repository.update_prices(batch)
+            num_of_ticks += len(batch)
+            updated += batch_updated
+            if config.METRICS:
+                PRICE_TICKS.inc(len(batch))
+                PRICE_UPDATES.inc(batch_updated)
+        seconds = time.perf_counter() - started
+        return {
+            'ticks': num_of_ticks,
+            'updated': updated,
+            'seconds': seconds,
+            'ticksPerSecond': num_of_ticks / seconds if seconds else 0,
+        }
+
+    def load(self, path):
+        """
+        Writes the prices of a CSV or NDJSON tick file, see read_ticks
+        """
+        return self.apply(read_ticks(path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load equity prices from CSV or NDJSON tick files')
+    parser.add_argument('files', nargs='+', help='.csv files with equityId and price columns or .ndjson files')
+    parser.add_argument('--batch-size', type=int, default=config.PRICE_FEED_BATCH_SIZE,
+                        help='max num of ticks written in one transaction')
+    args = parser.parse_args()
+    price_feed = PriceFeed(batch_size=args.batch_size)
+    for tick_file in args.files:
+        stats = price_feed.load(tick_file)
+        print(f'{tick_file}: {stats["ticks"]} ticks, {stats["updated"]} prices written in {stats["seconds"]:.2f}s '
+              f'({stats["ticksPerSecond"]:.0f} ticks/s)')
@@ -0,0 +1,321 @@
+import argparse
+import atexit
+import os
+import threading
+import time
+import weakref
+from src import config
+from src.persistence.journal import Journal, read_entries, read_snapshot, write_snapshot
+from src.persistence.storage import get_repository_class
+
+
+class TradeState:
+    def __init__(self, sequence=0, balances=None, positions=None):
+        """
+        Balances and positions rebuilt from trade events
+        Parameters
+        ----------
+        sequence: int
+            sequence number of the last event applied
+        balances: dict
+            user id to balance
+        positions: dict
+            (user id, equity id) to num of shares
+        """
+        self.sequence = sequence
+        self.balances = balances if balances is not None else {}
+        self.positions = positions if positions is not None else {}
+
+    def apply(self, event):
+        """
+        Applies a buy, sell or fund event
+        """
+        user_id = event['userId']
+        if event['type'] == 'fund':
+            self.balances[user_id] = self.balances.get(user_id, 0) + event['amount']
+            return
+        key = (user_id, event['equityId'])
+        amount = event['price'] * event['shares']
+        if event['type'] == 'buy':
+            self.balances[user_id] = self.balances.get(user_id, 0) - amount
+            self.positions[key] = self.positions.get(key, 0) + event['shares']
+        elif event['type'] == 'sell':
+            self.balances[user_id] = self.balances.get(user_id, 0) + amount
+            shares = self.positions.get(key, 0) - event['shares']
+            if shares > 0:
+                self.positions[key] = shares
+            else:
+                self.positions.pop(key, None)
+        else:
+            raise Exception(f'Unknown trade event {event["type"]}')
+
+    def to_snapshot(self):
+        return {
+            'sequence': self.sequence,
+            'balances': [[user_id, balance] for user_id, balance in self.balances.items()],
+            'positions': [[user_id, equity_id, shares] for (user_id, equity_id), shares in self.positions.items()],
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        return cls(snapshot['sequence'], {user_id: balance for user_id, balance in snapshot['balances']},
+                   {(user_id, equity_id): shares for user_id, equity_id, shares in snapshot['positions']})
+
+
+class TradeEventLog:
+    def __init__(self, path=config.TRADE_LOG_FILE, snapshot_file=config.TRADE_LOG_SNAPSHOT_FILE,
+                 fsync_batch_size=config.TRADE_LOG_FSYNC_BATCH_SIZE, fsync_interval=config.TRADE_LOG_FSYNC_INTERVAL,
+                 compact_every=config.TRADE_LOG_COMPACT_EVERY, db=None, relay_interval=config.TRADE_LOG_RELAY_INTERVAL):
+        """
+        Event sourced history of trades. Every committed buy, sell and fund is appended to a sequential log, which is
+        fsynced once per fsync_batch_size events or fsync_interval seconds instead of once per trade. Trades leave
+        their events in the outbox of their database, a background thread moves them to the log every relay_interval
+        seconds, so neither the relay nor the fsync of the log runs on the trade or inside its transaction. After
+        compact_every events the log is moved aside and folded into a snapshot of balances and positions on a
+        background thread, so replaying it never goes through more than the events since the last snapshot.
+        The first snapshot holds the balances and positions of the database at the time the log is started.
+        Parameters
+        ----------
+        path: str
+            path of the event log
+        snapshot_file: str
+            path of the snapshot the log is compacted into
+        fsync_batch_size: int
+            num of events after which the log is fsynced
+        fsync_interval: float
+            seconds after which pending events are fsynced, 0 to only fsync by batch size
+        compact_every: int
+            num of events after which the log is compacted, 0 to never compact
+        db: BrokingDB or LedgerDB
+            database the first snapshot is taken from, defaults to the shared one of the configured storage engine
+        relay_interval: float
+            seconds between two relays of the outboxes, 0 to only relay on relay() and close()
+        """
+        self.path = path
+        self.snapshot_file = snapshot_file
+        self.compacting_file = f'{path}.compacting'
+        self.fsync_batch_size = fsync_batch_size
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.journal = Journal(path)
+        # held while the snapshot and the moved aside log don't match
+        self._compaction_lock = threading.Lock()
+        if os.path.exists(self.compacting_file):
+            # finishes a compaction cut short by a stop
+            self._compact()
+        snapshot = read_snapshot(snapshot_file)
+        if snapshot is None:
+            snapshot = self._take_baseline(db)
+        self.journal.sequence = max(self.journal.sequence, snapshot['sequence'])
+        self._since_compaction = sum(1 for _ in self.journal.read(after=snapshot['sequence']))
+        self._unsynced = 0
+        self._lock = threading.Lock()
+        self._compaction_thread = None
+        self._stop_syncing = threading.Event()
+        self._sync_thread = None
+        if fsync_interval > 0:
+            self._sync_thread = threading.Thread(target=self._run_syncs, daemon=True, name='ebroker-trade-log-sync')
+            self._sync_thread.start()
+        self.relay_interval = relay_interval
+        # databases whose outbox is relayed to this log, one relay runs at a time
+        self._outbox_dbs = weakref.WeakSet()
+        self._relay_lock = threading.Lock()
+        self._stop_relaying = threading.Event()
+        self._relay_thread = None
+        if relay_interval > 0:
+            self._relay_thread = threading.Thread(target=self._run_relays, daemon=True,
+                                                  name='ebroker-trade-log-relay')
+            self._relay_thread.start()
+
+    def _take_baseline(self, db):
+        users = get_repository_class('user', db)(db)
+        positions = get_repository_class('user_equity_map', db)(db)
+        state = TradeState(self.journal.sequence, {user.id: user.balance for user in users.get_all_users()},
+                           {(position.user_id, position.equity_id): position.total_shares
+                            for position in positions.get_all_positions()})
+        snapshot = state.to_snapshot()
+        write_snapshot(self.snapshot_file, snapshot)
+        return snapshot
+
+    def record(self, events):
+        """
+        Appends events to the log
+        Parameters
+        ----------
+        events: list of dict
+            buy and sell events with type, userId, equityId, shares, price and timeStamp, fund events with type,
+            userId and amount
+        """
+        with self._lock:
+            self.journal.append(events)
+            self._unsynced += len(events)
+            if self._unsynced >= self.fsync_batch_size:
+                self._sync()
+            self._since_compaction += len(events)
+            if self.compact_every and self._since_compaction >= self.compact_every:
+                self._start_compaction()
+
+    def watch(self, db):
+        """
+        Relays the outbox of a database to this log from now on
+        Parameters
+        ----------
+        db: BrokingDB, LedgerDB or ShardedDB
+            database the trades leave their events in
+        """
+        self._outbox_dbs.add(db)
+
+    def relay(self):
+        """
+        Appends the events left in the outboxes of the watched databases in the order their trades were committed
+        """
+        with self._relay_lock:
+            for db in list(self._outbox_dbs):
+                get_repository_class('outbox', db)(db).relay(self.record)
+
+    def _run_relays(self):
+        while not self._stop_relaying.wait(self.relay_interval):
+            try:
+                self.relay()
+            except Exception as e:
+                # the events stay in the outbox and are relayed next time
+                print(str(e))
+
+    def _sync(self):
+        self.journal.sync()
+        self._unsynced = 0
+
+    def _run_syncs(self):
+        while not self._stop_syncing.wait(self.fsync_interval):
+            with self._lock:
+                if self._unsynced:
+                    self._sync()
+
+    def _start_compaction(self):
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        self._sync()
+        self.journal.rotate(self.compacting_file)
+        self._since_compaction = 0
+        self._compaction_thread = threading.Thread(target=self._compact, daemon=True, name='ebroker-trade-log-compact')
+        self._compaction_thread.start()
+
+    def _compact(self):
+        with self._compaction_lock:
+            state = TradeState.from_snapshot(read_snapshot(self.snapshot_file))
+            for sequence, event in read_entries(self.compacting_file, after=state.sequence):
+                state.apply(event)
+                state.sequence = sequence
+            write_snapshot(self.snapshot_file, state.to_snapshot())
+            os.remove(self.compacting_file)
+
+    def compact(self):
+        """
+        Folds all the events logged so far into the snapshot and waits for it to be written
+        """
+        running = self._compaction_thread
+        if running is not None:
+            running.join()
+        with self._lock:
+            self._start_compaction()
+            thread = self._compaction_thread
+        thread.join()
+
+    def replay(self):
+        """
+        Rebuilds balances and positions from the snapshot and the events logged after it
+        Returns
+        -------
+        TradeState
+        """
+        with self._lock, self._compaction_lock:
+            state = TradeState.from_snapshot(read_snapshot(self.snapshot_file))
+            for path in (self.compacting_file, self.path):
+                for sequence, event in read_entries(path, after=state.sequence):
+                    state.apply(event)
+                    state.sequence = sequence
+            return state
+
+    def restore(self, db=None):
+        """
+        Writes the balances and positions rebuilt from the log into a database
+        Parameters
+        ----------
+        db: BrokingDB or LedgerDB
+            database to restore, defaults to the shared one of the configured storage engine
+        """
+        users = get_repository_class('user', db)(db)
+        positions = get_repository_class('user_equity_map', db)(db)
+        # events a stop left in the outbox are part of the history
+        self.watch(users.db)
+        self.relay()
+        state = self.replay()
+        with users.db.transaction():
+            for user in users.get_all_users():
+                balance = state.balances.get(user.id)
+                if balance is not None and balance != user.balance:
+                    users.update_user({'id': user.id, 'name': user.name, 'balance': balance})
+            current = {(position.user_id, position.equity_id): position.total_shares
+                       for position in positions.get_all_positions()}
+            for key in set(current) | set(state.positions):
+                change = state.positions.get(key, 0) - current.get(key, 0)
+                if change:
+                    positions.upsert_position(key[0], key[1], change)
+
+    def close(self):
+        """
+        Relays the events left in the outboxes, fsyncs the pending events and waits for a running compaction
+        """
+        if self._relay_thread is not None:
+            self._stop_relaying.set()
+            self._relay_thread.join()
+            self._relay_thread = None
+        try:
+            self.relay()
+        except Exception as e:
+            # a database closed first keeps its events in its outbox for the next start
+            print(str(e))
+        if self._sync_thread is not None:
+            self._stop_syncing.set()
+            self._sync_thread.join()
+            self._sync_thread = None
+        with self._lock:
+            self._sync()
+            thread = self._compaction_thread
+        if thread is not None:
+            thread.join()
+        self.journal.close()
+
+
+_trade_event_log = None
+_trade_event_log_lock = threading.Lock()
+
+
+def get_trade_event_log():
+    """
+    Returns the trade event log of this process
+    Returns
+    -------
+    TradeEventLog
+    """
+    global _trade_event_log
+    if _trade_event_log is None:
+        with _trade_event_log_lock:
+            if _trade_event_log is None:
+                _trade_event_log = TradeEventLog()
+                atexit.register(_trade_event_log.close)
+    return _trade_event_log
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain the trade event log')
+    parser.add_argument('command', choices=('compact', 'restore'),
+                        help='compact the log into its snapshot or restore the database from the log')
+    args = parser.parse_args()
+    trade_event_log = get_trade_event_log()
+    start = time.perf_counter()
+    if args.command == 'compact':
+        trade_event_log.compact()
+    else:
+        trade_event_log.restore()
+    print(f'{args.command} done in {time.perf_counter() - start:.2f}s')
@@ -0,0 +1,179 @@
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from src import config
+from src.persistence.async_db import ServerBusyError
+from src.service.broking import BrokingService
+
+
+# sentinel asking the writer thread to stop
+_STOP = object()
+
+
+class TradeWriter:
+    def __init__(self, service=None, max_batch_size=256):
+        """
+        Single writer for trades. Request handlers submit trade commands to a queue and a dedicated thread drains it
+        in batches, applying each batch in one transaction with one commit. Every command runs in its own savepoint so
+        a failing command does not undo the others, and its caller gets its own result or error once the batch is
+        committed.
+        Parameters
+        ----------
+        service: BrokingService
+            service running the commands, defaults to one on the shared database
+        max_batch_size: int
+            maximum num of commands committed together
+        """
+        self.service = service if service is not None else BrokingService()
+        self.max_batch_size = max_batch_size
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.commands = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ebroker-trade-writer', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the writer thread once the commands already submitted are applied
+        """
+        with self._lock:
+            if self._thread is not None:
+                self.queue.put(_STOP)
+                self._thread.join()
+                self._thread = None
+
+    def submit(self, operation, *args):
+        """
+        Queues a trade command
+        Parameters
+        ----------
+        operation: str
+            name of the BrokingService method to run, e.g. buy_an_equity
+        args: tuple
+            arguments of the method
+
+        Returns
+        -------
+        concurrent.futures.Future
+            resolved with the result of the method or its error
+        """
+        future = Future()
+        self.queue.put((future, operation, args))
+        return future
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = any(command is _STOP for command in batch)
+            commands = [command for command in batch if command is not _STOP
+                        and command[0].set_running_or_notify_cancel()]
+            if commands:
+                self._apply(commands)
+            if stop:
+                return
+
+    def _apply(self, commands):
+        outcomes = []
+        try:
+            with self.service.transaction():
+                for future, operation, args in commands:
+                    try:
+                        # the unit of work of the method becomes a savepoint of the batch
+                        outcomes.append((future, getattr(self.service, operation)(*args), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+        except Exception as e:
+            for future, _, _ in commands:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.commands += len(commands)
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_trade_writer = None
+_trade_writer_lock = threading.Lock()
+
+
+def get_trade_writer():
+    """
+    Returns the started trade writer of this process
+    Returns
+    -------
+    TradeWriter
+    """
+    global _trade_writer
+    if _trade_writer is None:
+        with _trade_writer_lock:
+            if _trade_writer is None:
+                _trade_writer = TradeWriter(max_batch_size=config.WRITE_QUEUE_BATCH_SIZE).start()
+    return _trade_writer
+
+
+def give_up(future):
+    """
+    Gives up a trade command which was not answered within the write queue timeout. A command still queued is
+    cancelled and skipped by the writer, a command the writer already runs is committed all the same, so its caller
+    must not be told to simply send it again.
+    Parameters
+    ----------
+    future: concurrent.futures.Future
+        future returned by TradeWriter.submit
+
+    Returns
+    -------
+    ServerBusyError
+        error for the caller of the trade
+    """
+    if future.cancel():
+        return ServerBusyError('Timed out while waiting for the trade writer, the trade was not run, try again later')
+    return ServerBusyError('Timed out while the trade writer ran the trade, its outcome is unknown. Check it before '
+                           'sending it again, or send it again with the same idempotencyKey')
+
+
+def run_trade(operation, *args, idempotency_key=None):
+    """
+    Runs a trade command through the trade writer when the write queue is enabled, otherwise right away on the
+    calling thread
+    Parameters
+    ----------
+    operation: str
+        name of the BrokingService method to run, e.g. buy_an_equity
+    args: tuple
+        arguments of the method
+    idempotency_key: str
+        key of the request, a trade already run with the key of its user is answered with its stored response
+    """
+    if idempotency_key is not None:
+        # a retry does not wait for the trade writer
+        response = BrokingService().stored_response(idempotency_key, operation, *args)
+        if response is not None:
+            return response
+        operation, args = 'run_idempotent', (idempotency_key, operation, *args)
+    if config.WRITE_QUEUE:
+        future = get_trade_writer().submit(operation, *args)
+        try:
+            return future.result(config.WRITE_QUEUE_TIMEOUT)
+        except FutureTimeoutError:
+            raise give_up(future)
+    return getattr(BrokingService(), operation)(*args)
@@ -0,0 +1,228 @@
+import datetime
+import json
+import threading
+from src import config
+
+
+TIME_STAMP_FORMAT = '%d/%m/%Y %H:%M:%S'
+
+# reasons for which a market is closed for a whole day
+OPEN = 0
+CLOSED_ON_WEEKEND = 1
+CLOSED_ON_HOLIDAY = 2
+
+# num of parsed dates a calendar remembers
+MAX_CACHED_DAYS = 10000
+
+
+def parse_clock(clock):
+    """
+    Converts HH:MM or HH:MM:SS into seconds since midnight
+    """
+    parts = [int(part) for part in clock.split(':')]
+    while len(parts) < 3:
+        parts.append(0)
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def format_clock(seconds):
+    """
+    Converts seconds since midnight into 9am, 5pm or 1:30pm like text
+    """
+    hour, minute = seconds // 3600, seconds % 3600 // 60
+    suffix = 'am' if hour < 12 else 'pm'
+    hour = hour % 12 or 12
+    return f'{hour}:{minute:02d}{suffix}' if minute else f'{hour}{suffix}'
+
+
+def parse_date(date):
+    """
+    Converts YYYY-MM-DD into an ordinal
+    """
+    return datetime.date.fromisoformat(date).toordinal()
+
+
+class TradingCalendar:
+    def __init__(self, name, sessions, holidays=(), half_days=None):
+        """
+        Trading sessions of an exchange. Sessions of every weekday, holidays and half days are precomputed into
+        seconds since midnight and date ordinals, and every date seen in a time stamp is resolved once, so checking a
+        time stamp is a dict lookup and a few integer comparisons.
+        Parameters
+        ----------
+        name: str
+            name of the exchange
+        sessions: dict
+            weekday (Monday is 0 and Sunday is 6) to (open, close) in HH:MM, weekdays without session are closed
+        holidays: list of str
+            YYYY-MM-DD dates on which the exchange is closed
+        half_days: dict
+            YYYY-MM-DD date to (open, close) in HH:MM for days with shorter session
+        """
+        self.name = name
+        self.weekly_sessions = [None] * 7
+        for weekday, (open_on, close_on) in sessions.items():
+            self.weekly_sessions[int(weekday)] = (parse_clock(open_on), parse_clock(close_on))
+        # session used in messages for days on which the exchange is closed
+        self.regular_session = next(session for session in self.weekly_sessions if session is not None)
+        self.holidays = {parse_date(date) for date in holidays}
+        self.half_days = {parse_date(date): (parse_clock(open_on), parse_clock(close_on))
+                          for date, (open_on, close_on) in (half_days or {}).items()}
+        self._days = {}
+        self._lock = threading.Lock()
+
+    def _resolve_day(self, date_part):
+        """
+        Returns (session, reason) of a dd/mm/YYYY date
+        """
+        day = self._days.get(date_part)
+        if day is not None:
+            return day
+        day_of_month, month, year = date_part[0:2], date_part[3:5], date_part[6:10]
+        # int() alone would take signs and spaces, e.g. '-1' or ' 1'
+        if len(date_part) != 10 or date_part[2] != '/' or date_part[5] != '/' or not day_of_month.isdigit() \
+                or not month.isdigit() or not year.isdigit():
+            raise ValueError()
+        ordinal = datetime.date(int(year), int(month), int(day_of_month)).toordinal()
+        # 0001-01-01 is a Monday
+        session = self.weekly_sessions[(ordinal - 1) % 7]
+        if session is None:
+            day = (self.regular_session, CLOSED_ON_WEEKEND)
+        elif ordinal in self.holidays:
+            day = (session, CLOSED_ON_HOLIDAY)
+        else:
+            day = (self.half_days.get(ordinal, session), OPEN)
+        with self._lock:
+            if len(self._days) >= MAX_CACHED_DAYS:
+                self._days.clear()
+            self._days[date_part] = day
+        return day
+
+    def _resolve(self, time_stamp):
+        """
+        Returns (session, reason, seconds since midnight) of a time stamp in dd/mm/YYYY HH:MM:SS format
+        """
+        try:
+            if len(time_stamp) != 19 or time_stamp[2] != '/' or time_stamp[5] != '/' or time_stamp[10] != ' ' \
+                    or time_stamp[13] != ':' or time_stamp[16] != ':':
+                raise ValueError()
+            hour, minute, second = time_stamp[11:13], time_stamp[14:16], time_stamp[17:19]
+            if not hour.isdigit() or not minute.isdigit() or not second.isdigit():
+                raise ValueError()
+            hour, minute, second = int(hour), int(minute), int(second)
+            if hour > 23 or minute > 59 or second > 59:
+                raise ValueError()
+            session, reason = self._resolve_day(time_stamp[:10])
+        except (TypeError, ValueError):
+            raise ValueError(f"time data '{time_stamp}' does not match format '{TIME_STAMP_FORMAT}'")
+        return session, reason, hour * 3600 + minute * 60 + second
+
+    def _error(self, time_stamp):
+        """
+        Returns the error check raises for a time stamp at which the exchange is closed, None if it is open
+        """
+        session, reason, seconds = self._resolve(time_stamp)
+        open_on, close_on = session
+        if seconds < open_on or seconds > close_on:
+            return Exception(f'You can only buy an equity between {format_clock(open_on)} and '
+                             f'{format_clock(close_on)}')
+        if reason == CLOSED_ON_WEEKEND:
+            return Exception('You can only buy an equity between Monday and Friday')
+        if reason == CLOSED_ON_HOLIDAY:
+            return Exception('You cannot buy an equity on an exchange holiday')
+        return None
+
+    def check(self, time_stamp):
+        """
+        Checks whether the exchange is open at a time stamp
+        Parameters
+        ----------
+        time_stamp: str
+            time stamp in dd/mm/YYYY HH:MM:SS format
+
+        Returns
+        -------
+        bool
+        """
+        error = self._error(time_stamp)
+        if error is not None:
+            raise error
+        return True
+
+    def is_open(self, time_stamp):
+        """
+        Returns whether the exchange is open at a time stamp, a malformed time stamp counts as closed
+        """
+        try:
+            return self._error(time_stamp) is None
+        except ValueError:
+            return False
+
+    def check_all(self, time_stamps):
+        """
+        Checks a batch of time stamps at once, every day of the batch is resolved once
+        Parameters
+        ----------
+        time_stamps: list of str
+            time stamps in dd/mm/YYYY HH:MM:SS format
+
+        Returns
+        -------
+        list of Exception or None
+            error check raises for every time stamp, None for the ones at which the exchange is open
+        """
+        errors = []
+        for time_stamp in time_stamps:
+            try:
+                errors.append(self._error(time_stamp))
+            except ValueError as e:
+                errors.append(e)
+        return errors
+
+EXCHANGES = {
+    'DEFAULT': {
+        'sessions': {weekday: ('09:00', '17:00') for weekday in range(5)},
+        'holidays': [],
+        'half_days': {},
+    },
+}
+
+_calendars = {}
+_calendars_lock = threading.Lock()
+
+
+def load_exchanges(calendar_file):
+    """
+    Adds exchanges from a JSON file with the same layout as EXCHANGES
+    Parameters
+    ----------
+    calendar_file: str
+        path of the JSON file
+    """
+    with open(calendar_file) as f:
+        exchanges = json.load(f)
+    with _calendars_lock:
+        for name, exchange in exchanges.items():
+            EXCHANGES[name] = exchange
+            _calendars.pop(name, None)
+
+
+def get_calendar(exchange='DEFAULT'):
+    """
+    Returns the calendar of an exchange, it is built once per process
+    Returns
+    -------
+    TradingCalendar
+    """
+    calendar = _calendars.get(exchange)
+    if calendar is None:
+        if exchange not in EXCHANGES:
+            raise Exception(f'Unknown exchange {exchange}')
+        with _calendars_lock:
+            calendar = TradingCalendar(exchange, **EXCHANGES[exchange])
+            _calendars[exchange] = calendar
+    return calendar
+
+
+if config.CALENDAR_FILE:
+    load_exchanges(config.CALENDAR_FILE)
@@ -0,0 +1,79 @@
+import threading
+import time
+from contextlib import contextmanager
+from src import config
+from src.metrics import REGISTRY
+
+
+USER_LOCK_WAIT = REGISTRY.histogram('ebroker_user_lock_wait_seconds',
+                                    'Time trades waited for the striped locks of their users')
+
+
+class StripedLocks:
+    def __init__(self, num_of_stripes=config.USER_LOCK_STRIPES):
+        """
+        Fixed array of locks the users are spread over by id. Trades of one user take the same lock and run one after
+        the other, trades of users on other stripes don't wait for each other. Memory stays the same however many
+        users there are, at the cost of users sharing a stripe waiting for each other now and then.
+        Parameters
+        ----------
+        num_of_stripes: int
+            num of locks
+        """
+        if num_of_stripes < 1:
+            raise Exception('Provide at least one lock stripe')
+        self.locks = [threading.RLock() for _ in range(num_of_stripes)]
+
+    def stripe_for(self, user_id):
+        """
+        Returns the index of the lock of a user
+        """
+        # '1' and 1 are the same user, they must share a lock
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            raise Exception(f'Invalid user id {user_id}')
+        return hash(user_id) % len(self.locks)
+
+    @contextmanager
+    def hold(self, user_ids):
+        """
+        Holds the locks of users. They are taken in stripe order, so two callers holding several stripes can't wait
+        for each other.
+        Parameters
+        ----------
+        user_ids: iterable of int
+            ids of the users
+        """
+        stripes = sorted({self.stripe_for(user_id) for user_id in user_ids})
+        started = time.perf_counter()
+        acquired = []
+        try:
+            for stripe in stripes:
+                self.locks[stripe].acquire()
+                acquired.append(stripe)
+            if config.METRICS:
+                USER_LOCK_WAIT.observe(time.perf_counter() - started)
+            yield
+        finally:
+            for stripe in reversed(acquired):
+                self.locks[stripe].release()
+
+
+_user_locks = None
+_user_locks_lock = threading.Lock()
+
+
+def get_user_locks():
+    """
+    Returns the striped user locks of this process, None when they are turned off
+    Returns
+    -------
+    StripedLocks
+    """
+    global _user_locks
+    if _user_locks is None and config.USER_LOCK_STRIPES > 0:
+        with _user_locks_lock:
+            if _user_locks is None:
+                _user_locks = StripedLocks(config.USER_LOCK_STRIPES)
+    return _user_locks
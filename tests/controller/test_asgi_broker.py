@@ -0,0 +1,148 @@
+import asyncio
+import json
+import time
+from concurrent.futures import Future
+from unittest import TestCase
+from unittest.mock import patch
+from src.controller.asgi_broker import BrokerASGIApp
+from src.persistence.async_db import BoundedExecutor, ServerBusyError
+from src.service.async_broking import AsyncBrokingService
+from src.service.broking import BrokingService
+
+
+class EBrokerASGITest(TestCase):
+    def setUp(self):
+        self.write_executor = BoundedExecutor(max_workers=1, max_pending=2)
+        self.read_executor = BoundedExecutor(max_workers=1, max_pending=2)
+        self.app = BrokerASGIApp(AsyncBrokingService(self.write_executor, self.read_executor))
+
+    def tearDown(self):
+        self.write_executor.shutdown()
+        self.read_executor.shutdown()
+
+    def request(self, method, path, body=None, query_string=''):
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string.encode()}
+        messages = [{'type': 'http.request', 'body': json.dumps(body).encode() if body is not None else b''}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+        asyncio.run(self.app(scope, receive, send))
+        return sent[0]['status'], json.loads(sent[1]['body'])
+
+    def test_get_balance_with_missing_params(self):
+        status, body = self.request('GET', '/broker/api/getBalance', query_string='user=1')
+        self.assertEqual(status, 400)
+        self.assertEqual(body['error'], "'userId' not found in request")
+
+    @patch.object(BrokingService, 'buy_an_equity')
+    def test_buy_equity_with_success(self, mock_buy_an_equity):
+        mock_buy_an_equity.return_value = 'Equity bought successfully'
+        status, body = self.request('POST', '/broker/api/buy', {'userId': 1, 'equityId': 1, 'numOfShares': 10,
+                                                                'timeStamp': '10/12/2021 16:00:01'})
+        self.assertEqual(status, 200)
+        self.assertEqual(body['message'], 'Equity bought successfully')
+        mock_buy_an_equity.assert_called_once_with(1, 1, 10, '10/12/2021 16:00:01')
+
+    @patch.object(BrokingService, 'sell_an_equity')
+    @patch.object(BrokingService, 'stored_response')
+    def test_sell_equity_retry_returns_stored_response(self, mock_stored_response, mock_sell_an_equity):
+        mock_stored_response.return_value = 'Equity sold successfully'
+        status, body = self.request('POST', '/broker/api/sell', {'userId': 1, 'equityId': 1, 'numOfShares': 10,
+                                                                 'timeStamp': '10/12/2021 16:00:01',
+                                                                 'idempotencyKey': 'k1'})
+        self.assertEqual(status, 200)
+        self.assertEqual(body['message'], 'Equity sold successfully')
+        mock_stored_response.assert_called_once_with('k1', 'sell_an_equity', 1, 1, 10, '10/12/2021 16:00:01')
+        mock_sell_an_equity.assert_not_called()
+
+    def test_buy_equity_with_missing_params(self):
+        status, body = self.request('POST', '/broker/api/buy', {'userId': 1, 'equityId': 1, 'numOfShares': 10})
+        self.assertEqual(status, 400)
+        self.assertEqual(body['error'], "'timeStamp' not found in request")
+
+    @patch.object(BrokingService, 'add_fund')
+    def test_add_balance_with_error(self, mock_add_fund):
+        mock_add_fund.side_effect = [Exception('No such user exists')]
+        status, body = self.request('POST', '/broker/api/addAmount', {'userId': 1, 'amount': 10})
+        self.assertEqual(status, 500)
+        self.assertEqual(body['error'], 'No such user exists')
+
+    @patch.object(BrokingService, 'sell_an_equity')
+    def test_busy_server(self, mock_sell_an_equity):
+        mock_sell_an_equity.side_effect = [ServerBusyError('Server is busy, try again later')]
+        status, body = self.request('POST', '/broker/api/sell', {'userId': 1, 'equityId': 1, 'numOfShares': 10,
+                                                                 'timeStamp': '10/12/2021 16:00:01'})
+        self.assertEqual(status, 503)
+        self.assertEqual(body['error'], 'Server is busy, try again later')
+
+    def test_unknown_route(self):
+        status, _ = self.request('GET', '/broker/api/unknown')
+        self.assertEqual(status, 404)
+        status, _ = self.request('GET', '/broker/api/buy')
+        self.assertEqual(status, 405)
+
+    @patch.object(AsyncBrokingService, 'export_page')
+    def test_export_streams_every_page(self, mock_export_page):
+        mock_export_page.side_effect = [([{'equityId': 1}, {'equityId': 2}], 2), ([{'equityId': 3}], None)]
+        scope = {'type': 'http', 'method': 'GET', 'path': '/broker/api/export/equities', 'query_string': b''}
+        messages = [{'type': 'http.request', 'body': b''}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+        asyncio.run(self.app(scope, receive, send))
+        self.assertEqual(sent[0]['status'], 200)
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        self.assertEqual([json.loads(line)['equityId'] for line in body.splitlines()], [1, 2, 3])
+        self.assertFalse(sent[-1].get('more_body', False))
+        self.assertEqual([call.args for call in mock_export_page.call_args_list], [('equities', 0), ('equities', 2)])
+
+
+class WriteQueueTest(TestCase):
+    def setUp(self):
+        self.write_executor = BoundedExecutor(max_workers=1, max_pending=1, queue_timeout=0.05)
+        self.read_executor = BoundedExecutor(max_workers=1, max_pending=1)
+        self.service = AsyncBrokingService(self.write_executor, self.read_executor)
+
+    def tearDown(self):
+        self.write_executor.shutdown()
+        self.read_executor.shutdown()
+
+    @patch('src.config.WRITE_QUEUE_TIMEOUT', 0.1)
+    @patch('src.config.WRITE_QUEUE', True)
+    @patch('src.service.async_broking.get_trade_writer')
+    def test_queued_trades_are_bounded_and_time_out(self, mock_get_trade_writer):
+        # the trade writer never answers
+        mock_get_trade_writer.return_value.submit.side_effect = lambda *args: Future()
+
+        async def run():
+            waiting = asyncio.ensure_future(self.service.add_fund(1, 10))
+            await asyncio.sleep(0.01)
+            with self.assertRaisesRegex(ServerBusyError, 'Server is busy'):
+                await self.service.add_fund(1, 10)
+            with self.assertRaisesRegex(ServerBusyError, 'Timed out while waiting for the trade writer, the trade was '
+                                                         'not run'):
+                await waiting
+        asyncio.run(run())
+
+
+class BoundedExecutorTest(TestCase):
+    def test_caller_is_rejected_when_executor_is_full(self):
+        executor = BoundedExecutor(max_workers=1, max_pending=1, queue_timeout=0.05)
+
+        async def run():
+            slow = asyncio.ensure_future(executor.run(time.sleep, 0.3))
+            await asyncio.sleep(0.01)
+            with self.assertRaisesRegex(ServerBusyError, 'Server is busy'):
+                await executor.run(sum, [1, 2])
+            await slow
+            return await executor.run(sum, [1, 2])
+        self.assertEqual(asyncio.run(run()), 3)
+        executor.shutdown()
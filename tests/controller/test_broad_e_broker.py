@@ -1,3 +1,4 @@
+import json
 from unittest import TestCase
 from app import app
 
@@ -143,3 +144,52 @@ class EBrokerBroadIntegrationTest(TestCase):
         latest_balance = self.app.get(f'/broker/api/getBalance?userId={user_id}').get_json()['balance']
         self.assertEqual(latest_balance, balance_after_adding_the_amount)
 
+    def test_batch_of_orders(self):
+        user_id = 1
+        equity_id = 1
+        time_stamp = '10/12/2021 16:00:01'
+        current_balance = self.app.get(f'/broker/api/getBalance?userId={user_id}').get_json()['balance']
+        orders = [
+            {'type': 'addAmount', 'userId': user_id, 'amount': 50},
+            {'type': 'buy', 'userId': user_id, 'equityId': equity_id, 'numOfShares': 10, 'timeStamp': time_stamp},
+            {'type': 'sell', 'userId': user_id, 'equityId': equity_id, 'numOfShares': 4, 'timeStamp': time_stamp},
+            {'type': 'buy', 'userId': user_id, 'equityId': equity_id, 'numOfShares': 10000000,
+             'timeStamp': time_stamp},
+            {'type': 'sell', 'userId': user_id, 'equityId': equity_id, 'numOfShares': 6, 'timeStamp': time_stamp},
+        ]
+        response = self.app.post('/broker/api/orders/batch', json={'orders': orders})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['results'], [
+            {'message': 'User balance updated successfully'},
+            {'message': 'Equity bought successfully'},
+            {'message': 'Equity sold successfully'},
+            {'error': 'Insufficient balance to buy'},
+            {'message': 'Equity sold successfully'},
+        ])
+        new_balance = self.app.get(f'/broker/api/getBalance?userId={user_id}').get_json()['balance']
+        self.assertEqual(new_balance, current_balance + 50)
+
+    def test_portfolio(self):
+        user_id = 2
+        balance = self.app.get(f'/broker/api/getBalance?userId={user_id}').get_json()['balance']
+        response = self.app.get(f'/broker/api/portfolio?userId={user_id}')
+        self.assertEqual(response.status_code, 200)
+        portfolio = response.get_json()
+        self.assertEqual(portfolio['balance'], balance)
+        self.assertEqual([holding['equityId'] for holding in portfolio['holdings']], [1, 2, 3])
+        self.assertEqual(portfolio['netWorth'], balance + sum(h['marketValue'] for h in portfolio['holdings']))
+
+        response = self.app.get('/broker/api/portfolio?userId=1111111')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.get_json()['error'], 'No such user exists')
+
+    def test_export_equities(self):
+        response = self.app.get('/broker/api/export/equities')
+        self.assertEqual(response.status_code, 200)
+        equities = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(equities[0], {'equityId': 1, 'name': 'ITC', 'price': equities[0]['price']})
+        self.assertEqual([equity['equityId'] for equity in equities], sorted(equity['equityId'] for equity in equities))
+        response = self.app.get(f'/broker/api/export/equities?afterId={equities[0]["equityId"]}')
+        self.assertEqual(response.get_data(as_text=True).splitlines(),
+                         [json.dumps(equity) for equity in equities[1:]])
+
@@ -1,7 +1,9 @@
+import json
 from unittest import TestCase
 from unittest.mock import patch
 from app import app
 from src.service.broking import BrokingService
+from src.service.price_feed import PriceFeed
 
 
 class EBrokerNarrowIntegrationTest(TestCase):
@@ -146,6 +148,27 @@ class EBrokerNarrowIntegrationTest(TestCase):
         new_balance = self.app.get(f'/broker/api/getBalance?userId={user_id}').get_json()['balance']
         self.assertEqual(new_balance, current_balance - shares_to_buy * share_price)
 
+    @patch.object(BrokingService, 'run_idempotent')
+    @patch.object(BrokingService, 'stored_response')
+    def test_buy_equity_with_idempotency_key(self, mock_stored_response, mock_run_idempotent):
+        mock_stored_response.return_value = None
+        mock_run_idempotent.return_value = 'Equity bought successfully'
+        response = self.app.post('/broker/api/buy', json={'userId': 1, 'equityId': 2, 'numOfShares': 10,
+                                                          'timeStamp': '10/12/2021 16:00:01', 'idempotencyKey': 'k1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['message'], 'Equity bought successfully')
+        mock_run_idempotent.assert_called_once_with('k1', 'buy_an_equity', 1, 2, 10, '10/12/2021 16:00:01')
+
+    @patch.object(BrokingService, 'add_fund')
+    @patch.object(BrokingService, 'stored_response')
+    def test_add_balance_retry_returns_stored_response(self, mock_stored_response, mock_add_fund):
+        mock_stored_response.return_value = 'User balance updated successfully'
+        response = self.app.post('/broker/api/addAmount', json={'userId': 1, 'amount': 100, 'idempotencyKey': 'k1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['message'], 'User balance updated successfully')
+        mock_stored_response.assert_called_once_with('k1', 'add_fund', 1, 100)
+        mock_add_fund.assert_not_called()
+
     def test_sell_equity_with_missing_params(self):
         user_id = 1
         equity_id = 4
@@ -218,3 +241,74 @@ class EBrokerNarrowIntegrationTest(TestCase):
         self.assertEqual(response.get_json()['message'], 'Equity sold successfully')
         new_balance = self.app.get(f'/broker/api/getBalance?userId={user_id}').get_json()['balance']
         self.assertEqual(new_balance, current_balance + shares_to_sell * share_price)
+
+    def test_batch_orders_with_missing_params(self):
+        response = self.app.post('/broker/api/orders/batch', json={'order': []})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], "'orders' not found in request")
+
+    @patch.object(BrokingService, 'execute_orders')
+    def test_batch_orders_with_success(self, mock_execute_orders):
+        expected_results = [{'message': 'User balance updated successfully'}, {'error': 'No such user exists'}]
+        mock_execute_orders.return_value = expected_results
+        orders = [{'type': 'addAmount', 'userId': 1, 'amount': 10}, {'type': 'addAmount', 'userId': 2, 'amount': 10}]
+        response = self.app.post('/broker/api/orders/batch', json={'orders': orders})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['results'], expected_results)
+        mock_execute_orders.assert_called_once_with(orders)
+
+    def test_get_portfolio_with_missing_params(self):
+        response = self.app.get('/broker/api/portfolio?user=1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], "'userId' not found in request")
+
+    @patch.object(BrokingService, 'get_portfolio')
+    def test_get_portfolio_with_success(self, mock_get_portfolio):
+        mock_get_portfolio.return_value = {'balance': 100, 'holdings': [], 'holdingsValue': 0, 'netWorth': 100}
+        response = self.app.get('/broker/api/portfolio?userId=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['netWorth'], 100)
+        self.assertEqual(response.get_json()['userId'], '1')
+
+    @patch.object(BrokingService, 'get_balance')
+    def test_metrics_with_route_latency(self, mock_get_balance):
+        mock_get_balance.return_value = 1234
+        self.app.get('/broker/api/getBalance?userId=1')
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn('ebroker_http_request_duration_seconds_count{method="GET",route="/broker/api/getBalance",'
+                      'status="200"}', response.get_data(as_text=True))
+
+    @patch.object(BrokingService, 'export')
+    def test_export_users_as_ndjson(self, mock_export):
+        mock_export.return_value = iter([{'userId': 1, 'name': 'tester', 'balance': 10},
+                                         {'userId': 2, 'name': 'other', 'balance': 20}])
+        response = self.app.get('/broker/api/export/users?afterId=0')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['userId'] for line in response.get_data(as_text=True).splitlines()], [1, 2])
+        mock_export.assert_called_once_with('users', 0)
+
+    def test_export_with_invalid_after_id(self):
+        response = self.app.get('/broker/api/export/positions?afterId=last')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], "'afterId' should be an integer")
+
+    @patch.object(PriceFeed, 'apply')
+    def test_update_prices(self, mock_apply):
+        mock_apply.return_value = {'ticks': 2, 'updated': 1, 'seconds': 0.01, 'ticksPerSecond': 200}
+        response = self.app.post('/broker/api/prices', json={'prices': [{'equityId': 1, 'price': 5},
+                                                                        {'equityId': 1, 'price': 6}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['updated'], 1)
+        mock_apply.assert_called_once_with([(1, 5), (1, 6)])
+
+    def test_update_prices_with_invalid_ticks(self):
+        response = self.app.post('/broker/api/prices', json={'prices': [{'equityId': 1}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], "'price' not found in request")
+        response = self.app.post('/broker/api/prices', json={'prices': [{'equityId': 1, 'price': -5}]})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.get_json()['error'], 'Provide a non negative price for equity 1')
+
@@ -1,4 +1,11 @@
+import os
+import sqlite3
+import tempfile
+import threading
 from unittest import TestCase
+from setup_db import fill_generated_data
+from src.persistence import schema
+from src.persistence.db import BrokingDB
 from src.persistence.in_memory import InMemoryDB
 from src.persistence.user import UserRepository
 from src.persistence.equity import EquityRepository
@@ -8,6 +15,25 @@ from src.persistence.user_equity_map import UserEquityMapRepository
 # IN_MEMORY_DB = ':memory:'
 
 
+def create_baseline_database(database_file, positions):
+    """
+    Creates a database with the tables of the first release, without versions, indexes nor idempotency keys
+    """
+    conn = sqlite3.connect(database_file)
+    conn.execute('CREATE TABLE users (id integer PRIMARY KEY, name text NOT NULL, balance real NOT NULL, '
+                 'last_modified_on text NOT NULL)')
+    conn.execute('CREATE TABLE equities (id integer PRIMARY KEY, name text NOT NULL, price real NOT NULL, '
+                 'last_modified_on text NOT NULL)')
+    conn.execute('CREATE TABLE user_equity_map (id integer PRIMARY KEY, user_id integer, equity_id integer, '
+                 'total_shares integer NOT NULL, last_modified_on text NOT NULL)')
+    conn.execute("INSERT INTO users VALUES (1, 'tester', 1000, datetime('now'))")
+    conn.execute("INSERT INTO equities VALUES (1, 'ITC', 5, datetime('now'))")
+    conn.executemany("INSERT INTO user_equity_map (user_id, equity_id, total_shares, last_modified_on) "
+                     "VALUES (?, ?, ?, datetime('now'))", positions)
+    conn.commit()
+    conn.close()
+
+
 class TestNarrowIntegrationForUser(TestCase):
     def setUp(self):
         in_memory_db = InMemoryDB()
@@ -115,3 +141,292 @@ class TestNarrowIntegrationForUser(TestCase):
         self.assertTrue(self.map_repository.delete_user_equity_map(user_equity_id))
         user_equity_id = self.map_repository.get_user_equity_mapping_id(user_id, equity_id)
         self.assertIsNone(user_equity_id)
+
+    def test_upsert_position(self):
+        self.user_repository.add_user({'name': 'tester', 'balance': 1234})
+        self.equity_repository.add_equity({'name': 'myEquity', 'price': 100})
+        user_id = self.user_repository.get_all_users()[0][0]
+        equity_id = self.equity_repository.get_all_equities()[0][0]
+        # first buy creates the position
+        self.assertTrue(self.map_repository.upsert_position(user_id, equity_id, 10))
+        self.assertEqual(self.map_repository.get_position(user_id, equity_id)[3], 10)
+        # next buy adds to the same row
+        self.map_repository.upsert_position(user_id, equity_id, 5)
+        position = self.map_repository.get_position(user_id, equity_id)
+        self.assertEqual(position[3], 15)
+        self.assertEqual(self.map_repository.get_user_equity_mapping_id(user_id, equity_id), position[0])
+        # selling some of the shares keeps the row
+        self.map_repository.upsert_position(user_id, equity_id, -5)
+        self.assertEqual(self.map_repository.get_position(user_id, equity_id)[3], 10)
+        # selling all the shares removes the row
+        self.map_repository.upsert_position(user_id, equity_id, -10)
+        self.assertIsNone(self.map_repository.get_position(user_id, equity_id))
+
+    def test_duplicate_position_is_rejected(self):
+        user_equity_map = {'user_id': 1, 'equity_id': 1, 'total_shares': 10}
+        self.map_repository.add_user_equity(user_equity_map)
+        with self.assertRaisesRegex(Exception, 'Some error occurred while executing the query'):
+            self.map_repository.add_user_equity(user_equity_map)
+
+    def test_guarded_balance_updates(self):
+        self.user_repository.add_user({'name': 'tester', 'balance': 100})
+        user_id = self.user_repository.get_all_users()[0][0]
+        self.assertTrue(self.user_repository.debit_balance(user_id, 60))
+        self.assertEqual(self.user_repository.get_user(user_id)[2], 40)
+        # balance does not cover the amount
+        self.assertFalse(self.user_repository.debit_balance(user_id, 60))
+        self.assertEqual(self.user_repository.get_user(user_id)[2], 40)
+        self.assertTrue(self.user_repository.credit_balance(user_id, 60))
+        self.assertEqual(self.user_repository.get_user(user_id)[2], 100)
+        # unknown user
+        self.assertFalse(self.user_repository.debit_balance(user_id + 1, 1))
+        self.assertFalse(self.user_repository.credit_balance(user_id + 1, 1))
+
+    def test_guarded_share_updates(self):
+        self.map_repository.upsert_position(1, 1, 10)
+        self.assertFalse(self.map_repository.remove_shares(1, 1, 11))
+        self.assertTrue(self.map_repository.remove_shares(1, 1, 4))
+        self.assertEqual(self.map_repository.get_position(1, 1)[3], 6)
+        self.assertTrue(self.map_repository.remove_shares(1, 1, 6))
+        self.assertIsNone(self.map_repository.get_position(1, 1))
+        self.assertFalse(self.map_repository.remove_shares(1, 1, 1))
+
+    def test_equity_is_served_from_cache_till_it_is_updated(self):
+        self.equity_repository.add_equity({'name': 'myEquity', 'price': 100})
+        equity_id = self.equity_repository.get_all_equities()[0][0]
+        cache = self.equity_repository.cache
+        self.assertEqual(self.equity_repository.get_equity(equity_id)[2], 100)
+        self.assertEqual(self.equity_repository.get_equity(equity_id)[2], 100)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        self.equity_repository.update_equity({'id': equity_id, 'name': 'myEquity', 'price': 150})
+        self.assertEqual(self.equity_repository.get_equities([equity_id])[0][2], 150)
+        self.assertEqual(cache.misses, 2)
+        self.equity_repository.delete_equity(equity_id)
+        self.assertIsNone(self.equity_repository.get_equity(equity_id))
+
+    def test_equity_cache_is_invalidated_once_the_change_is_committed(self):
+        self.equity_repository.add_equity({'name': 'myEquity', 'price': 100})
+        equity_id = self.equity_repository.get_all_equities()[0][0]
+        self.equity_repository.get_equity(equity_id)
+        with self.equity_repository.db.transaction():
+            self.equity_repository.update_equity({'id': equity_id, 'name': 'myEquity', 'price': 150})
+            self.assertEqual(self.equity_repository.cache.get(equity_id)[2], 100)
+        self.assertIsNone(self.equity_repository.cache.get(equity_id))
+        with self.assertRaises(Exception):
+            with self.equity_repository.db.transaction():
+                self.equity_repository.delete_equity(equity_id)
+                raise Exception('rolled back')
+        self.assertEqual(self.equity_repository.get_equity(equity_id)[2], 150)
+
+    def test_equity_read_in_a_rolled_back_unit_of_work_is_not_cached(self):
+        self.equity_repository.add_equity({'name': 'myEquity', 'price': 100})
+        equity_id = self.equity_repository.get_all_equities()[0][0]
+        with self.assertRaises(Exception):
+            with self.equity_repository.db.transaction():
+                self.equity_repository.update_equity({'id': equity_id, 'name': 'myEquity', 'price': 999})
+                self.assertEqual(self.equity_repository.get_equity(equity_id)[2], 999)
+                self.assertEqual(self.equity_repository.get_equities([equity_id])[0][2], 999)
+                raise Exception('rolled back')
+        self.assertIsNone(self.equity_repository.cache.get(equity_id))
+        self.assertEqual(self.equity_repository.get_equity(equity_id)[2], 100)
+
+    def test_get_portfolio(self):
+        self.user_repository.add_user({'name': 'tester', 'balance': 100})
+        self.user_repository.add_user({'name': 'other', 'balance': 10})
+        self.equity_repository.add_equity({'name': 'ITC', 'price': 5})
+        self.equity_repository.add_equity({'name': 'TCS', 'price': 10})
+        self.map_repository.upsert_position(1, 2, 3)
+        self.map_repository.upsert_position(1, 1, 4)
+        self.map_repository.upsert_position(2, 1, 7)
+        self.assertEqual(self.map_repository.get_portfolio(1), [(1, 100, 1, 'ITC', 4, 5), (1, 100, 2, 'TCS', 3, 10)])
+        self.map_repository.upsert_position(2, 1, -7)
+        self.assertEqual(self.map_repository.get_portfolio(2), [(2, 10, None, None, None, None)])
+        self.assertEqual(self.map_repository.get_portfolio(3), [])
+
+    def test_pages_and_streams_in_id_order(self):
+        for i in range(5):
+            self.user_repository.add_user({'name': f'tester{i}', 'balance': i})
+            self.equity_repository.add_equity({'name': f'EQUITY{i}', 'price': i})
+            self.map_repository.upsert_position(i + 1, 1, i + 1)
+        self.user_repository.delete_user(2)
+        self.assertEqual([user.id for user in self.user_repository.get_users_page(limit=2)], [1, 3])
+        self.assertEqual([user.id for user in self.user_repository.get_users_page(3, limit=2)], [4, 5])
+        self.assertEqual(self.user_repository.get_users_page(5, limit=2), [])
+        self.assertEqual([equity.id for equity in self.equity_repository.get_equities_page(1, limit=3)], [2, 3, 4])
+        self.assertEqual([position.id for position in self.map_repository.get_positions_page(4)], [5])
+        self.assertEqual([user.id for user in self.user_repository.stream_users()], [1, 3, 4, 5])
+        self.assertEqual([equity.name for equity in self.equity_repository.stream_equities(3)], ['EQUITY3', 'EQUITY4'])
+        self.assertEqual([position.total_shares for position in self.map_repository.stream_positions(2)], [3, 4, 5])
+
+    def test_stream_fetches_in_batches(self):
+        for i in range(5):
+            self.user_repository.add_user({'name': f'tester{i}', 'balance': i})
+        stream = self.user_repository.db.stream_read('SELECT id FROM users ORDER BY id', batch_size=2)
+        self.assertEqual(next(stream), (1,))
+        self.assertEqual(list(stream), [(2,), (3,), (4,), (5,)])
+
+
+class TestNarrowIntegrationForUnitOfWork(TestCase):
+    def setUp(self):
+        self.db = InMemoryDB()
+        self.db.create_tables()
+        self.user_repository = UserRepository(self.db)
+        self.user_repository.add_user({'name': 'tester', 'balance': 100})
+        self.user_id = self.user_repository.get_all_users()[0][0]
+
+    def test_unit_of_work_is_committed_once_at_the_end(self):
+        with self.db.transaction():
+            self.user_repository.update_user({'id': self.user_id, 'name': 'tester', 'balance': 50})
+            self.assertTrue(self.db.conn.in_transaction)
+        self.assertFalse(self.db.conn.in_transaction)
+        self.assertEqual(self.user_repository.get_user(self.user_id)[2], 50)
+
+    def test_unit_of_work_is_rolled_back_on_error(self):
+        with self.assertRaisesRegex(Exception, 'Insufficient balance'):
+            with self.db.transaction():
+                self.user_repository.update_user({'id': self.user_id, 'name': 'tester', 'balance': 50})
+                raise Exception('Insufficient balance')
+        self.assertEqual(self.user_repository.get_user(self.user_id)[2], 100)
+
+    def test_nested_unit_of_work_rolls_back_only_its_own_changes(self):
+        with self.db.transaction():
+            self.user_repository.update_user({'id': self.user_id, 'name': 'tester', 'balance': 50})
+            with self.assertRaises(Exception):
+                with self.db.transaction():
+                    self.user_repository.update_user({'id': self.user_id, 'name': 'tester', 'balance': 10})
+                    raise Exception()
+        self.assertEqual(self.user_repository.get_user(self.user_id)[2], 50)
+
+
+class TestNarrowIntegrationForVersions(TestCase):
+    def setUp(self):
+        self.db = InMemoryDB()
+        self.db.create_tables()
+        self.user_repository = UserRepository(self.db)
+        self.map_repository = UserEquityMapRepository(self.db)
+        self.user_repository.add_user({'name': 'tester', 'balance': 100})
+        self.user_id = self.user_repository.get_all_users()[0][0]
+
+    def test_every_change_bumps_the_version(self):
+        self.assertEqual(self.user_repository.get_versioned_user(self.user_id).version, 0)
+        self.user_repository.credit_balance(self.user_id, 10)
+        self.user_repository.debit_balance(self.user_id, 10)
+        self.user_repository.update_user({'id': self.user_id, 'name': 'tester', 'balance': 50})
+        self.assertEqual(self.user_repository.get_versioned_user(self.user_id).version, 3)
+        self.map_repository.upsert_position(self.user_id, 1, 10)
+        self.map_repository.upsert_position(self.user_id, 1, 10)
+        self.map_repository.remove_shares(self.user_id, 1, 5)
+        position = self.map_repository.get_versioned_position(self.user_id, 1)
+        self.assertEqual((position.total_shares, position.version), (15, 2))
+
+    def test_update_on_a_stale_version_is_skipped(self):
+        user = self.user_repository.get_versioned_user(self.user_id)
+        self.assertTrue(self.user_repository.update_user({**user._asdict(), 'balance': 50}))
+        self.assertFalse(self.user_repository.update_user({**user._asdict(), 'balance': 10}))
+        self.assertEqual(self.user_repository.get_user(self.user_id).balance, 50)
+        self.assertTrue(self.map_repository.add_position(self.user_id, 1, 10))
+        self.assertFalse(self.map_repository.add_position(self.user_id, 1, 10))
+        position = self.map_repository.get_versioned_position(self.user_id, 1)
+        self.assertTrue(self.map_repository.update_equity({**position._asdict(), 'total_shares': 5}))
+        self.assertFalse(self.map_repository.update_equity({**position._asdict(), 'total_shares': 1}))
+        self.assertFalse(self.map_repository.delete_user_equity_map(position.id, position.version))
+        self.assertTrue(self.map_repository.delete_user_equity_map(position.id, position.version + 1))
+        self.assertIsNone(self.map_repository.get_position(self.user_id, 1))
+
+    def test_version_columns_are_added_to_an_older_database(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE TABLE users (id integer PRIMARY KEY, name text NOT NULL, balance real NOT NULL, '
+                     'last_modified_on text NOT NULL)')
+        conn.execute("INSERT INTO users VALUES (1, 'tester', 100, datetime('now'))")
+        schema.create_tables(conn)
+        self.assertEqual(conn.execute('SELECT version FROM users').fetchall(), [(0,)])
+        self.assertIn('version', [row[1] for row in conn.execute('PRAGMA table_info(user_equity_map)')])
+        conn.close()
+
+    def test_older_database_is_upgraded_on_first_connection(self):
+        database_file = os.path.join(tempfile.mkdtemp(), 'ebroker.db')
+        create_baseline_database(database_file, [(1, 1, 10)])
+        db = BrokingDB(database_file)
+        # the first read goes through the read lane, the writer upgrades the schema before it
+        self.assertEqual(UserRepository(db).get_versioned_user(1).version, 0)
+        self.assertTrue(UserEquityMapRepository(db).upsert_position(1, 1, 5))
+        self.assertEqual(db.execute_query('SELECT total_shares, version FROM user_equity_map'), [(15, 1)])
+        self.assertEqual(db.execute_query('SELECT COUNT(*) FROM idempotency_keys'), [(0,)])
+        db.close()
+
+    def test_duplicate_positions_are_merged_on_first_connection(self):
+        database_file = os.path.join(tempfile.mkdtemp(), 'ebroker.db')
+        create_baseline_database(database_file, [(1, 1, 10), (1, 1, 5)])
+        db = BrokingDB(database_file)
+        self.assertTrue(UserEquityMapRepository(db).upsert_position(1, 1, 1))
+        self.assertEqual(db.execute_query('SELECT user_id, equity_id, total_shares FROM user_equity_map'), [(1, 1, 16)])
+        indexes = db.execute_query("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")
+        self.assertIn(('user_equity_map_user_id_equity_id',), indexes)
+        db.close()
+
+
+class TestNarrowIntegrationForReadLane(TestCase):
+    def setUp(self):
+        self.db = BrokingDB(os.path.join(tempfile.mkdtemp(), 'ebroker.db'), pool_size=1, read_pool_size=2)
+        with self.db.transaction() as conn:
+            schema.create_tables(conn)
+        self.user_repository = UserRepository(self.db)
+        self.user_repository.add_user({'name': 'tester', 'balance': 100})
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_reads_use_read_only_connections(self):
+        self.assertEqual(self.user_repository.get_user(1).balance, 100)
+        self.assertEqual(self.db.read_pool.size, 1)
+        conn = self.db.read_pool.acquire()
+        try:
+            self.assertEqual(conn.execute('PRAGMA query_only').fetchone()[0], 1)
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("UPDATE users SET balance = 0")
+        finally:
+            self.db.read_pool.release(conn)
+
+    def test_reads_inside_a_unit_of_work_see_its_changes(self):
+        with self.db.transaction():
+            self.user_repository.credit_balance(1, 50)
+            self.assertEqual(self.user_repository.get_user(1).balance, 150)
+        self.assertEqual(self.user_repository.get_user(1).balance, 150)
+
+    def test_reads_do_not_wait_for_a_running_trade(self):
+        balances = []
+        with self.db.transaction():
+            self.user_repository.credit_balance(1, 50)
+            # the only write connection is held by this unit of work
+            reader = threading.Thread(target=lambda: balances.append(self.user_repository.get_user(1).balance))
+            reader.start()
+            reader.join(timeout=5)
+        self.assertEqual(balances, [100])
+
+
+class TestNarrowIntegrationForGeneratedData(TestCase):
+    def generate(self, num_of_positions, seed=0):
+        db = InMemoryDB()
+        fill_generated_data(db.conn, 10, 3, num_of_positions, seed=seed, chunk_size=4)
+        return db
+
+    def test_generated_rows(self):
+        db = self.generate(25)
+        self.assertEqual(db.execute_query('SELECT COUNT(*) FROM users')[0][0], 10)
+        self.assertEqual(db.execute_query('SELECT COUNT(*) FROM equities')[0][0], 3)
+        pairs = db.execute_query('SELECT user_id, equity_id FROM user_equity_map')
+        self.assertEqual(len(set(pairs)), 25)
+        self.assertEqual(UserEquityMapRepository(db).get_position(4, 2).user_id, 4)
+        indexes = db.execute_query("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")
+        self.assertEqual(sorted(indexes), [('idempotency_keys_created_on',), ('user_equity_map_user_id_equity_id',)])
+
+    def test_same_seed_gives_same_data(self):
+        query = 'SELECT u.balance, m.total_shares FROM users u JOIN user_equity_map m ON m.user_id = u.id ORDER BY m.id'
+        self.assertEqual(self.generate(12).execute_query(query), self.generate(12).execute_query(query))
+        self.assertNotEqual(self.generate(12).execute_query(query), self.generate(12, seed=1).execute_query(query))
+
+    def test_too_many_positions(self):
+        with self.assertRaisesRegex(Exception, 'provide fewer positions'):
+            self.generate(31)
+
@@ -0,0 +1,124 @@
+import os
+import tempfile
+from unittest import TestCase
+from setup_db import create_connection, create_tables, fill_testing_data
+from src.persistence.journal import Journal
+from src.persistence.ledger import LedgerDB
+from src.persistence.models import User
+from src.service.broking import BrokingService
+
+
+TIME_STAMP = '10/12/2021 16:00:01'
+
+
+class TestNarrowIntegrationForLedger(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.seed_file = os.path.join(self.directory, 'seed.db')
+        conn = create_connection(self.seed_file)
+        create_tables(conn)
+        fill_testing_data(conn)
+        conn.close()
+        self.journal_file = os.path.join(self.directory, 'ebroker.journal')
+        self.snapshot_file = os.path.join(self.directory, 'ebroker.snapshot.json')
+        self.ledger = self.open_ledger()
+        self.service = BrokingService(self.ledger)
+
+    def tearDown(self):
+        self.ledger.close()
+
+    def open_ledger(self, snapshot_every=0):
+        return LedgerDB(journal_file=self.journal_file, snapshot_file=self.snapshot_file, seed_file=self.seed_file,
+                        snapshot_every=snapshot_every)
+
+    def test_seeded_from_sqlite(self):
+        self.assertEqual(self.service.user_repository.get_user(2), User(2, 'Himanshu', 12000))
+        self.assertEqual(self.service.map_repository.get_position(2, 3).total_shares, 10)
+
+    def test_buy_and_sell(self):
+        self.service.buy_an_equity(2, 5, 10, TIME_STAMP)
+        self.assertEqual(self.service.get_balance(2), 11800)
+        self.assertEqual(self.service.map_repository.get_position(2, 5).total_shares, 10)
+        self.service.sell_an_equity(2, 5, 10, TIME_STAMP)
+        self.assertEqual(self.service.get_balance(2), 12000)
+        self.assertIsNone(self.service.map_repository.get_position(2, 5))
+
+    def test_failed_trade_leaves_no_change(self):
+        with self.assertRaisesRegex(Exception, 'Insufficient balance to buy'):
+            self.service.buy_an_equity(2, 1, 10 ** 6, TIME_STAMP)
+        with self.assertRaisesRegex(Exception, 'Insufficient shares to sell'):
+            self.service.sell_an_equity(2, 1, 11, TIME_STAMP)
+        self.assertEqual(self.service.get_balance(2), 12000)
+        self.assertEqual(self.service.map_repository.get_position(2, 1).total_shares, 10)
+
+    def test_failed_nested_unit_of_work_is_undone_alone(self):
+        with self.service.transaction():
+            self.service.add_fund(2, 100)
+            with self.assertRaisesRegex(Exception, 'Insufficient shares to sell'):
+                self.service.sell_an_equity(2, 1, 11, TIME_STAMP)
+        self.assertEqual(self.service.get_balance(2), 12100)
+
+    def test_portfolio(self):
+        portfolio = self.service.get_portfolio(2)
+        self.assertEqual(portfolio['holdingsValue'], 10 * 5 + 10 * 10 + 10 * 12)
+        self.assertEqual([holding['equityId'] for holding in portfolio['holdings']], [1, 2, 3])
+
+    def test_execute_orders(self):
+        results = self.service.execute_orders([
+            {'type': 'buy', 'userId': 2, 'equityId': 1, 'numOfShares': 2, 'timeStamp': TIME_STAMP},
+            {'type': 'sell', 'userId': 2, 'equityId': 2, 'numOfShares': 10, 'timeStamp': TIME_STAMP},
+            {'type': 'addAmount', 'userId': 3, 'amount': 10},
+        ])
+        self.assertEqual(results, [{'message': 'Equity bought successfully'}, {'message': 'Equity sold successfully'},
+                                   {'error': 'No such user exists'}])
+        self.assertEqual(self.service.get_balance(2), 12000 - 10 + 100)
+        self.assertIsNone(self.service.map_repository.get_position(2, 2))
+
+    def test_journal_is_replayed_after_a_crash(self):
+        self.service.buy_an_equity(2, 5, 10, TIME_STAMP)
+        self.service.add_fund(1, 500)
+        # the process stops without a snapshot
+        self.ledger.journal.close()
+        self.ledger.journal = None
+        self.ledger = self.open_ledger()
+        service = BrokingService(self.ledger)
+        self.assertEqual(service.get_balance(2), 11800)
+        self.assertEqual(service.get_balance(1), 10500)
+        self.assertEqual(service.map_repository.get_position(2, 5).total_shares, 10)
+
+    def test_snapshot_starts_the_journal_over(self):
+        self.ledger.close()
+        self.ledger = self.open_ledger(snapshot_every=2)
+        service = BrokingService(self.ledger)
+        service.buy_an_equity(2, 5, 10, TIME_STAMP)
+        self.assertTrue(os.path.exists(self.snapshot_file))
+        self.assertEqual(list(self.ledger.journal.read()), [])
+        service.add_fund(2, 1)
+        self.ledger.journal.close()
+        self.ledger.journal = None
+        self.ledger = self.open_ledger()
+        self.assertEqual(BrokingService(self.ledger).get_balance(2), 11801)
+
+    def test_pages_and_streams(self):
+        users = self.service.user_repository
+        self.assertEqual([user.id for user in users.get_users_page(limit=1)], [1])
+        self.assertEqual([user.id for user in users.get_users_page(1, limit=1)], [2])
+        self.assertEqual([equity.id for equity in self.service.equity_repository.stream_equities(3)], [4, 5])
+        positions = self.service.map_repository
+        self.assertEqual([position.id for position in positions.stream_positions(6)], [7, 8])
+        self.assertEqual([position.id for position in positions.get_positions_page(2, limit=2)], [3, 4])
+
+
+class TestJournal(TestCase):
+    def test_partial_last_line_is_skipped(self):
+        path = os.path.join(tempfile.mkdtemp(), 'ebroker.journal')
+        journal = Journal(path)
+        journal.append([['user', 1, 'user_1', 10], ['user', 2, 'user_2', 20]])
+        journal.close()
+        with open(path, 'a') as f:
+            f.write('[3,["user",3,')
+        journal = Journal(path)
+        self.assertEqual(journal.sequence, 2)
+        journal.append([['user', 3, 'user_3', 30]])
+        self.assertEqual([sequence for sequence, _ in journal.read(after=1)], [2, 3])
+        journal.close()
@@ -0,0 +1,131 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from setup_db import create_connection, create_tables, fill_testing_data
+from src.persistence.models import User
+from src.persistence.sharded import ShardedDB
+from src.service.broking import BrokingService
+
+
+TIME_STAMP = '10/12/2021 16:00:01'
+
+
+class TestNarrowIntegrationForSharding(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.seed_file = os.path.join(self.directory, 'seed.db')
+        conn = create_connection(self.seed_file)
+        create_tables(conn)
+        fill_testing_data(conn)
+        conn.close()
+        self.shard_files = [os.path.join(self.directory, f'ebroker.shard{index}.db') for index in range(2)]
+        self.db = ShardedDB(self.shard_files, seed_file=self.seed_file, pool_size=2)
+        self.service = BrokingService(self.db)
+
+    def tearDown(self):
+        self.db.close()
+
+    def count_users(self, index):
+        return self.db.shards[index].execute_query('SELECT COUNT(*) FROM users')[0][0]
+
+    def test_users_are_split_and_equities_copied(self):
+        self.assertEqual(self.db.shard_for(1), 1)
+        self.assertEqual(self.db.shard_for(2), 0)
+        self.assertEqual(self.db.shard_for('3'), 1)
+        with self.assertRaisesRegex(Exception, 'Invalid user id abc'):
+            self.db.shard_for('abc')
+        self.assertEqual([self.count_users(index) for index in range(2)], [1, 1])
+        for shard in self.db.shards:
+            self.assertEqual(len(shard.execute_query('SELECT id FROM equities')), 5)
+        self.assertEqual(self.service.user_repository.get_all_users(), [User(1, 'Dummy', 10000),
+                                                                         User(2, 'Himanshu', 12000)])
+        self.assertEqual(len(self.service.map_repository.get_all_positions()), 8)
+
+    def test_new_users_get_ids_across_shards(self):
+        self.service.user_repository.add_user({'name': 'tester', 'balance': 100})
+        self.service.user_repository.add_user({'name': 'other', 'balance': 100})
+        self.assertEqual(self.service.user_repository.get_user(3), User(3, 'tester', 100))
+        self.assertEqual([self.count_users(index) for index in range(2)], [2, 2])
+
+    def test_trades_and_portfolio(self):
+        self.service.buy_an_equity(2, 5, 10, TIME_STAMP)
+        self.service.sell_an_equity(1, 1, 5, TIME_STAMP)
+        self.assertEqual(self.service.get_balance(2), 11800)
+        self.assertEqual(self.service.get_balance(1), 10025)
+        portfolio = self.service.get_portfolio(2)
+        self.assertEqual([holding['equityId'] for holding in portfolio['holdings']], [1, 2, 3, 5])
+        position = self.service.map_repository.get_position(2, 5)
+        self.assertEqual(self.service.map_repository.get_user_equity(position.id), position)
+
+    def test_unit_of_work_only_locks_the_shard_of_its_user(self):
+        with self.service.transaction():
+            self.service.add_fund(2, 100)
+            other_unit = threading.Thread(target=self.service.add_fund, args=(1, 100))
+            other_unit.start()
+            other_unit.join(timeout=5)
+            self.assertFalse(other_unit.is_alive())
+            self.assertEqual(self.db._local.enlisted, [0])
+        self.assertEqual(self.service.get_balance(1), 10100)
+        self.assertEqual(self.service.get_balance(2), 12100)
+
+    def test_failed_unit_of_work_rolls_back_every_shard(self):
+        with self.assertRaisesRegex(Exception, 'Insufficient shares to sell'):
+            with self.service.transaction():
+                self.service.add_fund(1, 100)
+                self.service.add_fund(2, 100)
+                with self.assertRaisesRegex(Exception, 'Insufficient balance to buy'):
+                    self.service.buy_an_equity(2, 1, 10 ** 6, TIME_STAMP)
+                self.service.sell_an_equity(1, 1, 11, TIME_STAMP)
+        self.assertEqual(self.service.get_balance(1), 10000)
+        self.assertEqual(self.service.get_balance(2), 12000)
+
+    def test_batch_orders_across_shards(self):
+        results = self.service.execute_orders([
+            {'type': 'buy', 'userId': 1, 'equityId': 5, 'numOfShares': 10, 'timeStamp': TIME_STAMP},
+            {'type': 'sell', 'userId': 2, 'equityId': 1, 'numOfShares': 10, 'timeStamp': TIME_STAMP},
+            {'type': 'addAmount', 'userId': 3, 'amount': 10},
+        ])
+        self.assertEqual(results, [{'message': 'Equity bought successfully'}, {'message': 'Equity sold successfully'},
+                                   {'error': 'No such user exists'}])
+        self.assertEqual(self.service.map_repository.get_position(1, 5).total_shares, 20)
+        self.assertIsNone(self.service.map_repository.get_position(2, 1))
+
+    def test_batch_order_with_an_invalid_user_id(self):
+        results = self.service.execute_orders([
+            {'type': 'buy', 'userId': '1', 'equityId': 5, 'numOfShares': 10, 'timeStamp': TIME_STAMP},
+            {'type': 'addAmount', 'userId': 'abc', 'amount': 5},
+        ])
+        self.assertEqual(results, [{'message': 'Equity bought successfully'}, {'error': 'Invalid user id abc'}])
+        self.assertEqual(self.service.map_repository.get_position(1, 5).total_shares, 20)
+
+    def test_trade_events_wait_on_the_shard_of_their_user(self):
+        events = [{'type': 'fund', 'userId': 1, 'amount': 10}, {'type': 'fund', 'userId': 2, 'amount': 20}]
+        self.service.outbox_repository.add_events(events)
+        self.assertEqual([len(shard.execute_query('SELECT event FROM trade_outbox')) for shard in self.db.shards],
+                         [1, 1])
+        relayed = []
+        self.service.outbox_repository.relay(relayed.extend)
+        self.assertEqual(relayed, events[::-1])
+        self.assertEqual([shard.execute_query('SELECT COUNT(*) FROM trade_outbox') for shard in self.db.shards],
+                         [[(0,)], [(0,)]])
+
+    def test_equity_changes_reach_every_shard(self):
+        self.service.equity_repository.update_equity({'id': 1, 'name': 'ITC', 'price': 7})
+        for shard in self.db.shards:
+            self.assertEqual(shard.execute_query('SELECT price FROM equities WHERE id = 1')[0][0], 7)
+        self.assertEqual(self.service.get_portfolio(1)['holdings'][0]['price'], 7)
+
+    def test_pages_and_streams_merge_the_shards(self):
+        self.service.user_repository.add_user({'name': 'tester', 'balance': 100})
+        users = self.service.user_repository
+        self.assertEqual([user.id for user in users.get_users_page(limit=2)], [1, 2])
+        self.assertEqual([user.id for user in users.get_users_page(2, limit=2)], [3])
+        self.assertEqual([user.id for user in users.stream_users(1)], [2, 3])
+        positions = self.service.map_repository
+        all_ids = [position.id for position in positions.get_all_positions()]
+        self.assertEqual([position.id for position in positions.stream_positions()], all_ids)
+        self.assertEqual([position.id for position in positions.get_positions_page(all_ids[2], limit=3)],
+                         all_ids[3:6])
+        self.assertEqual([equity.id for equity in self.service.equity_repository.stream_equities(3)], [4, 5])
+
@@ -0,0 +1,69 @@
+import os
+import sqlite3
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+from setup_db import create_connection, create_tables, fill_testing_data
+from src.persistence.shared_memory import SharedMemoryDB
+from src.service.broking import BrokingService
+
+
+TIME_STAMP = '10/12/2021 16:00:01'
+
+
+class TestNarrowIntegrationForSharedMemory(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        seed_file = os.path.join(self.directory, 'seed.db')
+        conn = create_connection(seed_file)
+        create_tables(conn)
+        fill_testing_data(conn)
+        conn.close()
+        self.checkpoint_file = os.path.join(self.directory, 'checkpoint.db')
+        self.db = SharedMemoryDB(name=f'test_{id(self)}', seed_file=seed_file, checkpoint_file=self.checkpoint_file,
+                                 checkpoint_interval=0)
+        self.service = BrokingService(self.db)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_seeded_from_file(self):
+        self.assertEqual(self.service.get_balance(2), 12000)
+
+    def test_visible_to_every_connection_with_same_name(self):
+        self.service.buy_an_equity(2, 1, 10, TIME_STAMP)
+        other_db = SharedMemoryDB(name=self.db.name, seed_file=None, checkpoint_file=None)
+        try:
+            self.assertEqual(BrokingService(other_db).get_balance(2), 11950)
+        finally:
+            other_db.close()
+
+    def test_trades_from_many_threads(self):
+        def trade():
+            for _ in range(20):
+                self.service.buy_an_equity(2, 1, 1, TIME_STAMP)
+        threads = [threading.Thread(target=trade) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.service.get_balance(2), 12000 - 80 * 5)
+
+    @patch('src.config.STREAM_BATCH_SIZE', 1)
+    def test_export_does_not_hold_the_connection(self):
+        rows = self.service.export('users')
+        self.assertEqual(next(rows)['userId'], 1)
+        trade = threading.Thread(target=self.service.add_fund, args=(2, 1000))
+        trade.start()
+        trade.join(5)
+        self.assertFalse(trade.is_alive())
+        self.assertEqual([row['balance'] for row in rows], [13000])
+
+    def test_checkpoint_on_close(self):
+        self.service.add_fund(2, 1000)
+        self.db.close()
+        conn = sqlite3.connect(self.checkpoint_file)
+        balance = conn.execute('SELECT balance FROM users WHERE id = 2').fetchone()[0]
+        conn.close()
+        self.assertEqual(balance, 13000)
@@ -0,0 +1,50 @@
+from unittest import TestCase
+from unittest.mock import patch
+from src.persistence import cache as cache_module
+from src.persistence.cache import TTLCache
+
+
+class TestTTLCache(TestCase):
+    def setUp(self):
+        self.cache = TTLCache(max_size=2, ttl=10)
+
+    def test_get_counts_hits_and_misses(self):
+        self.assertIsNone(self.cache.get(1))
+        self.cache.put(1, 'ITC')
+        self.assertEqual(self.cache.get(1), 'ITC')
+        self.assertEqual(self.cache.stats(), {'size': 1, 'hits': 1, 'misses': 1})
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.put(1, 'ITC')
+        self.cache.put(2, 'TCS')
+        self.cache.get(1)
+        self.cache.put(3, 'SBIN')
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.get(1), 'ITC')
+        self.assertEqual(self.cache.get(3), 'SBIN')
+
+    @patch.object(cache_module.time, 'monotonic')
+    def test_entry_expires_after_ttl(self, mocked_monotonic):
+        mocked_monotonic.return_value = 100
+        self.cache.put(1, 'ITC')
+        mocked_monotonic.return_value = 109
+        self.assertEqual(self.cache.get(1), 'ITC')
+        mocked_monotonic.return_value = 111
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate_and_clear(self):
+        self.cache.put(1, 'ITC')
+        self.cache.put(2, 'TCS')
+        self.cache.invalidate(1)
+        self.assertIsNone(self.cache.get(1))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(2))
+
+    def test_value_loaded_before_an_invalidation_is_not_cached(self):
+        generation = self.cache.generation()
+        self.cache.invalidate(1)
+        self.cache.put(1, 'ITC', generation)
+        self.assertIsNone(self.cache.get(1))
+        self.cache.put(1, 'ITC', self.cache.generation())
+        self.assertEqual(self.cache.get(1), 'ITC')
@@ -1,7 +1,9 @@
 import sqlite3
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
+from src.persistence import schema
 from src.persistence.db import BrokingDB
+from src.persistence.pragmas import apply_pragma_profile
 
 
 class TestDB(TestCase):
@@ -55,6 +57,7 @@ class TestDB(TestCase):
         expected_result = []
         mocked_cursor = MagicMock()
         mocked_cursor.fetchall.return_value = expected_result
+        mocked_cursor.rowcount = 1
         conn = MagicMock()
         conn.cursor.return_value = mocked_cursor
         mocked_connect.return_value = conn
@@ -62,8 +65,9 @@ class TestDB(TestCase):
         actual_result = self.db.execute_query(query, params=(100, 1), is_transactional=True)
         self.assertEqual(expected_result, actual_result)
 
+    @patch.object(schema, 'upgrade_schema')
     @patch.object(BrokingDB, 'get_connection')
-    def test_execute_query_for_error_while_executing_update_statement(self, mocked_connect):
+    def test_execute_query_for_error_while_executing_update_statement(self, mocked_connect, mocked_upgrade_schema):
         expected_message = 'Some error occurred while executing the query'
         conn = MagicMock()
         conn.cursor.side_effect = [Exception()]
@@ -71,3 +75,32 @@ class TestDB(TestCase):
         query = 'UPDATE users SET balance = ? WHERE id = ?'
         with self.assertRaisesRegex(Exception, expected_message):
             self.db.execute_query(query, params=(100, 1), is_transactional=True)
+
+
+class TestPragmaProfiles(TestCase):
+    def test_profile_is_applied_on_connection(self):
+        conn = sqlite3.connect(':memory:')
+        apply_pragma_profile(conn, 'balanced')
+        # NORMAL is 1
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)
+        self.assertEqual(conn.execute('PRAGMA cache_size').fetchone()[0], -32000)
+        conn.close()
+
+    def test_unknown_profile(self):
+        conn = sqlite3.connect(':memory:')
+        with self.assertRaisesRegex(Exception, 'Unknown pragma profile fastest'):
+            apply_pragma_profile(conn, 'fastest')
+        conn.close()
+
+
+class TestSchema(TestCase):
+    def test_duplicate_positions_are_merged_before_creating_unique_index(self):
+        conn = sqlite3.connect(':memory:')
+        schema.create_tables(conn)
+        query = "INSERT INTO user_equity_map (user_id, equity_id, total_shares, last_modified_on) " \
+                "VALUES (?, ?, ?, datetime('now'))"
+        conn.executemany(query, [(1, 1, 10), (1, 1, 5), (1, 2, 7)])
+        schema.create_indexes(conn)
+        rows = conn.execute('SELECT user_id, equity_id, total_shares FROM user_equity_map ORDER BY id').fetchall()
+        self.assertEqual(rows, [(1, 1, 15), (1, 2, 7)])
+        conn.close()
@@ -0,0 +1,61 @@
+import threading
+from unittest import TestCase
+from src.metrics import MetricsRegistry, normalize_statement
+from src.persistence.in_memory import InMemoryDB
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0))
+        histogram.observe(0.05, '/buy')
+        histogram.observe(0.5, '/buy')
+        histogram.observe(5, '/buy')
+        lines = self.registry.render().splitlines()
+        self.assertIn('# TYPE latency_seconds histogram', lines)
+        self.assertIn('latency_seconds_bucket{route="/buy",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{route="/buy",le="1.0"} 2', lines)
+        self.assertIn('latency_seconds_bucket{route="/buy",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_count{route="/buy"} 3', lines)
+        self.assertIn('latency_seconds_sum{route="/buy"} 5.55', lines)
+
+    def test_counter_and_gauge(self):
+        counter = self.registry.counter('rows_total', 'Rows', ('statement',))
+        counter.inc(2, 'SELECT "x"')
+        self.registry.gauge('entries', 'Entries', collect=lambda: {(): 7})
+        lines = self.registry.render().splitlines()
+        self.assertIn('rows_total{statement="SELECT \\"x\\""} 2', lines)
+        self.assertIn('entries 7', lines)
+
+    def test_normalize_statement(self):
+        self.assertEqual(normalize_statement('SELECT id\n    FROM users WHERE id IN (?, ?, ?, ?)'),
+                         'SELECT id FROM users WHERE id IN (?, ...)')
+        self.assertEqual(normalize_statement('SELECT id FROM user_equity_map WHERE (user_id, equity_id) IN '
+                                             '(VALUES (?, ?), (?, ?))'),
+                         'SELECT id FROM user_equity_map WHERE (user_id, equity_id) IN (VALUES (?, ?), ...)')
+
+    def test_query_hooks_get_duration_and_rows(self):
+        db = InMemoryDB()
+        db.create_tables()
+        recorded = []
+        db.query_hooks = [lambda query, duration, rows, error: recorded.append((query, rows, error))]
+        db.execute_query("INSERT INTO users (name, balance, last_modified_on) VALUES ('user_1', 1, datetime('now'))",
+                         is_transactional=True)
+        db.execute_query('SELECT id FROM users')
+        with self.assertRaises(Exception):
+            db.execute_query('SELECT id FROM unknown_table')
+        db.close()
+        self.assertEqual([rows for _, rows, _ in recorded], [1, 1, 0])
+        self.assertIsNotNone(recorded[2][2])
+
+    def test_series_of_finished_threads_are_kept(self):
+        counter = self.registry.counter('trades_total', 'Trades')
+        threads = [threading.Thread(target=counter.inc) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        counter.inc()
+        self.assertEqual(counter.value(), 6)
+        self.assertEqual(len(counter._shards), 1)
@@ -0,0 +1,85 @@
+import threading
+from unittest import TestCase
+from unittest.mock import MagicMock
+from src.persistence.pool import ConnectionPool
+
+
+class TestConnectionPool(TestCase):
+    def setUp(self):
+        self.connect = MagicMock(side_effect=lambda: MagicMock(in_transaction=False))
+        self.pool = ConnectionPool(self.connect, max_size=2, checkout_timeout=0.1, health_check_interval=60)
+
+    def test_connection_is_reused_after_release(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        self.assertIs(self.pool.acquire(), conn)
+        self.assertEqual(self.connect.call_count, 1)
+
+    def test_nested_acquire_in_same_thread_returns_same_connection(self):
+        conn = self.pool.acquire()
+        self.assertIs(self.pool.acquire(), conn)
+        self.pool.release(conn)
+        self.assertEqual(self.pool.idle_count, 0)
+        self.pool.release(conn)
+        self.assertEqual(self.pool.idle_count, 1)
+
+    def test_different_threads_get_different_connections(self):
+        conn = self.pool.acquire()
+        other = []
+        thread = threading.Thread(target=lambda: other.append(self.pool.acquire()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], conn)
+        self.assertEqual(self.pool.size, 2)
+
+    def test_checkout_timeout_when_pool_is_exhausted(self):
+        self.pool.acquire()
+        thread = threading.Thread(target=self.pool.acquire)
+        thread.start()
+        thread.join()
+        errors = []
+
+        def acquire():
+            try:
+                self.pool.acquire()
+            except Exception as e:
+                errors.append(str(e))
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        thread.join()
+        self.assertEqual(errors, ['Timed out while waiting for a database connection'])
+
+    def test_connection_released_by_another_thread_is_handed_back(self):
+        conn = self.pool.acquire()
+        thread = threading.Thread(target=self.pool.release, args=(conn,))
+        thread.start()
+        thread.join()
+        self.assertEqual(self.pool.idle_count, 1)
+        self.assertIsNone(self.pool.current_connection())
+        self.assertIs(self.pool.acquire(), conn)
+        self.pool.release(conn)
+        # released once too often
+        self.pool.release(conn)
+        self.assertEqual(self.pool.idle_count, 1)
+
+    def test_open_transaction_is_rolled_back_on_release(self):
+        conn = self.pool.acquire()
+        conn.in_transaction = True
+        self.pool.release(conn)
+        conn.rollback.assert_called_once()
+
+    def test_unhealthy_connection_is_replaced(self):
+        self.pool.health_check_interval = 0
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        conn.execute.side_effect = Exception('disk I/O error')
+        new_conn = self.pool.acquire()
+        self.assertIsNot(new_conn, conn)
+        conn.close.assert_called_once()
+
+    def test_error_while_connecting_frees_the_slot(self):
+        self.connect.side_effect = [Exception('No connection'), MagicMock(in_transaction=False)]
+        with self.assertRaisesRegex(Exception, 'No connection'):
+            self.pool.acquire()
+        self.assertEqual(self.pool.size, 0)
+        self.assertIsNotNone(self.pool.acquire())
@@ -0,0 +1,38 @@
+import sqlite3
+from unittest import TestCase
+from src.persistence.models import USER_ROW, User
+from src.persistence.statements import in_list_query, in_list_statement
+
+
+class TestInListQuery(TestCase):
+    def test_values_are_padded_up_to_the_next_size(self):
+        query, params = in_list_query('SELECT id FROM users WHERE id IN ({})', [1, 2, 3])
+        self.assertEqual(query, 'SELECT id FROM users WHERE id IN (?, ?, ?, ?)')
+        self.assertEqual(params, (1, 2, 3, 3))
+
+    def test_same_size_reuses_the_same_statement(self):
+        first, _ = in_list_query('SELECT id FROM users WHERE id IN ({})', [1, 2, 3])
+        second, _ = in_list_query('SELECT id FROM users WHERE id IN ({})', [4, 5, 6, 7])
+        self.assertIs(first, second)
+        self.assertIs(first, in_list_statement('SELECT id FROM users WHERE id IN ({})', 4, '?'))
+
+    def test_pairs_are_flattened(self):
+        query, params = in_list_query('SELECT id FROM user_equity_map WHERE (user_id, equity_id) IN (VALUES {})',
+                                      [(1, 2), (3, 4), (5, 6)], placeholder='(?, ?)')
+        self.assertEqual(query, 'SELECT id FROM user_equity_map WHERE (user_id, equity_id) IN '
+                                '(VALUES (?, ?), (?, ?), (?, ?), (?, ?))')
+        self.assertEqual(params, (1, 2, 3, 4, 5, 6, 5, 6))
+
+
+class TestRowModels(TestCase):
+    def test_row_factory_builds_models(self):
+        conn = sqlite3.connect(':memory:')
+        cur = conn.cursor()
+        cur.row_factory = USER_ROW
+        cur.execute("SELECT 1, 'user_1', 100.0")
+        user = cur.fetchone()
+        conn.close()
+        self.assertIsInstance(user, User)
+        self.assertEqual(user.balance, 100.0)
+        self.assertEqual(user, (1, 'user_1', 100.0))
+        self.assertFalse(hasattr(user, '__dict__'))
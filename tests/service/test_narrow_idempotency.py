@@ -0,0 +1,107 @@
+import os
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from setup_db import create_connection, create_tables, fill_testing_data
+from src.persistence.db import BrokingDB
+from src.persistence.idempotency import IdempotencyRepository
+from src.persistence.ledger import LedgerDB, LedgerIdempotencyRepository
+from src.persistence.sharded import ShardedDB
+from src.persistence.user import UserRepository
+from src.service.broking import BrokingService
+
+
+TIME_STAMP = '10/12/2021 16:00:01'
+
+
+class TestIdempotency(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database_file = os.path.join(self.directory, 'ebroker.db')
+        conn = create_connection(self.database_file)
+        create_tables(conn)
+        fill_testing_data(conn)
+        conn.close()
+        self.db = BrokingDB(self.database_file)
+        self.service = BrokingService(self.db)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_retry_returns_the_stored_response(self):
+        self.assertEqual(self.service.run_idempotent('k1', 'buy_an_equity', 2, 5, 10, TIME_STAMP),
+                         'Equity bought successfully')
+        with patch.object(UserRepository, 'debit_balance') as mock_debit_balance:
+            self.assertEqual(self.service.run_idempotent('k1', 'buy_an_equity', 2, 5, 10, TIME_STAMP),
+                             'Equity bought successfully')
+            mock_debit_balance.assert_not_called()
+        self.assertEqual(self.service.get_balance(2), 11800)
+        self.assertEqual(self.service.map_repository.get_position(2, 5).total_shares, 10)
+
+    def test_keys_belong_to_a_user(self):
+        self.service.run_idempotent('k1', 'add_fund', 1, 100)
+        self.service.run_idempotent('k1', 'add_fund', 2, 100)
+        self.assertEqual(self.service.get_balance(1), 10100)
+        self.assertEqual(self.service.get_balance(2), 12100)
+
+    def test_failed_trade_stores_nothing(self):
+        with self.assertRaisesRegex(Exception, 'Insufficient balance to buy'):
+            self.service.run_idempotent('k1', 'buy_an_equity', 2, 1, 10 ** 6, TIME_STAMP)
+        self.assertIsNone(self.service.stored_response('k1', 'buy_an_equity', 2, 1, 10 ** 6, TIME_STAMP))
+        self.service.add_fund(2, 10 ** 7)
+        self.assertEqual(self.service.run_idempotent('k1', 'buy_an_equity', 2, 1, 10 ** 6, TIME_STAMP),
+                         'Equity bought successfully')
+
+    def test_key_sent_with_another_request(self):
+        self.service.run_idempotent('k1', 'add_fund', 2, 100)
+        with self.assertRaisesRegex(Exception, 'Idempotency key k1 was already used for another request'):
+            self.service.run_idempotent('k1', 'add_fund', 2, 200)
+        with self.assertRaisesRegex(Exception, 'execute_orders does not take an idempotency key'):
+            self.service.run_idempotent('k2', 'execute_orders', [])
+        self.assertEqual(self.service.get_balance(2), 12100)
+
+    def test_keys_survive_a_restart(self):
+        self.service.run_idempotent('k1', 'sell_an_equity', 2, 1, 5, TIME_STAMP)
+        self.db.close()
+        self.db = BrokingDB(self.database_file)
+        service = BrokingService(self.db)
+        self.assertEqual(len(service.idempotency_repository.cache), 0)
+        self.assertEqual(service.run_idempotent('k1', 'sell_an_equity', 2, 1, 5, TIME_STAMP),
+                         'Equity sold successfully')
+        self.assertEqual(service.map_repository.get_position(2, 1).total_shares, 5)
+
+    def test_expired_keys_are_deleted(self):
+        repository = IdempotencyRepository(self.db, key_ttl=60)
+        repository.save_response(2, 'k1', 'request', 'response')
+        self.assertEqual(repository.get_response(2, 'k1').response, 'response')
+        repository.cache.clear()
+        with patch('src.persistence.idempotency.time.time', return_value=time.time() + 61):
+            self.assertIsNone(repository.get_response(2, 'k1'))
+            repository.save_response(2, 'k2', 'request', 'response')
+        self.assertEqual(self.db.execute_query('SELECT key FROM idempotency_keys'), [('k2',)])
+
+    def test_ledger_keys_are_journaled(self):
+        journal_file = os.path.join(self.directory, 'ebroker.journal')
+        ledger = LedgerDB(journal_file=journal_file, snapshot_file=None, seed_file=self.database_file)
+        BrokingService(ledger).run_idempotent('k1', 'add_fund', 2, 100)
+        ledger.close()
+        ledger = LedgerDB(journal_file=journal_file, snapshot_file=None, seed_file=self.database_file)
+        service = BrokingService(ledger)
+        self.assertEqual(service.run_idempotent('k1', 'add_fund', 2, 100), 'User balance updated successfully')
+        self.assertEqual(service.get_balance(2), 12100)
+        with patch('src.persistence.ledger.time.time', return_value=time.time() + 61):
+            LedgerIdempotencyRepository(ledger, key_ttl=60).save_response(2, 'k2', 'request', 'response')
+        self.assertEqual(list(ledger.idempotency_keys), [(2, 'k2')])
+        ledger.close()
+
+    def test_sharded_keys_are_on_the_shard_of_the_user(self):
+        shard_files = [os.path.join(self.directory, f'ebroker.shard{index}.db') for index in range(2)]
+        db = ShardedDB(shard_files, seed_file=self.database_file)
+        service = BrokingService(db)
+        service.run_idempotent('k1', 'add_fund', 2, 100)
+        self.assertEqual(service.run_idempotent('k1', 'add_fund', 2, 100), 'User balance updated successfully')
+        self.assertEqual(service.get_balance(2), 12100)
+        self.assertEqual(db.shards[0].execute_query('SELECT user_id, key FROM idempotency_keys'), [(2, 'k1')])
+        self.assertEqual(db.shards[1].execute_query('SELECT user_id, key FROM idempotency_keys'), [])
+        db.close()
@@ -0,0 +1,106 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+from setup_db import create_connection, create_tables, fill_testing_data
+from src.persistence.db import BrokingDB
+from src.persistence.ledger import LedgerDB
+from src.persistence.sharded import ShardedDB
+from src.persistence.user import UserRepository
+from src.service.broking import VERSION_CONFLICTS, BrokingService
+
+
+TIME_STAMP = '10/12/2021 16:00:01'
+
+
+class TestOptimisticTrades(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database_file = os.path.join(self.directory, 'ebroker.db')
+        conn = create_connection(self.database_file)
+        create_tables(conn)
+        fill_testing_data(conn)
+        conn.close()
+        self.db = BrokingDB(self.database_file)
+        self.service = BrokingService(self.db, concurrency='optimistic')
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_buy_and_sell(self):
+        self.assertTrue(self.service.runs_optimistically())
+        self.assertEqual(self.service.buy_an_equity(2, 5, 10, TIME_STAMP), 'Equity bought successfully')
+        self.assertEqual(self.service.get_balance(2), 11800)
+        self.assertEqual(self.service.map_repository.get_position(2, 5).total_shares, 10)
+        self.assertEqual(self.service.sell_an_equity(2, 5, 4, TIME_STAMP), 'Equity sold successfully')
+        self.assertEqual(self.service.map_repository.get_position(2, 5).total_shares, 6)
+        self.service.sell_an_equity(2, 5, 6, TIME_STAMP)
+        self.assertIsNone(self.service.map_repository.get_position(2, 5))
+        self.assertEqual(self.service.get_balance(2), 12000)
+
+    def test_failed_trades(self):
+        with self.assertRaisesRegex(Exception, 'Insufficient balance to buy'):
+            self.service.buy_an_equity(2, 1, 10 ** 6, TIME_STAMP)
+        with self.assertRaisesRegex(Exception, 'Insufficient shares to sell'):
+            self.service.sell_an_equity(2, 1, 11, TIME_STAMP)
+        with self.assertRaisesRegex(Exception, 'User does not have selected equity'):
+            self.service.sell_an_equity(2, 5, 1, TIME_STAMP)
+        with self.assertRaisesRegex(Exception, 'No such user exists'):
+            self.service.buy_an_equity(99, 1, 1, TIME_STAMP)
+        self.assertEqual(self.service.get_balance(2), 12000)
+
+    def test_conflict_is_retried(self):
+        stale = self.service.user_repository.get_versioned_user(2)
+        self.service.add_fund(2, 100)
+        conflicts = VERSION_CONFLICTS.value()
+        with patch.object(UserRepository, 'get_versioned_user',
+                          side_effect=[stale, self.service.user_repository.get_versioned_user(2)]):
+            self.service.buy_an_equity(2, 5, 10, TIME_STAMP)
+        self.assertEqual(VERSION_CONFLICTS.value(), conflicts + 1)
+        self.assertEqual(self.service.get_balance(2), 11900)
+        self.assertEqual(self.service.map_repository.get_position(2, 5).total_shares, 10)
+
+    @patch('src.config.OPTIMISTIC_BACKOFF', 0)
+    @patch('src.config.OPTIMISTIC_RETRIES', 2)
+    def test_retries_are_bounded(self):
+        stale = self.service.user_repository.get_versioned_user(2)
+        self.service.add_fund(2, 100)
+        with patch.object(UserRepository, 'get_versioned_user', return_value=stale) as mock_get_versioned_user:
+            with self.assertRaisesRegex(Exception, 'Too many concurrent trades for this user'):
+                self.service.buy_an_equity(2, 5, 10, TIME_STAMP)
+        self.assertEqual(mock_get_versioned_user.call_count, 3)
+        self.assertEqual(self.service.get_balance(2), 12100)
+        self.assertIsNone(self.service.map_repository.get_position(2, 5))
+
+    @patch('src.config.OPTIMISTIC_RETRIES', 100)
+    def test_concurrent_trades_of_a_user(self):
+        def buy():
+            for _ in range(10):
+                self.service.buy_an_equity(2, 5, 1, TIME_STAMP)
+        threads = [threading.Thread(target=buy) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.service.map_repository.get_position(2, 5).total_shares, 40)
+        self.assertEqual(self.service.get_balance(2), 12000 - 40 * 20)
+
+    def test_trades_inside_a_unit_of_work_are_pessimistic(self):
+        with self.service.transaction():
+            self.assertFalse(self.service.runs_optimistically())
+            self.service.buy_an_equity(2, 5, 10, TIME_STAMP)
+        self.assertEqual(self.service.get_balance(2), 11800)
+
+    def test_sharded_and_ledger_engines(self):
+        db = ShardedDB([os.path.join(self.directory, f'ebroker.shard{index}.db') for index in range(2)],
+                       seed_file=self.database_file)
+        service = BrokingService(db, concurrency='optimistic')
+        service.buy_an_equity(1, 5, 10, TIME_STAMP)
+        service.sell_an_equity(1, 5, 10, TIME_STAMP)
+        self.assertEqual(service.map_repository.get_position(1, 5).total_shares, 10)
+        db.close()
+        ledger = LedgerDB(journal_file=None, snapshot_file=None, seed_file=self.database_file)
+        self.assertFalse(BrokingService(ledger, concurrency='optimistic').optimistic)
+        with self.assertRaisesRegex(Exception, 'Unknown concurrency locking'):
+            BrokingService(ledger, concurrency='locking')
@@ -0,0 +1,69 @@
+import os
+import tempfile
+from unittest import TestCase
+from src.persistence.in_memory import InMemoryDB
+from src.service.broking import BrokingService
+from src.service.price_feed import PriceFeed, validate_tick
+
+
+class TestPriceFeed(TestCase):
+    def setUp(self):
+        self.db = InMemoryDB()
+        self.db.create_tables()
+        self.service = BrokingService(self.db)
+        self.service.equity_repository.add_equity({'name': 'ITC', 'price': 10})
+        self.service.equity_repository.add_equity({'name': 'TCS', 'price': 20})
+        self.price_feed = PriceFeed(self.db, batch_size=3)
+        self.directory = tempfile.mkdtemp()
+
+    def price(self, equity_id):
+        return self.service.equity_repository.get_equity(equity_id).price
+
+    def test_last_tick_of_a_batch_wins(self):
+        stats = self.price_feed.apply([(1, 11), (2, 21), (1, 12), (1, 13), (3, 5)])
+        self.assertEqual(stats['ticks'], 5)
+        # first batch writes 1 and 2, second one writes 1 and skips the unknown equity 3
+        self.assertEqual(stats['updated'], 3)
+        self.assertGreater(stats['ticksPerSecond'], 0)
+        self.assertEqual(self.price(1), 13)
+        self.assertEqual(self.price(2), 21)
+        self.assertEqual(self.service.equity_repository.get_equity(1).name, 'ITC')
+
+    def test_cached_prices_are_dropped(self):
+        self.assertEqual(self.price(1), 10)
+        self.price_feed.apply([(1, 15)])
+        self.assertEqual(self.price(1), 15)
+
+    def test_rolled_back_prices_keep_the_cache(self):
+        self.assertEqual(self.price(1), 10)
+        with self.assertRaises(Exception):
+            with self.db.transaction():
+                self.service.equity_repository.update_prices([(1, 15)])
+                raise Exception('rolled back')
+        self.assertEqual(self.price(1), 10)
+        self.assertEqual(self.service.equity_repository.cache.stats()['size'], 1)
+
+    def test_load_csv_and_ndjson_files(self):
+        csv_file = os.path.join(self.directory, 'ticks.csv')
+        with open(csv_file, 'w') as f:
+            f.write('equityId,price,timeStamp\n1,10.5,10/12/2021 16:00:01\n2,20.5,10/12/2021 16:00:01\n'
+                    '1,11,10/12/2021 16:00:02\n')
+        self.assertEqual(self.price_feed.load(csv_file)['ticks'], 3)
+        self.assertEqual((self.price(1), self.price(2)), (11, 20.5))
+        ndjson_file = os.path.join(self.directory, 'ticks.ndjson')
+        with open(ndjson_file, 'w') as f:
+            f.write('{"equityId": 2, "price": 22}\n\n{"equityId": 1, "price": 9.5}\n')
+        self.assertEqual(self.price_feed.load(ndjson_file)['updated'], 2)
+        self.assertEqual((self.price(1), self.price(2)), (9.5, 22))
+
+    def test_invalid_ticks(self):
+        ndjson_file = os.path.join(self.directory, 'ticks.ndjson')
+        with open(ndjson_file, 'w') as f:
+            f.write('{"equityId": 2, "price": 22}\n{"equityId": 1}\n')
+        with self.assertRaisesRegex(Exception, 'Invalid tick at line 2'):
+            self.price_feed.load(ndjson_file)
+        for price in (-1, float('nan'), float('inf'), float('-inf')):
+            with self.assertRaisesRegex(Exception, 'Provide a non negative price for equity 1'):
+                validate_tick(1, price)
+        with self.assertRaisesRegex(Exception, 'Invalid equity id 1'):
+            validate_tick('1', 5)
@@ -0,0 +1,171 @@
+import os
+import tempfile
+import time
+from unittest import TestCase
+from src.persistence.in_memory import InMemoryDB
+from src.persistence.ledger import LedgerDB
+from src.service.broking import BrokingService
+from src.service.trade_log import TradeEventLog
+
+
+TIME_STAMP = '10/12/2021 16:00:01'
+
+
+class TestTradeEventLog(TestCase):
+    def setUp(self):
+        self.db = InMemoryDB()
+        self.db.create_tables()
+        service = BrokingService(self.db)
+        service.user_repository.add_user({'name': 'tester', 'balance': 100})
+        service.equity_repository.add_equity({'name': 'ITC', 'price': 10})
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'ebroker.trades.log')
+        self.snapshot_file = os.path.join(directory, 'ebroker.trades.snapshot.json')
+        self.event_log = self.open_log()
+        self.service = BrokingService(self.db, self.event_log)
+
+    def tearDown(self):
+        self.event_log.close()
+
+    def open_log(self, compact_every=0):
+        return TradeEventLog(self.path, self.snapshot_file, fsync_batch_size=2, fsync_interval=0,
+                             compact_every=compact_every, db=self.db, relay_interval=0)
+
+    def logged_events(self):
+        self.event_log.relay()
+        return [event for _, event in self.event_log.journal.read()]
+
+    def assert_replay_matches_db(self):
+        self.event_log.relay()
+        state = self.event_log.replay()
+        self.assertEqual(state.balances, {user.id: user.balance
+                                          for user in self.service.user_repository.get_all_users()})
+        self.assertEqual(state.positions, {(position.user_id, position.equity_id): position.total_shares
+                                           for position in self.service.map_repository.get_all_positions()})
+
+    def test_replay_rebuilds_balances_and_positions(self):
+        self.service.buy_an_equity(1, 1, 5, TIME_STAMP)
+        self.service.sell_an_equity(1, 1, 2, TIME_STAMP)
+        self.service.add_fund(1, 30)
+        self.service.execute_orders([{'type': 'sell', 'userId': 1, 'equityId': 1, 'numOfShares': 3,
+                                      'timeStamp': TIME_STAMP}, {'type': 'addAmount', 'userId': 1, 'amount': 5}])
+        self.assertEqual([event.get('timeStamp') for event in self.logged_events()],
+                         [TIME_STAMP, TIME_STAMP, None, TIME_STAMP, None])
+        self.assertEqual(self.event_log.journal.sequence, 5)
+        self.assert_replay_matches_db()
+
+    def test_user_id_sent_as_a_string_is_logged_as_an_int(self):
+        self.service.buy_an_equity('1', 1, 5, TIME_STAMP)
+        self.service.add_fund('1', 30)
+        self.assertEqual([event['userId'] for event in self.logged_events()], [1, 1])
+        self.assert_replay_matches_db()
+
+    def test_failed_trades_are_not_logged(self):
+        with self.assertRaises(Exception):
+            self.service.buy_an_equity(1, 1, 500, TIME_STAMP)
+        with self.service.transaction():
+            self.service.add_fund(1, 30)
+            with self.assertRaises(Exception):
+                self.service.sell_an_equity(1, 1, 1, TIME_STAMP)
+        with self.assertRaises(Exception):
+            with self.service.transaction():
+                self.service.add_fund(1, 30)
+                raise Exception('rolled back')
+        self.assertEqual(self.logged_events(), [{'type': 'fund', 'userId': 1, 'amount': 30}])
+        self.assert_replay_matches_db()
+
+    def test_compaction_keeps_replay_bounded(self):
+        self.event_log.close()
+        self.event_log = self.open_log(compact_every=2)
+        self.service = BrokingService(self.db, self.event_log)
+        for _ in range(3):
+            self.service.buy_an_equity(1, 1, 1, TIME_STAMP)
+            self.event_log.relay()
+        self.event_log.compact()
+        self.assertFalse(os.path.exists(self.event_log.compacting_file))
+        self.assertEqual(list(self.event_log.journal.read()), [])
+        self.service.sell_an_equity(1, 1, 1, TIME_STAMP)
+        self.event_log.relay()
+        self.assertEqual(self.event_log.replay().sequence, 4)
+        self.assert_replay_matches_db()
+
+    def test_reopened_log_continues(self):
+        self.service.buy_an_equity(1, 1, 5, TIME_STAMP)
+        self.event_log.close()
+        self.event_log = self.open_log()
+        self.service = BrokingService(self.db, self.event_log)
+        self.service.add_fund(1, 30)
+        self.event_log.relay()
+        self.assertEqual([sequence for sequence, _ in self.event_log.journal.read()], [1, 2])
+        self.assert_replay_matches_db()
+
+    def test_restore_writes_the_replayed_state(self):
+        self.service.buy_an_equity(1, 1, 5, TIME_STAMP)
+        self.service.user_repository.update_user({'id': 1, 'name': 'tester', 'balance': 0})
+        self.service.map_repository.upsert_position(1, 1, -5)
+        self.event_log.restore(self.db)
+        self.assertEqual(self.service.get_balance(1), 50)
+        self.assertEqual(self.service.map_repository.get_position(1, 1).total_shares, 5)
+
+    def test_events_are_relayed_in_commit_order(self):
+        # committed before a stop which came ahead of its relay
+        self.service.outbox_repository.add_events([{'type': 'fund', 'userId': 1, 'amount': 30}])
+        self.service.user_repository.credit_balance(1, 30)
+        with self.service.transaction():
+            self.service.buy_an_equity(1, 1, 2, TIME_STAMP)
+            self.service.sell_an_equity(1, 1, 1, TIME_STAMP)
+        self.assertEqual([event['type'] for event in self.logged_events()], ['fund', 'buy', 'sell'])
+        self.assertEqual(self.db.execute_query('SELECT COUNT(*) FROM trade_outbox'), [(0,)])
+        self.assert_replay_matches_db()
+
+    def test_trade_leaves_the_relay_to_the_log(self):
+        self.service.add_fund(1, 30)
+        self.assertEqual(list(self.event_log.journal.read()), [])
+        self.assertEqual(self.db.execute_query('SELECT COUNT(*) FROM trade_outbox'), [(1,)])
+        self.event_log.close()
+        # closing the log relays what is left in the outbox
+        self.event_log = self.open_log()
+        self.assertEqual(list(self.event_log.journal.read()), [(1, {'type': 'fund', 'userId': 1, 'amount': 30})])
+
+    def test_outbox_is_relayed_in_batches(self):
+        self.service.outbox_repository.add_events([{'type': 'fund', 'userId': 1, 'amount': amount}
+                                                   for amount in (1, 2, 3)])
+        batches = []
+        self.service.outbox_repository.relay(batches.append, batch_size=2)
+        self.assertEqual([[event['amount'] for event in batch] for batch in batches], [[1, 2], [3]])
+        self.assertEqual(self.db.execute_query('SELECT COUNT(*) FROM trade_outbox'), [(0,)])
+
+    def test_outbox_is_relayed_in_the_background(self):
+        self.event_log.close()
+        self.event_log = TradeEventLog(self.path, self.snapshot_file, fsync_interval=0, db=self.db,
+                                       relay_interval=0.01)
+        BrokingService(self.db, self.event_log).add_fund(1, 30)
+        for _ in range(500):
+            if list(self.event_log.journal.read()):
+                break
+            time.sleep(0.01)
+        self.assertEqual([event['amount'] for _, event in self.event_log.journal.read()], [30])
+
+    def test_rolled_back_trades_leave_the_outbox_empty(self):
+        with self.assertRaises(Exception):
+            with self.service.transaction():
+                self.service.add_fund(1, 30)
+                raise Exception('rolled back')
+        self.assertEqual(self.db.execute_query('SELECT COUNT(*) FROM trade_outbox'), [(0,)])
+        self.assertEqual(self.logged_events(), [])
+
+    def test_ledger_outbox_is_journaled(self):
+        directory = tempfile.mkdtemp()
+        journal_file = os.path.join(directory, 'ebroker.journal')
+        ledger = LedgerDB(journal_file=journal_file, snapshot_file=None, seed_file=None)
+        # a stop leaves the event in the outbox before it is relayed
+        service = BrokingService(ledger)
+        service.user_repository.add_user({'name': 'tester', 'balance': 100})
+        service.outbox_repository.add_events([{'type': 'fund', 'userId': 1, 'amount': 30}])
+        ledger.close()
+        ledger = LedgerDB(journal_file=journal_file, snapshot_file=None, seed_file=None)
+        self.assertEqual(list(ledger.outbox.values()), [{'type': 'fund', 'userId': 1, 'amount': 30}])
+        BrokingService(ledger, self.event_log).add_fund(1, 5)
+        self.assertEqual([event['amount'] for event in self.logged_events()], [30, 5])
+        self.assertEqual(ledger.outbox, {})
+        ledger.close()
@@ -0,0 +1,65 @@
+from unittest import TestCase
+from unittest.mock import patch
+from src.persistence.async_db import ServerBusyError
+from src.persistence.in_memory import InMemoryDB
+from src.service.broking import BrokingService
+from src.service.trade_queue import TradeWriter, give_up, run_trade
+
+
+class TestTradeWriter(TestCase):
+    def setUp(self):
+        db = InMemoryDB()
+        db.create_tables()
+        self.service = BrokingService(db)
+        self.service.user_repository.add_user({'name': 'tester', 'balance': 100})
+        self.service.equity_repository.add_equity({'name': 'ITC', 'price': 10})
+        self.writer = TradeWriter(self.service)
+
+    def tearDown(self):
+        self.writer.stop()
+
+    def test_batch_is_committed_together_and_each_caller_gets_its_own_result(self):
+        time_stamp = '10/12/2021 16:00:01'
+        futures = [
+            self.writer.submit('buy_an_equity', 1, 1, 5, time_stamp),
+            self.writer.submit('buy_an_equity', 1, 1, 50, time_stamp),
+            self.writer.submit('sell_an_equity', 1, 1, 2, time_stamp),
+            self.writer.submit('add_fund', 1, 30),
+            self.writer.submit('sell_an_equity', 1, 1, 0, time_stamp),
+        ]
+        # all the commands are queued before the writer starts, so they form one batch
+        self.writer.start()
+        self.assertEqual(futures[0].result(5), 'Equity bought successfully')
+        with self.assertRaisesRegex(Exception, 'Insufficient balance to buy'):
+            futures[1].result(5)
+        self.assertEqual(futures[2].result(5), 'Equity sold successfully')
+        self.assertEqual(futures[3].result(5), 'User balance updated successfully')
+        with self.assertRaisesRegex(Exception, 'Provide minimum one share to sell'):
+            futures[4].result(5)
+        self.assertEqual(self.writer.batches, 1)
+        self.assertEqual(self.service.get_balance(1), 100 - 50 + 20 + 30)
+        self.assertEqual(self.service.map_repository.get_position(1, 1)[3], 3)
+
+    def test_writer_stops_after_pending_commands(self):
+        self.writer.start()
+        future = self.writer.submit('add_fund', 1, 10)
+        self.writer.stop()
+        self.assertEqual(future.result(0), 'User balance updated successfully')
+
+    @patch('src.config.WRITE_QUEUE_TIMEOUT', 0.01)
+    @patch('src.config.WRITE_QUEUE', True)
+    def test_timed_out_command_is_skipped(self):
+        # the writer is not started, the command is still queued when it times out
+        with patch('src.service.trade_queue.get_trade_writer', return_value=self.writer):
+            with self.assertRaisesRegex(ServerBusyError, 'the trade was not run, try again later'):
+                run_trade('add_fund', 1, 10)
+        self.writer.start()
+        self.writer.stop()
+        self.assertEqual(self.writer.commands, 0)
+        self.assertEqual(self.service.get_balance(1), 100)
+
+    def test_running_command_is_not_given_up(self):
+        future = self.writer.submit('add_fund', 1, 10)
+        future.set_running_or_notify_cancel()
+        self.assertRegex(str(give_up(future)), 'its outcome is unknown')
+        self.assertFalse(future.cancelled())
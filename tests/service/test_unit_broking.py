@@ -2,6 +2,7 @@ from builtins import map
 from unittest import TestCase
 from unittest.mock import MagicMock
 
+from src.persistence.models import Equity, PortfolioRow, Position, User
 from src.service.broking import BrokingService
 
 
@@ -58,28 +59,40 @@ class TestBrokingService(TestCase):
     def test_buy_an_equity_with_insufficient_funds(self):
         expected_message = 'Insufficient balance to buy'
         current_time_stamp = '10/12/2021 16:00:01'
-        self.service.user_repository.get_user.return_value = (1, 'mocked', 900)
-        self.service.equity_repository.get_equity.return_value = (1, 'mocked', 10)
+        self.service.user_repository.get_user.return_value = User(1, 'mocked', 900)
+        self.service.user_repository.debit_balance.return_value = False
+        self.service.equity_repository.get_equity.return_value = Equity(1, 'mocked', 10)
         with self.assertRaisesRegex(Exception, expected_message):
             self.service.buy_an_equity(user_id=1, equity_id=1, num_of_shares=100,
                                        time_stamp=current_time_stamp)
 
+    def test_buy_an_equity_for_unknown_user(self):
+        expected_message = 'No such user exists'
+        current_time_stamp = '10/12/2021 16:00:01'
+        self.service.user_repository.get_user.return_value = None
+        self.service.user_repository.debit_balance.return_value = False
+        self.service.equity_repository.get_equity.return_value = Equity(1, 'mocked', 10)
+        with self.assertRaisesRegex(Exception, expected_message):
+            self.service.buy_an_equity(user_id=1, equity_id=1, num_of_shares=100,
+                                       time_stamp=current_time_stamp)
+        self.service.map_repository.upsert_position.assert_not_called()
+
     def test_buy_more_existing_equity_with_sufficient_funds(self):
         expected_message = 'Equity bought successfully'
         current_time_stamp = '10/12/2021 16:00:01'
-        self.service.user_repository.get_user.return_value = (1, 'mocked', 1100)
-        self.service.equity_repository.get_equity.return_value = (1, 'mocked', 10)
-        self.service.map_repository.get_user_equity_mapping_id.return_value = 1
+        self.service.user_repository.get_user.return_value = User(1, 'mocked', 1100)
+        self.service.equity_repository.get_equity.return_value = Equity(1, 'mocked', 10)
         actual_message = self.service.buy_an_equity(user_id=1, equity_id=1, num_of_shares=100,
                                                     time_stamp=current_time_stamp)
         self.assertEqual(actual_message, expected_message)
+        self.service.user_repository.debit_balance.assert_called_once_with(1, 1000)
+        self.service.map_repository.upsert_position.assert_called_once_with(1, 1, 100)
 
     def test_buy_an_equity_for_the_first_time_with_sufficient_funds(self):
         expected_message = 'Equity bought successfully'
         current_time_stamp = '10/12/2021 16:00:01'
-        self.service.user_repository.get_user.return_value = (1, 'mocked', 1100)
-        self.service.equity_repository.get_equity.return_value = (1, 'mocked', 10)
-        self.service.map_repository.get_user_equity_mapping_id.return_value = None
+        self.service.user_repository.get_user.return_value = User(1, 'mocked', 1100)
+        self.service.equity_repository.get_equity.return_value = Equity(1, 'mocked', 10)
         actual_message = self.service.buy_an_equity(user_id=1, equity_id=1, num_of_shares=100,
                                                     time_stamp=current_time_stamp)
         self.assertEqual(actual_message, expected_message)
@@ -101,7 +114,8 @@ class TestBrokingService(TestCase):
     def test_sell_non_holding_equity(self):
         expected_message = 'User does not have selected equity'
         current_time_stamp = '10/12/2021 16:00:01'
-        self.service.map_repository.get_user_equity_mapping_id.return_value = None
+        self.service.map_repository.remove_shares.return_value = False
+        self.service.map_repository.get_position.return_value = None
         with self.assertRaisesRegex(Exception, expected_message):
             self.service.sell_an_equity(user_id=1, equity_id=1, num_of_shares=100,
                                         time_stamp=current_time_stamp)
@@ -109,8 +123,8 @@ class TestBrokingService(TestCase):
     def test_sell_an_equity_with_insufficient_shares(self):
         expected_message = 'Insufficient shares to sell'
         current_time_stamp = '10/12/2021 16:00:01'
-        self.service.map_repository.get_user_equity_mapping_id.return_value = 1
-        self.service.map_repository.get_user_equity.return_value = (1, 1, 1, 99)
+        self.service.map_repository.remove_shares.return_value = False
+        self.service.map_repository.get_position.return_value = Position(1, 1, 1, 99)
         with self.assertRaisesRegex(Exception, expected_message):
             self.service.sell_an_equity(user_id=1, equity_id=1, num_of_shares=100,
                                         time_stamp=current_time_stamp)
@@ -118,8 +132,7 @@ class TestBrokingService(TestCase):
     def test_sell_an_equity_with_sufficient_shares(self):
         expected_message = 'Equity sold successfully'
         current_time_stamp = '10/12/2021 16:00:01'
-        self.service.map_repository.get_user_equity_mapping_id.return_value = 1
-        self.service.map_repository.get_user_equity.return_value = (1, 1, 1, 199)
+        self.service.equity_repository.get_equity.return_value = Equity(1, 'mocked', 10)
         actual_message = self.service.sell_an_equity(user_id=1, equity_id=1, num_of_shares=100,
                                                      time_stamp=current_time_stamp)
         self.assertEqual(actual_message, expected_message)
@@ -127,27 +140,30 @@ class TestBrokingService(TestCase):
     def test_sell_all_the_shares_of_an_equity(self):
         expected_message = 'Equity sold successfully'
         current_time_stamp = '10/12/2021 16:00:01'
-        self.service.map_repository.get_user_equity_mapping_id.return_value = 1
-        self.service.map_repository.get_user_equity.return_value = (1, 1, 1, 100)
+        self.service.equity_repository.get_equity.return_value = Equity(1, 'mocked', 10)
         actual_message = self.service.sell_an_equity(user_id=1, equity_id=1, num_of_shares=100,
                                                      time_stamp=current_time_stamp)
         self.assertEqual(actual_message, expected_message)
+        self.service.map_repository.remove_shares.assert_called_once_with(1, 1, 100)
+        self.service.user_repository.credit_balance.assert_called_once_with(1, 1000)
 
     def test_add_funds(self):
         expected_message = 'User balance updated successfully'
-        self.service.user_repository.get_user.return_value = (1, 'mocked', 1000)
+        self.service.user_repository.credit_balance.return_value = True
         actual_message = self.service.add_fund(user_id=1, amount=1000)
         self.assertEqual(actual_message, expected_message)
+        self.service.user_repository.credit_balance.assert_called_once_with(1, 1000)
 
     def test_add_funds_with_negative_amount(self):
         expected_message = 'Negative amount cannot be added'
-        self.service.user_repository.update_user.return_value = False
+        self.service.user_repository.credit_balance.return_value = False
         with self.assertRaisesRegex(Exception, expected_message):
             self.service.add_fund(user_id=1, amount=-1000)
 
     def test_add_funds_with_some_error(self):
         expected_message = 'Some error occurred while updating user balance'
-        self.service.user_repository.update_user.return_value = False
+        self.service.user_repository.get_user.return_value = User(1, 'mocked', 1000)
+        self.service.user_repository.credit_balance.return_value = False
         with self.assertRaisesRegex(Exception, expected_message):
             self.service.add_fund(user_id=1, amount=1000)
 
@@ -159,6 +175,73 @@ class TestBrokingService(TestCase):
 
     def test_get_balance(self):
         expected_amount = 1000
-        self.service.user_repository.get_user.return_value = (1, 'mocked', expected_amount)
+        self.service.user_repository.get_user.return_value = User(1, 'mocked', expected_amount)
         actual_amount = self.service.get_balance(user_id=99999)
         self.assertEqual(expected_amount, actual_amount)
+
+    def test_execute_orders(self):
+        time_stamp = '10/12/2021 16:00:01'
+        self.service.user_repository.get_users.return_value = [User(1, 'mocked', 100)]
+        self.service.equity_repository.get_equities.return_value = [Equity(1, 'mocked', 10)]
+        self.service.map_repository.get_positions.return_value = [Position(1, 1, 1, 5)]
+        orders = [
+            {'type': 'buy', 'userId': 1, 'equityId': 1, 'numOfShares': 5, 'timeStamp': time_stamp},
+            {'type': 'buy', 'userId': 1, 'equityId': 1, 'numOfShares': 10, 'timeStamp': time_stamp},
+            {'type': 'sell', 'userId': 1, 'equityId': 1, 'numOfShares': 8, 'timeStamp': time_stamp},
+            {'type': 'addAmount', 'userId': 1, 'amount': 20},
+            {'type': 'sell', 'userId': 1, 'numOfShares': 8, 'timeStamp': time_stamp},
+            {'type': 'addAmount', 'userId': 2, 'amount': 20},
+            {'type': 'sell', 'userId': 1, 'equityId': 1, 'numOfShares': 3, 'timeStamp': time_stamp},
+        ]
+        results = self.service.execute_orders(orders)
+        self.assertEqual(results, [
+            {'message': 'Equity bought successfully'},
+            {'error': 'Insufficient balance to buy'},
+            {'message': 'Equity sold successfully'},
+            {'message': 'User balance updated successfully'},
+            {'error': "'equityId' not found in request"},
+            {'error': 'No such user exists'},
+            {'error': 'Insufficient shares to sell'},
+        ])
+        self.service.user_repository.credit_balances.assert_called_once_with([(1, 50)])
+        self.service.map_repository.upsert_positions.assert_called_once_with([(1, 1, -3)])
+
+    def test_execute_orders_with_invalid_orders(self):
+        orders = [
+            {'type': 'hold', 'userId': 1},
+            {'type': 'buy', 'userId': 1, 'equityId': 1, 'numOfShares': 0, 'timeStamp': '10/12/2021 16:00:01'},
+            {'type': 'sell', 'userId': 1, 'equityId': 1, 'numOfShares': 1, 'timeStamp': '12/12/2021 16:00:01'},
+            {'type': 'addAmount', 'userId': 1, 'amount': -1},
+            {'type': 'transfer'},
+            {'type': 'addAmount', 'userId': 'abc', 'amount': 5},
+        ]
+        results = self.service.execute_orders(orders)
+        self.assertEqual(results, [
+            {'error': 'Unknown order type hold'},
+            {'error': 'Provide minimum one share to buy'},
+            {'error': 'You can only buy an equity between Monday and Friday'},
+            {'error': 'Negative amount cannot be added'},
+            {'error': 'Unknown order type transfer'},
+            {'error': 'Invalid user id abc'},
+        ])
+
+    def test_get_portfolio(self):
+        self.service.map_repository.get_portfolio.return_value = [PortfolioRow(1, 100, 1, 'ITC', 10, 5),
+                                                                PortfolioRow(1, 100, 2, 'TCS', 2, 10)]
+        portfolio = self.service.get_portfolio(user_id=1)
+        self.assertEqual(portfolio['balance'], 100)
+        self.assertEqual(portfolio['holdings'][0], {'equityId': 1, 'name': 'ITC', 'shares': 10, 'price': 5,
+                                                    'marketValue': 50})
+        self.assertEqual(portfolio['holdingsValue'], 70)
+        self.assertEqual(portfolio['netWorth'], 170)
+
+    def test_get_portfolio_without_holdings(self):
+        self.service.map_repository.get_portfolio.return_value = [PortfolioRow(1, 100, None, None, None, None)]
+        portfolio = self.service.get_portfolio(user_id=1)
+        self.assertEqual(portfolio['holdings'], [])
+        self.assertEqual(portfolio['netWorth'], 100)
+
+    def test_get_portfolio_for_unknown_user(self):
+        self.service.map_repository.get_portfolio.return_value = []
+        with self.assertRaisesRegex(Exception, 'No such user exists'):
+            self.service.get_portfolio(user_id=99999)
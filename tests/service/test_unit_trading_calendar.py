@@ -0,0 +1,57 @@
+from unittest import TestCase
+from src.service.trading_calendar import TradingCalendar, format_clock, get_calendar
+
+
+class TestTradingCalendar(TestCase):
+    def setUp(self):
+        self.calendar = TradingCalendar('TEST', sessions={weekday: ('09:15', '15:30') for weekday in range(5)},
+                                        holidays=['2021-12-24'], half_days={'2021-12-31': ('09:15', '13:00')})
+
+    def test_default_calendar_matches_9_to_5_monday_to_friday(self):
+        calendar = get_calendar()
+        self.assertTrue(calendar.check('10/12/2021 09:00:00'))
+        self.assertTrue(calendar.check('10/12/2021 17:00:00'))
+        with self.assertRaisesRegex(Exception, 'You can only buy an equity between 9am and 5pm'):
+            calendar.check('10/12/2021 17:00:01')
+        with self.assertRaisesRegex(Exception, 'You can only buy an equity between Monday and Friday'):
+            calendar.check('11/12/2021 16:00:01')
+
+    def test_session_of_exchange(self):
+        self.assertTrue(self.calendar.check('23/12/2021 15:30:00'))
+        with self.assertRaisesRegex(Exception, 'You can only buy an equity between 9:15am and 3:30pm'):
+            self.calendar.check('23/12/2021 09:14:59')
+
+    def test_holiday(self):
+        with self.assertRaisesRegex(Exception, 'You cannot buy an equity on an exchange holiday'):
+            self.calendar.check('24/12/2021 10:00:00')
+
+    def test_half_day(self):
+        self.assertTrue(self.calendar.check('31/12/2021 12:59:59'))
+        with self.assertRaisesRegex(Exception, 'You can only buy an equity between 9:15am and 1pm'):
+            self.calendar.check('31/12/2021 14:00:00')
+
+    def test_malformed_time_stamp(self):
+        for time_stamp in ('2021-12-10 10:00:00', '10/12/2021 25:00:00', '31/02/2021 10:00:00', None,
+                           '10/12/2021 -1:00:00', '10/12/2021 10: 1:00', '10/12/2021 10:00:+1', '+1/12/2021 10:00:00',
+                           '10/ 1/2021 10:00:00', '10/12/-021 10:00:00'):
+            with self.assertRaisesRegex(ValueError, 'does not match format'):
+                self.calendar.check(time_stamp)
+
+    def test_check_all(self):
+        time_stamps = ['23/12/2021 10:00:00', '24/12/2021 10:00:00', '25/12/2021 10:00:00', '31/12/2021 14:00:00',
+                       '23/12/2021 16:00:00', 'not a time stamp']
+        errors = self.calendar.check_all(time_stamps)
+        self.assertEqual([str(error) if error is not None else None for error in errors[:5]], [
+            None,
+            'You cannot buy an equity on an exchange holiday',
+            'You can only buy an equity between Monday and Friday',
+            'You can only buy an equity between 9:15am and 1pm',
+            'You can only buy an equity between 9:15am and 3:30pm',
+        ])
+        self.assertIsInstance(errors[5], ValueError)
+        self.assertEqual([self.calendar.is_open(time_stamp) for time_stamp in time_stamps],
+                         [True, False, False, False, False, False])
+
+    def test_format_clock(self):
+        self.assertEqual([format_clock(seconds) for seconds in (0, 9 * 3600, 12 * 3600, 13 * 3600 + 1800)],
+                         ['12am', '9am', '12pm', '1:30pm'])
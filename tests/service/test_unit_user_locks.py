@@ -0,0 +1,120 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from setup_db import create_connection, create_tables, fill_testing_data
+from src.persistence.db import BrokingDB
+from src.service.broking import BrokingService
+from src.service.user_locks import USER_LOCK_WAIT, StripedLocks
+
+
+def hold_in_thread(locks, user_ids):
+    """
+    Holds the locks of users on another thread until the returned event is set
+    """
+    held = threading.Event()
+    release = threading.Event()
+
+    def run():
+        with locks.hold(user_ids):
+            held.set()
+            release.wait(5)
+    thread = threading.Thread(target=run)
+    thread.start()
+    held.wait(5)
+    return thread, release
+
+
+class TestStripedLocks(TestCase):
+    def setUp(self):
+        self.locks = StripedLocks(4)
+
+    def test_users_are_striped_by_id(self):
+        self.assertEqual(self.locks.stripe_for(1), self.locks.stripe_for(5))
+        self.assertNotEqual(self.locks.stripe_for(1), self.locks.stripe_for(2))
+        self.assertEqual(self.locks.stripe_for('1'), self.locks.stripe_for(1))
+        with self.assertRaisesRegex(Exception, 'Invalid user id abc'):
+            self.locks.stripe_for('abc')
+        with self.assertRaisesRegex(Exception, 'Provide at least one lock stripe'):
+            StripedLocks(0)
+
+    def test_same_user_waits_and_other_users_do_not(self):
+        thread, release = hold_in_thread(self.locks, [1])
+        other_user = threading.Event()
+        same_user = threading.Event()
+
+        def hold(user_id, event):
+            with self.locks.hold([user_id]):
+                event.set()
+        threads = [threading.Thread(target=hold, args=(2, other_user)),
+                   threading.Thread(target=hold, args=(1, same_user))]
+        for waiting in threads:
+            waiting.start()
+        self.assertTrue(other_user.wait(5))
+        self.assertFalse(same_user.wait(0.05))
+        release.set()
+        self.assertTrue(same_user.wait(5))
+        for waiting in threads + [thread]:
+            waiting.join()
+
+    def test_several_users_are_held_in_stripe_order(self):
+        # both callers hold stripes 1 and 2, they wait for each other instead of locking each other out
+        done = []
+
+        def run(user_ids):
+            for _ in range(200):
+                with self.locks.hold(user_ids):
+                    pass
+            done.append(user_ids)
+        threads = [threading.Thread(target=run, args=([1, 2],)), threading.Thread(target=run, args=([2, 1],))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(done), 2)
+
+    def test_wait_is_recorded(self):
+        count = USER_LOCK_WAIT.count()
+        with self.locks.hold([1, 2]):
+            pass
+        self.assertEqual(USER_LOCK_WAIT.count(), count + 1)
+
+
+class TestUserLocksOfTrades(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        database_file = os.path.join(directory, 'ebroker.db')
+        conn = create_connection(database_file)
+        create_tables(conn)
+        fill_testing_data(conn)
+        conn.close()
+        self.db = BrokingDB(database_file)
+        self.locks = StripedLocks(4)
+        self.service = BrokingService(self.db, user_locks=self.locks)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_concurrent_trades_of_users(self):
+        def add_funds(user_id):
+            for _ in range(20):
+                self.service.add_fund(user_id, 1)
+        threads = [threading.Thread(target=add_funds, args=(user_id,)) for user_id in (1, 1, 2, 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.service.get_balance(1), 10040)
+        self.assertEqual(self.service.get_balance(2), 12040)
+
+    def test_no_lock_is_taken_inside_a_unit_of_work(self):
+        thread, release = hold_in_thread(self.locks, [2])
+        started = time.perf_counter()
+        with self.service.transaction():
+            # the unit of work already holds the database, the trade does not wait for the other thread
+            self.service.add_fund(2, 1)
+        self.assertLess(time.perf_counter() - started, 1)
+        release.set()
+        thread.join()
+        self.assertEqual(self.service.get_balance(2), 12001)